@@ -1,6 +1,8 @@
 import os
 
+from registest.core.cache import is_stale
 from registest.utils.io_utils import load_json, save_json
+from registest.utils.storage import remove_path
 
 
 class FileMetadata:
@@ -11,6 +13,8 @@ class FileMetadata:
         self.registration = {"done": False, "method": None}
         self.shift = {"done": False, "xyz_values": None}
         self.similarity = {"SSIM": None, "NMSE": None}
+        self.output = None
+        self.cache = None
 
     def get_metadata(self):
         return {
@@ -19,15 +23,25 @@ class FileMetadata:
             "registration": self.registration,
             "shift": self.shift,
             "similarity": self.similarity,
+            "output": self.output,
+            "cache": self.cache,
         }
 
 
 class MetadataManager:
-    """Manage a metadata.json file."""
+    """Manage a metadata.json file.
 
-    def __init__(self, folder):
+    New entries are kept in memory and written to disk by batches of
+    `batch_size` entries, or when `flush` is called (also on context exit).
+    Each write is atomic, so an interrupted run leaves the last flushed
+    version of the file instead of a truncated one.
+    """
+
+    def __init__(self, folder, batch_size=1):
         self.folder = folder
         self.filepath = os.path.join(self.folder, "metadata.json")
+        self.batch_size = batch_size
+        self.pending = 0
         self.data = self._load_metadata()
 
     def _load_metadata(self):
@@ -39,12 +53,75 @@ class MetadataManager:
     def save_metadata(self):
         """Save current metadata"""
         save_json(self.data, self.filepath)
+        self.pending = 0
+
+    def flush(self):
+        """Save metadata if some entries are not written yet."""
+        if self.pending:
+            self.save_metadata()
 
-    def add_file_metadata(self, file_metadata: FileMetadata):
-        """Add metadata for a new file"""
-        if file_metadata.path in self.data:
+    def add_file_metadata(self, file_metadata: FileMetadata, overwrite=False):
+        """Add metadata for a new file (or replace it if `overwrite`)"""
+        if file_metadata.path in self.data and not overwrite:
             raise ValueError(
                 f"This key: '{file_metadata.path}' already exist inside '{self.filepath}'."
             )
         self.data[file_metadata.path] = file_metadata.get_metadata()
-        self.save_metadata()
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.save_metadata()
+
+    def is_cached(self, key_path, cache):
+        """Return True if `key_path` exists and was computed with the same cache key."""
+        entry = self.data.get(key_path)
+        if not entry or not entry.get("cache"):
+            return False
+        if entry["cache"]["key"] != cache["key"]:
+            return False
+        return os.path.exists(os.path.join(self.folder, key_path))
+
+    def get_cache_key(self, key_path):
+        """Return the cache key of `key_path`, or None if it has no cache entry."""
+        entry = self.data.get(key_path)
+        if not entry or not entry.get("cache"):
+            return None
+        return entry["cache"]["key"]
+
+    def evict_stale(self, ref_digests):
+        """
+        Remove entries computed from another reference content or RegisTest version.
+
+        The output file of each stale entry is deleted too, with the files
+        listed in its "similarity" "files" (previews of the comparison).
+
+        Parameters
+        ----------
+        ref_digests : dict
+            Content digest of each current reference, by reference basename.
+
+        Returns
+        -------
+        list of str
+            The evicted keys.
+        """
+        stale_keys = []
+        for key_path, entry in self.data.items():
+            if not entry.get("cache"):
+                continue
+            ref_name = os.path.basename(entry["reference_img"])
+            if is_stale(entry["cache"], ref_digests.get(ref_name)):
+                stale_keys.append(key_path)
+        for key_path in stale_keys:
+            entry = self.data.pop(key_path)
+            companions = (entry.get("similarity") or {}).get("files", [])
+            for name in [key_path] + companions:
+                # a file, or a Zarr directory
+                remove_path(os.path.join(self.folder, name))
+        self.pending += len(stale_keys)
+        return stale_keys
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
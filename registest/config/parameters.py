@@ -11,6 +11,16 @@ class Parameters:
         self.dict = self.load_parameters()
         self.transform = self.dict["transform"]
         self.register = self.dict["register"]
+        self.compare = self.dict.get("compare", [])
+        self.output = self.dict.get("output", {})
+        self.storage = self.dict.get("storage", {})
+
+    def get_compare_options(self):
+        """Merge the option dicts of the `compare` section."""
+        options = {}
+        for param in self.compare:
+            options.update(param)
+        return options
 
     def load_parameters(self):
         # Check if the file exists
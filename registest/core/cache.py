@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+
+from registest._version import __version__
+
+
+def file_digest(filepath, chunk_size=2**23):
+    """
+    Hash the content of a file.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the file.
+    chunk_size : int, optional
+        Number of bytes read at once. The default is 8 MB.
+
+    Returns
+    -------
+    str
+        The BLAKE2b hexadecimal digest of the file content.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_entry(ref_digest, operation, params):
+    """
+    Build the cache entry saved with the metadata of an output file.
+
+    Parameters
+    ----------
+    ref_digest : str
+        Content digest of the reference image.
+    operation : str
+        Name of the pipeline stage ("transform", "register" or "compare").
+    params : dict
+        JSON-serializable parameters of the operation.
+
+    Returns
+    -------
+    dict
+        The cache key with the reference digest and RegisTest version used to
+        build it (needed to find stale entries).
+    """
+    content = {
+        "reference": ref_digest,
+        "operation": operation,
+        "params": params,
+        "version": __version__,
+    }
+    key = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+    return {"key": key, "reference_digest": ref_digest, "version": __version__}
+
+
+def is_stale(cache, ref_digest):
+    """Return True if a cache entry was built from another reference or version."""
+    return cache["reference_digest"] != ref_digest or cache["version"] != __version__
@@ -3,7 +3,12 @@
 import os
 
 from registest.config.metadata import MetadataManager
+from registest.core.cache import file_digest
 from registest.utils.io_utils import load_json, load_tiff, save_tiff
+from registest.utils.storage import STORAGE_EXTENSIONS, TiffStorage, path_storage
+
+# Number of new entries kept in memory before rewriting a metadata.json
+METADATA_BATCH_SIZE = 100
 
 
 class ReferenceImg:
@@ -11,6 +16,8 @@ class ReferenceImg:
         """
         Initialize the ReferenceImg object.
 
+        The image data are loaded lazily, at the first access to `data`.
+
         Parameters
         ----------
         filepath : str
@@ -18,23 +25,41 @@ class ReferenceImg:
         """
         self.path = os.path.abspath(filepath)
         self.basename = os.path.basename(self.path).split(".")[0]
-        self.data = self.load()
-
-    def load(self):
+        self.check_path()
+        self._data = None
+        self._digest = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.load()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def digest(self):
+        """Content hash of the image file, used as key of cached results."""
+        if self._digest is None:
+            self._digest = file_digest(self.path)
+        return self._digest
+
+    def unload(self):
+        """Release the image data, they will be loaded again if needed."""
+        self._data = None
+
+    def check_path(self):
         """
-        Load the image file after performing various checks.
-
-        Returns
-        -------
-        ndarray
-            The loaded 3D image data.
+        Check the image file path.
 
         Raises
         ------
         FileNotFoundError
             If the file does not exist.
         ValueError
-            If the file is not a TIFF file or not a 3D image.
+            If the file is not a TIFF file.
         """
         # Check if the file exists
         if not os.path.exists(self.path):
@@ -46,9 +71,30 @@ class ReferenceImg:
                 f"Invalid file format: {self.path}. Expected a .tif or .tiff file."
             )
 
+    def load(self):
+        """
+        Load the image file after performing various checks.
+
+        Uncompressed TIFF files are memory-mapped. The data are read-only, so
+        the products derived from them stay valid for the whole run.
+
+        Returns
+        -------
+        ndarray
+            The loaded 3D image data.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the file does not exist.
+        ValueError
+            If the file is not a TIFF file or not a 3D image.
+        """
+        self.check_path()
+
         # Load the TIFF file
         try:
-            data = load_tiff(self.path)
+            data = load_tiff(self.path, mmap=True)
         except Exception as e:
             raise ValueError(f"Error reading the TIFF file: {e}")
 
@@ -57,7 +103,7 @@ class ReferenceImg:
             raise ValueError(
                 f"The file is not a 3D image. Found {data.ndim} dimensions."
             )
-
+        data.flags.writeable = False
         return data
 
 
@@ -132,6 +178,8 @@ class OutImg:
 class DataManager:
     def __init__(self, output_path: str):
         self.out_folder = OutFolder(output_path)
+        self.metadata = {}  # folder path -> MetadataManager
+        self.storage = TiffStorage()  # backend of the volumes written by stages
         self.ref_list = [ReferenceImg(path) for path in self.find_refs()]
         self.create_ref_symlink()
 
@@ -154,18 +202,55 @@ class DataManager:
                 os.symlink(os.path.abspath(ref.path), symlink_path)
                 print(f"Symbolic link created: {symlink_path}")
 
-    def save_tif(self, data, folder, name):
+    def get_filepath(self, folder, name):
         folder_path = self.out_folder.find_path(folder)
-        if name[-4:] != ".tif":
+        if not name.endswith(STORAGE_EXTENSIONS):
             name = name + ".tif"
         filepath = os.path.join(folder_path, name)
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        save_tiff(data, filepath)
+        return filepath
 
-    def save_metadata(self, metadata, folder):
+    def save_tif(self, data, folder, name):
+        """Save an image with the storage backend and return the number of bytes written."""
+        return self.storage.save(data, self.get_filepath(folder, name))
+
+    def load_tiff(self, path, mmap=False):
+        """
+        Load an image saved by any storage backend.
+
+        With `mmap`, the image is opened without being read all at once:
+        memory-mapped, or a lazy Zarr array (see `open_volume`).
+        """
+        storage = path_storage(path, self.storage)
+        return storage.open(path) if mmap else storage.load(path)
+
+    def get_metadata_manager(self, folder):
         folder_path = self.out_folder.find_path(folder)
-        meta_datam = MetadataManager(folder=folder_path)
-        meta_datam.add_file_metadata(metadata)
+        if folder_path not in self.metadata:
+            self.metadata[folder_path] = MetadataManager(
+                folder=folder_path, batch_size=METADATA_BATCH_SIZE
+            )
+        return self.metadata[folder_path]
+
+    def save_metadata(self, metadata, folder):
+        # Entries of stale or uncached results are replaced when recomputed
+        self.get_metadata_manager(folder).add_file_metadata(metadata, overwrite=True)
+
+    def evict_stale_results(self):
+        """
+        Remove the outputs computed from an older reference content or version.
+        """
+        ref_digests = {os.path.basename(ref.path): ref.digest for ref in self.ref_list}
+        for folder in ["to_register", "shifted", "similarity"]:
+            meta_datam = self.get_metadata_manager(folder)
+            for key_path in meta_datam.evict_stale(ref_digests):
+                print(f"Stale result evicted: {folder}/{key_path}")
+        self.flush_metadata()
+
+    def flush_metadata(self):
+        """Write every pending metadata entry to its metadata.json file."""
+        for meta_datam in self.metadata.values():
+            meta_datam.flush()
 
 
 def get_tif_filepaths(folder_path):
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Default memory cap (bytes) of the volumes held by the I/O queues
+DEFAULT_IO_MEMORY = 2**30
+
+# Worker-side handle on the shared reference: (SharedMemory list, ndarray
+# view or dict of ndarray views)
+_SHARED_REF = None
+
+
+class SharedArray:
+    """Expose a numpy array to worker processes through shared memory."""
+
+    def __init__(self, array):
+        """
+        Copy `array` once into a new shared memory block.
+
+        Parameters
+        ----------
+        array : ndarray
+            The array to share (usually the reference image data).
+        """
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        view[...] = array
+
+    @property
+    def spec(self):
+        """Picklable description used by workers to attach the block."""
+        return (self.shm.name, self.shape, self.dtype)
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def attach_shared_array(spec):
+    """Worker initializer: map the shared reference without copying it."""
+    global _SHARED_REF
+    specs = spec if isinstance(spec, dict) else {None: spec}
+    shms, views = [], {}
+    for key, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        shms.append(shm)
+        views[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        views[key].flags.writeable = False  # jobs only read the reference
+    _SHARED_REF = (shms, views if isinstance(spec, dict) else views[None])
+
+
+def _run_on_shared_ref(func, job):
+    return func(_SHARED_REF[1], **job)
+
+
+def run_jobs(func, ref_data, jobs, workers=1):
+    """
+    Run `func(ref_data, **job)` for every job and yield results in job order.
+
+    With more than one worker, jobs are fanned out to a process pool and the
+    reference is handed over through shared memory instead of being pickled
+    for each job. Results are still yielded in submission order, so the
+    caller can write metadata, CSV rows or PDF pages deterministically from
+    the main process.
+
+    Parameters
+    ----------
+    func : callable
+        Module-level function (picklable) taking the reference as first argument.
+    ref_data : ndarray or dict of ndarray
+        The reference image data, or several arrays derived from it (each
+        one is shared).
+    jobs : list of dict
+        Keyword arguments of each call.
+    workers : int, optional
+        Number of worker processes. The default is 1 (serial execution).
+
+    Yields
+    ------
+    Any
+        The return value of each job, in the same order as `jobs`.
+    """
+    from tqdm import tqdm
+
+    if workers <= 1 or len(jobs) <= 1:
+        for job in tqdm(jobs):
+            yield func(ref_data, **job)
+        return
+
+    with ExitStack() as stack:
+        if isinstance(ref_data, dict):
+            spec = {
+                key: stack.enter_context(SharedArray(array)).spec
+                for key, array in ref_data.items()
+            }
+        else:
+            spec = stack.enter_context(SharedArray(ref_data)).spec
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)),
+            initializer=attach_shared_array,
+            initargs=(spec,),
+        ) as pool:
+            futures = [pool.submit(_run_on_shared_ref, func, job) for job in jobs]
+            try:
+                for future in tqdm(futures):
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+
+class Prefetcher:
+    """Load the next items in background threads while the current one is processed.
+
+    Items are yielded in order with their loaded data. At most `depth` items
+    are read ahead, and only while they fit in `max_bytes` (an item still
+    loading counts as the largest one loaded so far). An error raised by
+    `load` is raised again when its item is reached.
+    """
+
+    def __init__(self, items, load, depth=2, max_bytes=DEFAULT_IO_MEMORY):
+        """
+        Parameters
+        ----------
+        items : iterable
+            Items to load, e.g. file paths.
+        load : callable
+            Function loading an item (a file read releases the GIL).
+        depth : int, optional
+            Maximum number of items read ahead. The default is 2.
+        max_bytes : int, optional
+            Memory cap of the items read ahead. The default is 1 GiB.
+        """
+        self.items = items
+        self.load = load
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+
+    def ahead_bytes(self, pending):
+        """Memory of the items read ahead of the next one to yield.
+
+        Items still loading count as the largest item loaded so far.
+        """
+        for _, future in pending:
+            if future.done() and not future.exception():
+                nbytes = getattr(future.result(), "nbytes", 0)
+                self.item_bytes = max(self.item_bytes, nbytes)
+        return sum(
+            (
+                getattr(future.result(), "nbytes", 0)
+                if future.done() and not future.exception()
+                else self.item_bytes
+            )
+            for _, future in list(pending)[1:]
+        )
+
+    def __iter__(self):
+        items = iter(self.items)
+        pending = deque()
+        exhausted = False
+        self.item_bytes = 0
+        with ThreadPoolExecutor(max_workers=self.depth) as pool:
+            try:
+                while True:
+                    while not exhausted and len(pending) <= self.depth:
+                        if pending:
+                            # The next item is needed first: its size bounds the others
+                            wait([pending[0][1]])
+                            expected = self.ahead_bytes(pending) + self.item_bytes
+                            if expected > self.max_bytes:
+                                break
+                        try:
+                            item = next(items)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        pending.append((item, pool.submit(self.load, item)))
+                    if not pending:
+                        return
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+
+class WriteBehind:
+    """Run write tasks in a background thread, in submission order.
+
+    `submit` returns at once unless `max_pending` tasks or `max_bytes` of
+    data are already waiting, then it waits for the oldest ones. The first
+    error of a task is raised by the next `submit` or by `close`, so a
+    failed write stops the caller.
+    """
+
+    def __init__(self, max_pending=2, max_bytes=DEFAULT_IO_MEMORY):
+        self.max_pending = max(1, max_pending)
+        self.max_bytes = max_bytes
+        self.pending = deque()  # (future, nbytes)
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def pending_bytes(self):
+        return sum(nbytes for _, nbytes in self.pending)
+
+    def wait_oldest(self):
+        future, _ = self.pending.popleft()
+        future.result()
+
+    def check(self):
+        """Raise the error of a finished task, if any."""
+        while self.pending and self.pending[0][0].done():
+            self.wait_oldest()
+
+    def submit(self, func, *args, nbytes=0, **kwargs):
+        """
+        Queue `func(*args, **kwargs)`.
+
+        Parameters
+        ----------
+        nbytes : int, optional
+            Memory held by the task until it is done, e.g. the size of the
+            image to write. The default is 0.
+        """
+        self.check()
+        while self.pending and (
+            len(self.pending) >= self.max_pending
+            or self.pending_bytes + nbytes > self.max_bytes
+        ):
+            self.wait_oldest()
+        self.pending.append((self.pool.submit(func, *args, **kwargs), nbytes))
+
+    def close(self):
+        """Wait for all the tasks and raise the first error."""
+        try:
+            while self.pending:
+                self.wait_oldest()
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the first error: finish the running write, drop the others
+            self.pool.shutdown(wait=True, cancel_futures=True)
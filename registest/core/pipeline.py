@@ -1,26 +1,363 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
-from tqdm import tqdm
-
+from registest.config.metadata import FileMetadata
 from registest.config.parameters import Parameters
+from registest.core.cache import file_digest, make_cache_entry
 from registest.core.data_manager import DataManager, get_target_paths, remove_ext
-from registest.modules.comparison import Compare, add_page_pdf, normalize_image
-from registest.modules.registration import Register
-from registest.modules.transformation import Transform
-from registest.utils.io_utils import load_tiff, save_png
-from registest.utils.visualization import visu_rgb_2d, visu_rgb_slice
+from registest.core.parallel import DEFAULT_IO_MEMORY, Prefetcher, WriteBehind, run_jobs
+from registest.modules.comparison import Compare, PdfReport
+from registest.modules.reporting import ResultsWriter
+from registest.modules.transformation import Transform, spline_coefficients
+from registest.utils.io_utils import TiffFormat, load_npy, save_npy, save_png
+from registest.utils.kernels import normalize_image
+from registest.utils.metrics import DEFAULT_MAX_MEMORY
+from registest.utils.storage import TiffStorage, get_storage, load_volume, open_volume
+from registest.utils.visualization import ReferenceOverlay, visu_overlay
+
+
+def write_output(image, out_path, storage):
+    """Save the image of a job and describe the written file for its metadata."""
+    start = time.perf_counter()
+    nbytes = storage.save(image, out_path)
+    return {
+        "bytes": nbytes,
+        "write_time": time.perf_counter() - start,
+        "dtype": image.dtype.name,
+    }
+
+
+def print_write_stats(outputs):
+    """Print the bytes written by a stage and the write throughput."""
+    outputs = [output for output in outputs if output]
+    if not outputs:
+        return
+    megabytes = sum(output["bytes"] for output in outputs) / 2**20
+    seconds = sum(output["write_time"] for output in outputs)
+    rate = megabytes / seconds if seconds > 0 else float("inf")
+    print(
+        f"Written: {len(outputs)} files, {megabytes:.1f} MB in {seconds:.2f} s ({rate:.1f} MB/s)"
+    )
+
+
+def shift_reference(
+    ref_data,
+    xyz,
+    method="scipy",
+    interpolation="auto",
+    order=3,
+    dtype=None,
+    storage=None,
+):
+    """Shifted reference and its Transform; with `dtype`, `ref_data` holds its spline coefficients."""
+    storage = storage or TiffStorage()
+    transform_mod = Transform(
+        method=method, xyz_shifts=xyz, interpolation=interpolation, order=order
+    )
+    transformed_img = transform_mod.execute(
+        ref_data,
+        prefiltered=dtype is not None,
+        dtype=storage.tiff_format.out_dtype(dtype or ref_data.dtype),
+    )
+    return transform_mod, transformed_img
+
+
+def transform_job(ref_data, out_path, ref_path, storage=None, **transform):
+    """Shift the reference; with `dtype`, `ref_data` holds its spline coefficients."""
+    storage = storage or TiffStorage()
+    transform_mod, transformed_img = shift_reference(
+        ref_data, storage=storage, **transform
+    )
+    metad = transform_mod.generate_metadata(os.path.basename(out_path), ref_path)
+    metad.output = write_output(transformed_img, out_path, storage)
+    return metad
+
+
+# Register objects reused by the jobs of a process, so that the reference
+# spectrum of `global_pyhim` is computed once per reference and not per target.
+REGISTER_CACHE = {}
+
+
+def register_image(
+    ref_data, target, method, options=None, storage=None, label=None, products=None
+):
+    """Registered target and its Register object (kept in REGISTER_CACHE)."""
+    # scipy.fft and scikit-image are only needed by the register stage
+    from registest.modules.registration import Register
+
+    # One object per setting, so settings can run in parallel threads
+    key = (method, label, json.dumps(options, sort_keys=True))
+    if key not in REGISTER_CACHE:
+        REGISTER_CACHE[key] = Register(method, options=options)
+    reg_mod = REGISTER_CACHE[key]
+    storage = storage or TiffStorage()
+    registered_img = reg_mod.execute(
+        ref_data,
+        target,
+        dtype=storage.tiff_format.out_dtype(target.dtype),
+        products=products,
+    )
+    return reg_mod, registered_img
+
+
+def registration_metadata(reg_mod, out_path, ref_path, label=None):
+    if reg_mod.export_field:
+        reg_mod.save_field(f"{remove_ext(out_path)}_blocks.csv")
+    metad = reg_mod.generate_metadata(os.path.basename(out_path), ref_path=ref_path)
+    if label:
+        metad.registration["label"] = label
+    return metad
+
+
+def register_target(ref_data, target, registrations, ref_path, storage=None, threads=1):
+    """
+    Register one target with every method of `registrations`.
+
+    The methods share the products of the target (spectrum, float32
+    cast...), computed once.
+
+    Parameters
+    ----------
+    ref_data : ndarray
+        The reference.
+    target : ndarray
+        The target, loaded once.
+    registrations : list of dict
+        "method", "options", "label" and "out_path" of each registration.
+    ref_path : str
+        Path of the reference, saved in the metadata.
+    storage : TiffStorage, optional
+        Backend of the registered volumes (sets their dtype).
+    threads : int, optional
+        Number of methods run at the same time in threads (the FFTs and
+        SimpleITK release the GIL). The default is 1.
+
+    Yields
+    ------
+    tuple
+        (registration metadata, registered image), in the order of
+        `registrations`.
+    """
+    from registest.modules.registration import TargetProducts
+
+    products = TargetProducts(target)
+
+    def register(registration):
+        reg_mod, registered_img = register_image(
+            ref_data,
+            target,
+            registration["method"],
+            registration["options"],
+            storage,
+            label=registration["label"],
+            products=products,
+        )
+        metad = registration_metadata(
+            reg_mod, registration["out_path"], ref_path, registration["label"]
+        )
+        return metad, registered_img
+
+    if threads <= 1 or len(registrations) == 1:
+        for registration in registrations:
+            yield register(registration)
+        return
+    with ThreadPoolExecutor(min(threads, len(registrations))) as pool:
+        yield from pool.map(register, registrations)
+
+
+def register_job(ref_data, targ_path, registrations, ref_path, storage=None, threads=1):
+    """Load a target once, register it with every method and write the results."""
+    storage = storage or TiffStorage()
+    target = load_volume(targ_path, mmap=True, storage=storage)
+    results = []
+    for registration, (metad, registered_img) in zip(
+        registrations,
+        register_target(ref_data, target, registrations, ref_path, storage, threads),
+    ):
+        metad.output = write_output(registered_img, registration["out_path"], storage)
+        results.append(metad)
+    return results
+
+
+PREVIEW_DEFAULTS = {"preview_slices": 8, "preview_format": "png", "html": False}
+
+# Reference products of the compare stage, computed once per process
+COMPARE_CACHE = {}
+
+
+def reference_overlay(ref_data):
+    """Overlay products of the (normalized) reference, shared by every target."""
+    overlay = COMPARE_CACHE.get("overlay")
+    if overlay is None or not overlay.matches(ref_data):
+        COMPARE_CACHE["overlay"] = ReferenceOverlay(ref_data)
+    return COMPARE_CACHE["overlay"]
+
+
+def compare_image(
+    ref_data,
+    target,
+    targ_path,
+    out_folder,
+    img_2d_path,
+    max_memory,
+    metric="ssim_nmse",
+    preview_slices=8,
+    preview_format="png",
+    html=False,
+):
+    """Similarity report of a target and its overlay images, `ref_data` is normalized."""
+    target = normalize_image(target)
+    comp_mod = Compare(max_memory=max_memory, metric=metric)
+    start = time.perf_counter()
+    report = comp_mod.execute(ref_data, target)
+    report["comparison_time"] = time.perf_counter() - start
+    report["method"] = "unknown"
+    report["target"] = targ_path
+    # Plotting
+    path_base = os.path.join(out_folder, os.path.basename(targ_path))
+    project = visu_overlay(
+        ref_data,
+        target,
+        path_base,
+        n_slices=preview_slices,
+        fmt=preview_format,
+        html=html,
+        reference=reference_overlay(ref_data),
+    )
+    save_png(project, img_2d_path)
+    # Files of the target besides `img_2d_path`, removed with its cache entry
+    report["files"] = [
+        os.path.basename(path)
+        for path, saved in [
+            (f"{path_base}_preview.{preview_format}", preview_slices > 0),
+            (f"{path_base}.html", html),
+        ]
+        if saved
+    ]
+    return report
+
+
+def compare_job(ref_data, targ_path, storage=None, **compare):
+    # Normalized chunk by chunk: a Zarr target is never read all at once
+    target = open_volume(targ_path, storage)
+    return compare_image(ref_data, target, targ_path, **compare)
+
+
+def fused_job(
+    ref_data,
+    ref_path,
+    transform,
+    registrations,
+    compare,
+    save=False,
+    storage=None,
+    threads=1,
+):
+    """
+    Transform, register and compare one shift without reading files back.
+
+    Parameters
+    ----------
+    ref_data : dict of ndarray
+        "image" (the reference), "normalized" (the normalized reference) and
+        "coefficients" (its spline coefficients, for the jobs with a `dtype`).
+    ref_path : str
+        Path of the reference, saved in the metadata.
+    transform : dict
+        Keyword arguments of `shift_reference` and "out_path".
+    registrations : list of dict
+        "method", "options", "label", "out_path" and "img_2d_path" of each
+        registration of the shifted reference.
+    compare : dict
+        Other keyword arguments of `compare_image`.
+    save : bool, optional
+        Write the shifted and registered volumes to their "out_path".
+        The default is False.
+    storage : TiffStorage, optional
+        Backend of the saved volumes.
+    threads : int, optional
+        Registrations run at the same time (see `register_target`).
+
+    Returns
+    -------
+    tuple
+        (transform metadata, [(registration metadata, report), ...])
+    """
+    storage = storage or TiffStorage()
+    transform = dict(transform)
+    out_path = transform.pop("out_path")
+    source = ref_data["coefficients" if transform.get("dtype") else "image"]
+    transform_mod, transformed_img = shift_reference(
+        source, storage=storage, **transform
+    )
+    transform_metad = transform_mod.generate_metadata(
+        os.path.basename(out_path), ref_path
+    )
+    if save:
+        transform_metad.output = write_output(transformed_img, out_path, storage)
+    results = []
+    registered = register_target(
+        ref_data["image"], transformed_img, registrations, ref_path, storage, threads
+    )
+    for registration, (metad, registered_img) in zip(registrations, registered):
+        reg_path = registration["out_path"]
+        metad.transformation = transform_metad.transformation
+        if save:
+            metad.output = write_output(registered_img, reg_path, storage)
+        report = compare_image(
+            ref_data["normalized"],
+            registered_img,
+            reg_path,
+            img_2d_path=registration["img_2d_path"],
+            **compare,
+        )
+        results.append((metad, report))
+    return transform_metad, results
 
 
 class Pipeline:
-    def __init__(self, datam: DataManager, params: Parameters, raw_cmd_list: str):
+    def __init__(
+        self,
+        datam: DataManager,
+        params: Parameters,
+        raw_cmd_list: str,
+        workers: int = 1,
+        use_cache: bool = True,
+        keep_spline: bool = False,
+        fused: bool = False,
+        save_intermediate: bool = False,
+        prefetch: int = 2,
+        io_memory: int = DEFAULT_IO_MEMORY,
+        register_threads: int = 1,
+        html: bool = False,
+    ):
         self.datam = datam
         self.params = params
         self.ref = self.datam.ref_list[0]
         self.default_cmds = ["transform", "register", "compare"]
         self.commands = self.decode_cmd_list(raw_cmd_list)
+        self.workers = workers
+        self.use_cache = use_cache
+        self.keep_spline = keep_spline
+        self.fused_mode = fused
+        self.save_intermediate = save_intermediate
+        # Serial runs read the next targets and write the outputs in threads
+        self.prefetch = prefetch
+        self.io_memory = io_memory
+        # Registration methods run at the same time on a target
+        self.register_threads = register_threads
+        # Save the HTML overlays, whatever the `compare` section says
+        self.html = html
+        self.tiff_format = TiffFormat(**params.output)
+        storage_options = dict(params.storage)
+        self.export_tiff = storage_options.pop("export_tiff", False)
+        self.storage = get_storage(tiff_format=self.tiff_format, **storage_options)
+        self.datam.storage = self.storage
+        self.written = []  # volumes written by this run, for the TIFF export
         self.out_transform = "to_register"
         self.update_folder()
 
@@ -46,105 +383,401 @@ class Pipeline:
         return sorted_cmds
 
     def run(self):
+        stages = {
+            "transform": ("\n[Transformation]", self.transform),
+            "register": ("\n[Registration]", self.register),
+            "compare": ("\n[Comparison]", self.compare),
+            "fused": ("\n[Transformation + Registration + Comparison]", self.fused),
+        }
+        commands = self.commands
+        if self.fused_mode:
+            if commands == self.default_cmds:
+                commands = ["fused"]
+            else:
+                print("The fused mode needs the transform,register,compare commands.")
+        for cmd in commands:
+            title, stage = stages[cmd]
+            print(title)
+            try:
+                for ref in self.datam.ref_list:
+                    self.ref = ref
+                    print(f"Reference image: {self.ref.path}")
+                    stage()
+                    self.ref.unload()
+            finally:
+                # Next stage reads metadata.json, and a failed stage should
+                # keep track of the files already written.
+                self.datam.flush_metadata()
+        if self.export_tiff:
+            self.export_written()
 
-        if "transform" in self.commands:
-            print("\n[Transformation]")
-            for ref in self.datam.ref_list:
-                self.ref = ref
-                print(f"Reference image: {self.ref.path}")
-                self.transform()
-        if "register" in self.commands:
-            print("\n[Registration]")
-            for ref in self.datam.ref_list:
-                self.ref = ref
-                print(f"Reference image: {self.ref.path}")
-                self.register()
-        if "compare" in self.commands:
-            print("\n[Comparison]")
-            for ref in self.datam.ref_list:
-                self.ref = ref
-                print(f"Reference image: {self.ref.path}")
-                self.compare()
+    def export_written(self):
+        """Export the volumes written by this run to TIFF files next to them."""
+        if self.storage.name == "tiff" or not self.written:
+            return
+        print("\n[TIFF export]")
+        for path in self.written:
+            print(f"Exported: {self.storage.export_tiff(path)}")
 
-    def transform(self):
-        for param in tqdm(self.params.transform):
+    def is_cached(self, folder, key_path, cache):
+        """Return True if `key_path` was already computed with the same cache key."""
+        if not self.use_cache:
+            return False
+        if self.datam.get_metadata_manager(folder).is_cached(key_path, cache):
+            note = ""
+            if folder == "similarity":
+                # Reports are incremental: the row and page were added by that run
+                note = " (kept in the report of an earlier run)"
+            print(f"Cached result reused: {folder}/{key_path}{note}")
+            return True
+        return False
+
+    def target_key(self, folder, targ_path):
+        """Cache key of an input target, or its content hash if it has none."""
+        meta_datam = self.datam.get_metadata_manager(folder)
+        key = meta_datam.get_cache_key(os.path.basename(targ_path))
+        return key if key else file_digest(targ_path)
+
+    def spline_coefficients(self):
+        """
+        Cubic spline coefficients of the reference, computed once per reference.
+
+        With `keep_spline`, they are saved in the `reference` folder next to
+        the reference symlink, and memory-mapped by the next runs as long as
+        the reference content does not change.
+        """
+        if not self.keep_spline:
+            return spline_coefficients(self.ref.data)
+        folder = self.datam.out_folder.reference
+        prefix = f"{self.ref.basename}_spline3_"
+        path = os.path.join(folder, f"{prefix}{self.ref.digest}.npy")
+        if os.path.exists(path):
+            print(f"Spline coefficients reused: {path}")
+            return load_npy(path, mmap=True)
+        for name in os.listdir(folder):
+            if name.startswith(prefix) and name.endswith(".npy"):
+                os.remove(os.path.join(folder, name))
+        coefficients = spline_coefficients(self.ref.data)
+        save_npy(coefficients, path)
+        return coefficients
+
+    def transform_plan(self):
+        """Output name, cache entry and job of each shift of the reference."""
+        plan = []
+        for param in self.params.transform:
             xyz = param["xyz"]
-            transform_mod = Transform(xyz_shifts=xyz)
-            transformed_img = transform_mod.execute(self.ref.data)
-            target_name = f"{self.ref.basename}_{xyz[0]}_{xyz[1]}_{xyz[2]}.tif"
-            self.datam.save_tif(
-                data=transformed_img, folder=self.out_transform, name=target_name
+            method = param.get("method", "scipy")
+            interpolation = param.get("interpolation", "auto")
+            order = param.get("order", 3)
+            name = f"{self.ref.basename}_{xyz[0]}_{xyz[1]}_{xyz[2]}"
+            if method != "scipy":
+                name = f"{name}_{method}"
+            cache = make_cache_entry(
+                self.ref.digest,
+                "transform",
+                {
+                    "method": method,
+                    "xyz": xyz,
+                    "filling_value": "0.0",
+                    "interpolation": interpolation,
+                    "order": order,
+                    **self.tiff_format.cache_params(),
+                },
+            )
+            job = {
+                "xyz": xyz,
+                "method": method,
+                "interpolation": interpolation,
+                "order": order,
+            }
+            # Cubic spline shifts share one prefilter of the reference,
+            # the other paths (integer, FFT, low orders) read the image itself.
+            transform_mod = Transform(
+                method=method, xyz_shifts=xyz, interpolation=interpolation, order=order
+            )
+            if transform_mod.select_path() == "spline3":
+                job["dtype"] = self.ref.data.dtype.str
+            plan.append(
+                {"name": f"{name}{self.storage.ext}", "cache": cache, "job": job}
+            )
+        return plan
+
+    def transform(self):
+        jobs, caches = [], []
+        for item in self.transform_plan():
+            if self.is_cached(self.out_transform, item["name"], item["cache"]):
+                continue
+            out_path = self.datam.get_filepath(self.out_transform, item["name"])
+            jobs.append(
+                dict(
+                    item["job"],
+                    out_path=out_path,
+                    ref_path=self.ref.path,
+                    storage=self.storage,
+                )
+            )
+            caches.append(item["cache"])
+        if not jobs:
+            return
+
+        spline_jobs = [
+            (job, cache) for job, cache in zip(jobs, caches) if "dtype" in job
+        ]
+        other_jobs = [
+            (job, cache) for job, cache in zip(jobs, caches) if "dtype" not in job
+        ]
+        batches = [(self.ref.data, other_jobs)]
+        if spline_jobs:
+            batches.append((self.spline_coefficients(), spline_jobs))
+        outputs = []
+        for ref_data, batch in batches:
+            if not batch:
+                continue
+            batch_jobs = [job for job, _ in batch]
+            results = run_jobs(transform_job, ref_data, batch_jobs, self.workers)
+            for (_, cache), metadata in zip(batch, results):
+                metadata.cache = cache
+                outputs.append(metadata.output)
+                self.datam.save_metadata(metadata, self.out_transform)
+        self.written += [job["out_path"] for job in jobs]
+        print_write_stats(outputs)
+
+    def register_plan(self, targ_name, targ_key):
+        """Output name, cache entry and settings of each registration of a target."""
+        plan = []
+        for param in self.params.register:
+            reg_method = param["method"]
+            # `label` tells apart several settings of the same method
+            label = param.get("label")
+            options = {k: v for k, v in param.items() if k not in ["method", "label"]}
+            suffix = f"{reg_method}_{label}" if label else reg_method
+            cache_params = {"method": reg_method, "target": targ_key}
+            if options:
+                cache_params["options"] = options
+            cache_params.update(self.tiff_format.cache_params())
+            plan.append(
+                {
+                    "name": f"{remove_ext(targ_name)}_{suffix}{self.storage.ext}",
+                    "cache": make_cache_entry(
+                        self.ref.digest, "register", cache_params
+                    ),
+                    "method": reg_method,
+                    "options": options,
+                    "label": label,
+                }
             )
-            metadata = transform_mod.generate_metadata(target_name, self.ref.path)
-            self.datam.save_metadata(metadata, self.out_transform)
+        return plan
 
     def register(self):
+        """
+        Register every target with every method.
+
+        The jobs are planned per target: a target is loaded once, and all
+        its registrations that are not cached run on it.
+        """
         target_paths = get_target_paths(
             self.datam.out_folder.to_register, self.ref.path
         )
 
-        for targ_path in tqdm(target_paths):
-            for param in self.params.register:
-                reg_method = param["method"]
-                reg_mod = Register(reg_method)
-                target = load_tiff(targ_path)
-                registered_img = reg_mod.execute(self.ref.data, target)
-                base = remove_ext(os.path.basename(targ_path))
-                shifted_filepath = f"{base}_{reg_method}.tif"
-                self.datam.save_tif(
-                    data=registered_img,
-                    folder="shifted",
-                    name=shifted_filepath,
+        targ_meta = self.datam.get_metadata_manager("to_register").data
+        jobs, caches, transformations = [], [], []
+        for targ_path in target_paths:
+            targ_key = self.target_key("to_register", targ_path)
+            registrations, job_caches = [], []
+            for item in self.register_plan(os.path.basename(targ_path), targ_key):
+                if self.is_cached("shifted", item["name"], item["cache"]):
+                    continue
+                registrations.append(
+                    {
+                        "method": item["method"],
+                        "options": item["options"],
+                        "label": item["label"],
+                        "out_path": self.datam.get_filepath("shifted", item["name"]),
+                    }
                 )
-                metad = reg_mod.generate_metadata(
-                    shifted_filepath, ref_path=self.ref.path
+                job_caches.append(item["cache"])
+            if not registrations:
+                continue
+            jobs.append(
+                {
+                    "targ_path": targ_path,
+                    "registrations": registrations,
+                    "ref_path": self.ref.path,
+                    "storage": self.storage,
+                    "threads": self.register_threads,
+                }
+            )
+            caches.append(job_caches)
+            targ_entry = targ_meta.get(os.path.basename(targ_path), {})
+            transformations.append(targ_entry.get("transformation"))
+        if not jobs:
+            return
+
+        outputs = []
+        try:
+            if self.workers <= 1 and self.prefetch > 0:
+                self.register_serial(jobs, caches, transformations, outputs)
+            else:
+                results = run_jobs(register_job, self.ref.data, jobs, self.workers)
+                for job_caches, transformation, job_results in zip(
+                    caches, transformations, results
+                ):
+                    for cache, metad in zip(job_caches, job_results):
+                        metad.cache = cache
+                        if transformation:
+                            metad.transformation = transformation
+                        outputs.append(metad.output)
+                        self.datam.save_metadata(metad, "shifted")
+        finally:
+            REGISTER_CACHE.clear()  # release the reference spectra
+        self.written += [
+            registration["out_path"]
+            for job in jobs
+            for registration in job["registrations"]
+        ]
+        print_write_stats(outputs)
+
+    def register_serial(self, jobs, caches, transformations, outputs):
+        """
+        Register the jobs in this process, with the I/O in background threads.
+
+        The next targets are read while the current one is registered, and
+        the registered volumes and their metadata are written behind, in
+        order. A failed read or write stops the stage.
+        """
+        from tqdm import tqdm
+
+        targets = Prefetcher(
+            [job["targ_path"] for job in jobs],
+            self.datam.load_tiff,  # with the storage options of the run
+            depth=self.prefetch,
+            max_bytes=self.io_memory,
+        )
+        with WriteBehind(self.prefetch, self.io_memory) as writer:
+            for job, job_caches, transformation, (_, target) in tqdm(
+                zip(jobs, caches, transformations, targets), total=len(jobs)
+            ):
+                registered = register_target(
+                    self.ref.data,
+                    target,
+                    job["registrations"],
+                    job["ref_path"],
+                    self.storage,
+                    job["threads"],
                 )
-                self.datam.save_metadata(metad, "shifted")
+                for registration, cache, (metad, registered_img) in zip(
+                    job["registrations"], job_caches, registered
+                ):
+                    metad.cache = cache
+                    if transformation:
+                        metad.transformation = transformation
+                    writer.submit(
+                        self.save_volume,
+                        registered_img,
+                        registration["out_path"],
+                        metad,
+                        "shifted",
+                        outputs,
+                        nbytes=registered_img.nbytes,
+                    )
 
-    def compare(self):
-        out_folder = self.datam.out_folder.similarity
-        output_csv = os.path.join(out_folder, "similarity_report.csv")
+    def save_volume(self, image, out_path, metad, folder, outputs):
+        """Write a volume, then record its metadata (called by `WriteBehind`)."""
+        metad.output = write_output(image, out_path, self.storage)
+        outputs.append(metad.output)
+        self.datam.save_metadata(metad, folder)
+
+    def result_row(self, targ_path, report, entry=None):
+        """Similarity result of a target, with its transformation and registration."""
+        if entry is None:
+            entry = self.datam.get_metadata_manager("shifted").data
+            entry = entry.get(os.path.basename(targ_path), {})
+        transformation = entry.get("transformation") or {}
+        registration = entry.get("registration") or {}
+        xyz_transfo = transformation.get("xyz_values") or [None, None, None]
+        xyz_shifts = (entry.get("shift") or {}).get("xyz_values") or [None] * 3
+        return {
+            "reference": self.ref.path,
+            "target": targ_path,
+            "method": registration.get("label")
+            or registration.get("method")
+            or report["method"],
+            "transform_x": xyz_transfo[0],
+            "transform_y": xyz_transfo[1],
+            "transform_z": xyz_transfo[2],
+            "shift_x": xyz_shifts[0],
+            "shift_y": xyz_shifts[1],
+            "shift_z": xyz_shifts[2],
+            "SSIM": report.get("SSIM"),
+            "NMSE": report.get("NMSE"),
+            "registration_time": registration.get("elapsed_time"),
+            "comparison_time": report["comparison_time"],
+        }
+
+    def compare_settings(self):
+        """Keyword arguments of `compare_image` set by the `compare` section."""
+        options = self.params.get_compare_options()
+        max_memory = int(options.get("max_memory_mb", DEFAULT_MAX_MEMORY / 2**20))
+        settings = {
+            "out_folder": self.datam.out_folder.similarity,
+            "max_memory": max_memory * 2**20,
+            "metric": options.get("metric", "ssim_nmse"),
+        }
+        for name, default in PREVIEW_DEFAULTS.items():
+            settings[name] = type(default)(options.get(name, default))
+        if self.html:
+            settings["html"] = True
+        return settings
 
+    def compare_cache(self, targ_key, settings):
+        cache_params = {"target": targ_key}
+        if settings["metric"] != "ssim_nmse":
+            cache_params["metric"] = settings["metric"]
+        # Preview options only in the key when changed, to keep old caches valid
+        cache_params.update(
+            {
+                name: settings[name]
+                for name, default in PREVIEW_DEFAULTS.items()
+                if settings[name] != default
+            }
+        )
+        return make_cache_entry(self.ref.digest, "compare", cache_params)
+
+    def compare(self):
+        settings = self.compare_settings()
         target_paths = get_target_paths(self.datam.out_folder.shifted, self.ref.path)
-        self.ref.data = normalize_image(self.ref.data)
-
-        for targ_path in tqdm(target_paths):
-            target = load_tiff(targ_path)
-            target = normalize_image(target)
-            comp_mod = Compare()
-            report = comp_mod.execute(self.ref.data, target)
-            report["method"] = "unknown"
-            report["target"] = targ_path
-            # Save report to CSV
-            report_df = pd.DataFrame([report])
-            report_df.to_csv(
-                output_csv,
-                mode="a",
-                header=not pd.io.common.file_exists(output_csv),
-                index=False,
-            )
-            print(f"Similarity report saved to {output_csv}")
-            # Plotting
-            visu_rgb_slice(
-                self.ref.data,
-                target,
-                path_to_save=os.path.join(out_folder, os.path.basename(targ_path)),
-            )
-            project = visu_rgb_2d(self.ref.data, target)
-            img_2d_path = os.path.join(
-                out_folder, f"{os.path.basename(targ_path)}_2d.png"
+        jobs, caches = [], []
+        for targ_path in target_paths:
+            cache = self.compare_cache(self.target_key("shifted", targ_path), settings)
+            img_2d_name = f"{os.path.basename(targ_path)}_2d.png"
+            if self.is_cached("similarity", img_2d_name, cache):
+                continue
+            jobs.append(
+                dict(
+                    settings,
+                    targ_path=targ_path,
+                    img_2d_path=os.path.join(settings["out_folder"], img_2d_name),
+                    storage=self.storage,
+                )
             )
-            save_png(project, img_2d_path)
-            add_page_pdf(
-                img_2d_path,
-                os.path.join(out_folder, "similarity_report.pdf"),
-                self.ref.path,
-                targ_path,
-                xyz_transfo=[0, 0, 0],
-                xyz_shifts=[0, 0, 0],
-                ssim=report["SSIM"],
-                nmse=report["NMSE"],
+            caches.append(cache)
+        if not jobs:
+            return
+
+        # Overlay products of the reference are computed once per process (COMPARE_CACHE)
+        ref_data = normalize_image(self.ref.data)
+        try:
+            if self.workers <= 1 and self.prefetch > 0:
+                reports = self.compare_serial(ref_data, jobs)
+            else:
+                reports = run_jobs(compare_job, ref_data, jobs, self.workers)
+            results = (
+                (job["targ_path"], job["img_2d_path"], cache, report, None)
+                for job, cache, report in zip(jobs, caches, reports)
             )
+            self.save_similarity(results)
+        finally:
+            COMPARE_CACHE.clear()
 
         # generate_similarity_report(
         #     self.ref.data, self.datam.out_folder.regis, output_csv
@@ -165,3 +798,160 @@ class Pipeline:
         #         visu_rgb_slice(
         #             self.ref.data, target, comp_method_path + "ref_VS_" + basename
         #         )
+
+    def compare_serial(self, ref_data, jobs):
+        """Compare the jobs in this process, reading the next targets in background threads."""
+        from tqdm import tqdm
+
+        targets = Prefetcher(
+            [job["targ_path"] for job in jobs],
+            self.datam.load_tiff,  # with the storage options of the run
+            depth=self.prefetch,
+            max_bytes=self.io_memory,
+        )
+        for job, (targ_path, target) in tqdm(zip(jobs, targets), total=len(jobs)):
+            compare = {
+                name: value
+                for name, value in job.items()
+                if name not in ["targ_path", "storage"]
+            }
+            yield compare_image(ref_data, target, targ_path, **compare)
+
+    def save_similarity(self, results):
+        """
+        Write the similarity results, the PDF report pages and the metadata.
+
+        Parameters
+        ----------
+        results : iterable of tuple
+            (target path, 2D image path, cache entry, report, metadata entry
+            of the target or None to read it from `shifted/metadata.json`).
+        """
+        out_folder = self.datam.out_folder.similarity
+        pdf_path = os.path.join(out_folder, "similarity_report.pdf")
+        results_writer = ResultsWriter(
+            os.path.join(out_folder, "similarity_report"),
+            fmt=self.params.get_compare_options().get("results_format", "auto"),
+        )
+        with PdfReport(pdf_path) as pdf_report, results_writer:
+            for targ_path, img_2d_path, cache, report, entry in results:
+                row = self.result_row(targ_path, report, entry)
+                results_writer.add(row)
+                pdf_report.add_page(
+                    img_2d_path,
+                    self.ref.path,
+                    targ_path,
+                    xyz_transfo=[
+                        row["transform_x"],
+                        row["transform_y"],
+                        row["transform_z"],
+                    ],
+                    xyz_shifts=[row["shift_x"], row["shift_y"], row["shift_z"]],
+                    ssim=report.get("SSIM"),
+                    nmse=report.get("NMSE"),
+                )
+                metad = FileMetadata(os.path.basename(img_2d_path), self.ref.path)
+                metad.similarity = {
+                    name: value
+                    for name, value in report.items()
+                    if name not in ["method", "target", "comparison_time"]
+                }
+                metad.cache = cache
+                self.datam.save_metadata(metad, "similarity")
+        print(f"PDF report saved to {pdf_path}")
+
+    def fused(self):
+        """
+        Run transform, register and compare shift by shift, in memory.
+
+        Each shifted reference goes straight to every registration method
+        and each registered image to the comparison, without being written
+        and read back. The volumes are saved only with `save_intermediate`.
+        Results are cached like the separate stages: a shift is skipped when
+        all its comparisons are cached.
+        """
+        settings = self.compare_settings()
+        jobs, caches = [], []
+        for item in self.transform_plan():
+            registrations, job_caches = [], []
+            for reg_item in self.register_plan(item["name"], item["cache"]["key"]):
+                compare_cache = self.compare_cache(reg_item["cache"]["key"], settings)
+                img_2d_name = f"{reg_item['name']}_2d.png"
+                if self.is_cached("similarity", img_2d_name, compare_cache):
+                    continue
+                registrations.append(
+                    {
+                        "method": reg_item["method"],
+                        "options": reg_item["options"],
+                        "label": reg_item["label"],
+                        "out_path": self.datam.get_filepath(
+                            "shifted", reg_item["name"]
+                        ),
+                        "img_2d_path": os.path.join(
+                            settings["out_folder"], img_2d_name
+                        ),
+                    }
+                )
+                job_caches.append((reg_item["cache"], compare_cache))
+            if not registrations:
+                continue
+            jobs.append(
+                {
+                    "ref_path": self.ref.path,
+                    "transform": dict(
+                        item["job"],
+                        out_path=self.datam.get_filepath(
+                            self.out_transform, item["name"]
+                        ),
+                    ),
+                    "registrations": registrations,
+                    "compare": settings,
+                    "save": self.save_intermediate,
+                    "storage": self.storage,
+                    "threads": self.register_threads,
+                }
+            )
+            caches.append((item["cache"], job_caches))
+        if not jobs:
+            return
+
+        ref_data = {
+            "image": self.ref.data,
+            "normalized": normalize_image(self.ref.data),
+        }
+        if any("dtype" in job["transform"] for job in jobs):
+            ref_data["coefficients"] = self.spline_coefficients()
+        outputs = []
+        try:
+            results = run_jobs(fused_job, ref_data, jobs, self.workers)
+            self.save_similarity(self.fused_results(jobs, caches, results, outputs))
+        finally:
+            REGISTER_CACHE.clear()
+            COMPARE_CACHE.clear()
+        print_write_stats(outputs)
+
+    def fused_results(self, jobs, caches, results, outputs):
+        """Save the metadata of the fused jobs and yield their similarity results."""
+        for job, (transform_cache, job_caches), (transform_metad, reg_results) in zip(
+            jobs, caches, results
+        ):
+            if job["save"]:
+                transform_metad.cache = transform_cache
+                outputs.append(transform_metad.output)
+                self.datam.save_metadata(transform_metad, self.out_transform)
+                self.written.append(job["transform"]["out_path"])
+            for registration, (reg_cache, compare_cache), (metad, report) in zip(
+                job["registrations"], job_caches, reg_results
+            ):
+                if job["save"]:
+                    metad.cache = reg_cache
+                    outputs.append(metad.output)
+                    self.datam.save_metadata(metad, "shifted")
+                    self.written.append(registration["out_path"])
+                yield (
+                    registration["out_path"],
+                    registration["img_2d_path"],
+                    compare_cache,
+                    report,
+                    metad.get_metadata(),
+                )
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Registry of the registration, transform and metric methods.
+
+Built-in methods are declared below. External packages add their own
+methods through entry points, one group per kind of method::
+
+    [project.entry-points."registest.registration"]
+    my_method = "my_package.registest_plugin:MY_METHOD"
+
+where `MY_METHOD` is a `MethodSpec`. A method is only a "module:attribute"
+string until it is used, so its heavy dependencies (SimpleITK...) are
+imported at its first use and not when RegisTest starts.
+
+Interface of the loaded objects:
+
+- registration: class built as `cls(ref_3d, **options)`, with a
+  `find_shift(target_3d)` method returning the (z, x, y) shift to apply to
+  the target. Optional: a `matches(ref_3d)` method telling if the object
+  can be reused for `ref_3d` (else it is built again for each target) and
+  a `report` dict saved in the registration metadata. A class with `shares_products = True` gets
+  `find_shift(target_3d, products)`, where `products` is the
+  `TargetProducts` shared by the methods registering the same target.
+- transform: function `func(array_3d, zxy_shifts, filling_val, mode, order,
+  prefiltered=False, dtype=None)` returning (shifted array, path name).
+- metric: function `func(reference_3d, target_3d, max_memory)` returning a
+  dict of values (at least "SSIM" and "NMSE" for the PDF report).
+"""
+
+import importlib
+from importlib.metadata import entry_points
+
+METHOD_KINDS = ["registration", "transform", "metric"]
+
+# Registry state: {kind: {name: MethodSpec}}
+_METHODS = {kind: {} for kind in METHOD_KINDS}
+_ENTRY_POINTS_LOADED = False
+
+
+class MethodSpec:
+    def __init__(
+        self,
+        kind: str,
+        name: str,
+        target: str,
+        capabilities=(),
+        cost=None,
+        description="",
+    ):
+        """
+        Declare a method.
+
+        Parameters
+        ----------
+        kind : str
+            One of `METHOD_KINDS`.
+        name : str
+            Name used in `parameters.json` and on the command line.
+        target : str
+            "module:attribute" path of the implementation, imported lazily.
+        capabilities : iterable of str, optional
+            What the method can do, e.g. "subpixel", "affine", "local", "threads",
+            or "field" for a registration with `save_field(path)`.
+        cost : dict, optional
+            Cost hints: "memory" in bytes per voxel of the image and "time"
+            relative to `global_pyhim` (registration) or `scipy` (transform).
+        description : str, optional
+            One line description.
+        """
+        if kind not in METHOD_KINDS:
+            raise ValueError(
+                f"Unknown method kind '{kind}', use one of {METHOD_KINDS}."
+            )
+        self.kind = kind
+        self.name = name
+        self.target = target
+        self.capabilities = tuple(capabilities)
+        self.cost = dict(cost or {})
+        self.description = description
+        self._loaded = None
+
+    def load(self):
+        """Import and return the implementation (cached)."""
+        if self._loaded is None:
+            module_name, attr = self.target.split(":")
+            self._loaded = getattr(importlib.import_module(module_name), attr)
+        return self._loaded
+
+    def has(self, capability):
+        return capability in self.capabilities
+
+    def __repr__(self):
+        return f"MethodSpec({self.kind!r}, {self.name!r}, {self.target!r})"
+
+
+BUILTIN_METHODS = [
+    MethodSpec(
+        "registration",
+        "global_pyhim",
+        "registest.modules.registration:ReferenceSpectrum",
+        capabilities=["translation", "subpixel"],
+        cost={"memory": 32, "time": 1.0},
+        description="Phase correlation of the whole volume.",
+    ),
+    MethodSpec(
+        "registration",
+        "global_sitk",
+        "registest.modules.sitk_registration:SitkRegistration",
+        capabilities=["translation", "affine", "subpixel", "threads"],
+        cost={"memory": 8, "time": 5.0},
+        description="SimpleITK intensity-based registration.",
+    ),
+    MethodSpec(
+        "registration",
+        "pyramid_pyhim",
+        "registest.modules.registration:ReferencePyramid",
+        capabilities=["translation", "subpixel", "multiresolution"],
+        cost={"memory": 6, "time": 0.15},
+        description="Coarse-to-fine phase correlation on a pyramid.",
+    ),
+    MethodSpec(
+        "registration",
+        "blocks_pyhim",
+        "registest.modules.registration:BlockRegistration",
+        capabilities=["translation", "subpixel", "local", "threads", "field"],
+        cost={"memory": 32, "time": 1.0},
+        description="Phase correlation of XY blocks combined by median or consensus.",
+    ),
+    MethodSpec(
+        "transform",
+        "scipy",
+        "registest.modules.transformation:shift_3d_array",
+        capabilities=["translation", "subpixel", "integer", "fft", "prefilter"],
+        cost={"memory": 8, "time": 1.0},
+        description="Spline, integer or Fourier shift.",
+    ),
+    MethodSpec(
+        "metric",
+        "ssim_nmse",
+        "registest.utils.metrics:similarity_metrics",
+        capabilities=["streaming"],
+        cost={"memory": 0, "time": 1.0},
+        description="SSIM and normalized MSE computed block by block.",
+    ),
+]
+
+
+def register_method(spec: MethodSpec, replace=False):
+    """Add a method to the registry."""
+    if spec.name in _METHODS[spec.kind] and not replace:
+        raise ValueError(f"The {spec.kind} method '{spec.name}' already exists.")
+    _METHODS[spec.kind][spec.name] = spec
+
+
+def iter_entry_points(group):
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        return eps.select(group=group)
+    return eps.get(group, [])  # Python < 3.10
+
+
+def load_entry_points():
+    """Register the methods of installed plugins (once)."""
+    global _ENTRY_POINTS_LOADED
+    if _ENTRY_POINTS_LOADED:
+        return
+    _ENTRY_POINTS_LOADED = True
+    for kind in METHOD_KINDS:
+        for entry_point in iter_entry_points(f"registest.{kind}"):
+            spec = entry_point.load()
+            if not isinstance(spec, MethodSpec) or spec.kind != kind:
+                raise TypeError(
+                    f"Entry point '{entry_point.name}' of 'registest.{kind}' must be a {kind} MethodSpec."
+                )
+            register_method(spec)
+
+
+def get_method(kind, name):
+    """
+    Return the spec of a method.
+
+    Raises
+    ------
+    NotImplementedError
+        If no built-in or plugin method has this name.
+    """
+    load_entry_points()
+    try:
+        return _METHODS[kind][name]
+    except KeyError:
+        raise NotImplementedError(
+            f"The {kind} method '{name}' is not implemented. Please use a supported method such as {list_methods(kind)}."
+        ) from None
+
+
+def list_methods(kind):
+    """Names of the available methods of a kind."""
+    load_entry_points()
+    return list(_METHODS[kind])
+
+
+for _spec in BUILTIN_METHODS:
+    register_method(_spec)
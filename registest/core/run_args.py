@@ -5,15 +5,20 @@ import os
 from argparse import ArgumentParser
 
 
-def parse_run_args():
-    """Parse run arguments
+def run_arg_parser(parents=()):
+    """Build the parser of the arguments shared by registest and the stage scripts
+
+    Parameters
+    ----------
+    parents : sequence of ArgumentParser, optional
+        Parsers of extra arguments (see `ArgumentParser(parents=...)`).
 
     Returns
     -------
-    ArgumentParser.args
-        An accessor of run arguments
+    ArgumentParser
+        The run argument parser
     """
-    parser = ArgumentParser()
+    parser = ArgumentParser(parents=list(parents))
     parser.add_argument(
         "-R",
         "--reference",
@@ -74,4 +79,239 @@ def parse_run_args():
         help="Registration method name. Default: scipy",
     )
 
-    return parser.parse_args()
+    return parser
+
+
+def compare_arg_parser():
+    """Build the parser of the options of the compare stage
+
+    Returns
+    -------
+    ArgumentParser
+        A parser without help, to use as a parent of the run argument parser
+    """
+    compare = ArgumentParser(add_help=False)
+    compare.add_argument(
+        "--html",
+        action="store_true",
+        help="Also save the interactive HTML overlay of every Z slice (large and slow).",
+    )
+    return compare
+
+
+def parse_run_args():
+    """Parse run arguments of regis_transform and regis_register
+
+    Returns
+    -------
+    ArgumentParser.args
+        An accessor of run arguments
+    """
+    return run_arg_parser().parse_args()
+
+
+def parse_compare_args():
+    """Parse run arguments of regis_compare, with the options of the compare stage
+
+    Returns
+    -------
+    ArgumentParser.args
+        An accessor of run arguments
+    """
+    return run_arg_parser([compare_arg_parser()]).parse_args()
+
+
+def parse_pipeline_args():
+    """Parse run arguments of registest, with the options of the pipeline
+
+    Returns
+    -------
+    ArgumentParser.args
+        An accessor of run arguments
+    """
+    pipeline = ArgumentParser(add_help=False)
+    pipeline.add_argument(
+        "-W",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used by each stage.\nDEFAULT: 1",
+    )
+    pipeline.add_argument(
+        "--register-threads",
+        type=int,
+        default=1,
+        help="Number of registration methods run at the same time on a target, in threads.\nDEFAULT: 1",
+    )
+    pipeline.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="With one worker, number of targets read ahead and outputs written behind in background threads (0 disables).\nDEFAULT: 2",
+    )
+    pipeline.add_argument(
+        "--io-memory",
+        type=int,
+        default=1024,
+        help="Memory cap in MB of the volumes read ahead, and of those waiting to be written.\nDEFAULT: 1024",
+    )
+    pipeline.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Recompute every result, even those already computed with the same parameters.",
+    )
+    pipeline.add_argument(
+        "--evict-stale",
+        action="store_true",
+        help="Remove results computed from an older reference content or RegisTest version.",
+    )
+    pipeline.add_argument(
+        "--keep-spline",
+        action="store_true",
+        help="Save the spline coefficients of each reference in the `reference` folder to reuse them at the next run.",
+    )
+    pipeline.add_argument(
+        "--fused",
+        action="store_true",
+        help="Transform, register and compare each shift in memory, without writing the intermediate volumes (with the transform,register,compare commands).",
+    )
+    pipeline.add_argument(
+        "--save-intermediate",
+        action="store_true",
+        help="With --fused, also save the shifted and registered volumes.",
+    )
+    return run_arg_parser([pipeline, compare_arg_parser()]).parse_args()
+
+
+def parse_shape(text):
+    """Convert a "ZxXxY" string into a shape tuple."""
+    shape = tuple(int(val) for val in text.lower().split("x"))
+    if len(shape) != 3:
+        raise ValueError(f"Expected a 3D shape like 30x128x128, got '{text}'.")
+    return shape
+
+
+def parse_bench_args(argv=None):
+    """Parse arguments of the registration benchmark
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Arguments to parse. The default is `sys.argv[1:]`.
+
+    Returns
+    -------
+    ArgumentParser.args
+        An accessor of benchmark arguments
+    """
+    parser = ArgumentParser(
+        prog="registest bench",
+        description="Benchmark registration methods on synthetic 3D images.",
+    )
+    parser.add_argument(
+        "-S",
+        "--shapes",
+        type=str,
+        default="30x128x128",
+        help="Comma-separated list of image shapes ZxXxY.\nDEFAULT: 30x128x128",
+    )
+    parser.add_argument(
+        "-M",
+        "--methods",
+        type=str,
+        default=None,
+        help="Comma-separated list of registration methods.\nDEFAULT: all methods",
+    )
+    parser.add_argument(
+        "-N",
+        "--shifts",
+        type=int,
+        default=3,
+        help="Number of random shifts applied to each image.\nDEFAULT: 3",
+    )
+    parser.add_argument(
+        "--max-shift",
+        type=float,
+        default=5.0,
+        help="Maximum absolute shift value (pixel) on each axis.\nDEFAULT: 5.0",
+    )
+    parser.add_argument(
+        "--spots",
+        type=int,
+        default=50,
+        help="Number of PSF spots of each synthetic image.\nDEFAULT: 50",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed, to reproduce the same images and shifts.\nDEFAULT: 0",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=os.getcwd() + os.sep + "bench_results.csv",
+        help="CSV file where benchmark results are appended.\nDEFAULT: ./bench_results.csv",
+    )
+
+    return parser.parse_args(argv)
+
+
+def parse_generate_args(argv=None):
+    """Parse arguments of the synthetic dataset generator
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Arguments to parse. The default is `sys.argv[1:]`.
+
+    Returns
+    -------
+    ArgumentParser.args
+        An accessor of generator arguments
+    """
+    parser = ArgumentParser(
+        prog="regis_generate",
+        description="Generate a synthetic reference and target with PSF spots.",
+    )
+    parser.add_argument(
+        "-F",
+        "--folder",
+        type=str,
+        default=os.getcwd(),
+        help="Output folder of img_ref.tif, target.tif and spots.csv.\nDEFAULT: Current directory",
+    )
+    parser.add_argument(
+        "-S",
+        "--shape",
+        type=str,
+        default="60x256x256",
+        help="Image shape ZxXxY.\nDEFAULT: 60x256x256",
+    )
+    parser.add_argument(
+        "--psf-shape",
+        type=str,
+        default="30x64x64",
+        help="PSF shape ZxXxY.\nDEFAULT: 30x64x64",
+    )
+    parser.add_argument(
+        "--spots",
+        type=int,
+        default=100,
+        help="Number of PSF spots.\nDEFAULT: 100",
+    )
+    parser.add_argument(
+        "--shift-range",
+        type=int,
+        default=4,
+        help="Maximum absolute shift (pixel) of each target spot on each axis.\nDEFAULT: 4",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed, to reproduce the same dataset.\nDEFAULT: 0",
+    )
+
+    return parser.parse_args(argv)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+import numpy as np
+
+from registest._version import __version__
+from registest.core.registry import list_methods
+from registest.core.run_args import parse_bench_args, parse_shape
+from registest.modules.generator import generate_volume
+from registest.modules.registration import Register
+from registest.modules.transformation import Transform
+from registest.utils.kernels import normalize_image
+from registest.utils.metrics import PeakRSS, streaming_similarity, timing_main
+
+
+def random_shifts(rng, n_shifts, max_shift):
+    """Draw `n_shifts` xyz shifts, rounded to 0.01 pixel."""
+    return [
+        [round(float(val), 2) for val in rng.uniform(-max_shift, max_shift, 3)]
+        for _ in range(n_shifts)
+    ]
+
+
+def bench_method(method, ref_3d, ref_norm, target_3d, xyz):
+    """
+    Register one target with one method and measure it.
+
+    Returns
+    -------
+    dict
+        Wall time, peak RSS, recovered shift, shift error and similarity.
+    """
+    reg_mod = Register(method)
+    with PeakRSS() as memory:
+        start = time.perf_counter()
+        registered_img = reg_mod.execute(ref_3d, target_3d)
+        wall_time = time.perf_counter() - start
+    # The shift found should cancel the applied transformation
+    shift_error = float(np.linalg.norm(np.add(reg_mod.xyz_shift, xyz)))
+    ssim_value, nmse_value = streaming_similarity(
+        ref_norm, normalize_image(registered_img), data_range=1.0
+    )
+    return {
+        "shift_x": reg_mod.xyz_shift[0],
+        "shift_y": reg_mod.xyz_shift[1],
+        "shift_z": reg_mod.xyz_shift[2],
+        "shift_error": shift_error,
+        "wall_time": wall_time,
+        "peak_rss_mb": memory.peak / 2**20 if memory.peak else None,
+        "rss_increase_mb": (
+            (memory.peak - memory.baseline) / 2**20 if memory.baseline else None
+        ),
+        "SSIM": round(ssim_value, 6),
+        "NMSE": round(nmse_value, 6),
+    }
+
+
+def run_benchmark(shapes, methods, n_shifts=3, max_shift=5.0, n_spots=50, seed=0):
+    """
+    Benchmark registration methods on synthetic images with known shifts.
+
+    Parameters
+    ----------
+    shapes : list of tuple
+        Shapes (Z, X, Y) of the synthetic reference images.
+    methods : list of str
+        Registration methods to benchmark.
+    n_shifts : int, optional
+        Number of random shifts applied to each reference. The default is 3.
+    max_shift : float, optional
+        Maximum absolute shift on each axis (pixel). The default is 5.0.
+    n_spots : int, optional
+        Number of PSF spots of each reference. The default is 50.
+    seed : int, optional
+        Random seed of images and shifts. The default is 0.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per (shape, shift, method).
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for shape in shapes:
+        print(f"Generating a {shape} reference with {n_spots} spots...")
+        ref_3d = generate_volume(shape, n_spots, rng)
+        ref_norm = normalize_image(ref_3d)
+        for xyz in random_shifts(rng, n_shifts, max_shift):
+            target_3d = Transform(xyz_shifts=xyz).execute(ref_3d)
+            for method in methods:
+                print(f"  {method} on shift {xyz}")
+                row = {
+                    "version": __version__,
+                    "shape": "x".join(str(s) for s in shape),
+                    "n_spots": n_spots,
+                    "seed": seed,
+                    "method": method,
+                    "transform_x": xyz[0],
+                    "transform_y": xyz[1],
+                    "transform_z": xyz[2],
+                }
+                row.update(bench_method(method, ref_3d, ref_norm, target_3d, xyz))
+                rows.append(row)
+    return pd.DataFrame(rows)
+
+
+@timing_main
+def main(argv=None):
+    bench_args = parse_bench_args(argv)
+    shapes = [parse_shape(text) for text in bench_args.shapes.split(",")]
+    methods = (
+        bench_args.methods.split(",")
+        if bench_args.methods
+        else list_methods("registration")
+    )
+    results = run_benchmark(
+        shapes,
+        methods,
+        n_shifts=bench_args.shifts,
+        max_shift=bench_args.max_shift,
+        n_spots=bench_args.spots,
+        seed=bench_args.seed,
+    )
+    results.to_csv(
+        bench_args.output,
+        mode="a",
+        header=not os.path.exists(bench_args.output),
+        index=False,
+    )
+    summary = results.groupby(["shape", "method"])[
+        ["wall_time", "peak_rss_mb", "shift_error", "SSIM"]
+    ].mean()
+    print(summary.to_string())
+    print(f"Benchmark results saved to {bench_args.output}")
+
+
+if __name__ == "__main__":
+    main()
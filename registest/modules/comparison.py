@@ -1,135 +1,135 @@
 import os
-import shutil
-
-import fitz  # PyMuPDF
-import numpy as np
-import pandas as pd
-from PIL import Image
-from skimage.metrics import structural_similarity as ssim
 
 from registest.core.data_manager import ReferenceImg
-from registest.core.run_args import parse_run_args
+from registest.core.registry import get_method
+from registest.core.run_args import parse_compare_args
 from registest.utils.io_utils import save_png
-from registest.utils.metrics import timing_main
-from registest.utils.visualization import visu_rgb_2d, visu_rgb_slice
-
-
-def normalize_image(image):
-    """
-    Normalize the image to the range [0, 1].
-
-    Parameters
-    ----------
-    image : ndarray
-        The input image to normalize.
-
-    Returns
-    -------
-    ndarray
-        The normalized image.
-    """
-    return (image - np.min(image)) / (np.max(image) - np.min(image))
-
-
-def calculate_normalized_mse(image1, image2):
-    """
-    Calculate normalized MSE between two images.
-
-    Parameters
-    ----------
-    image1, image2 : ndarray
-        Two input images to compare (must have the same shape).
-
-    Returns
-    -------
-    float
-        The normalized Mean Squared Error (MSE).
-    """
-    mse = np.mean((image1 - image2) ** 2)
-    return mse
+from registest.utils.kernels import calculate_normalized_mse  # noqa: F401 (re-exported)
+from registest.utils.kernels import normalize_image
+from registest.utils.metrics import DEFAULT_MAX_MEMORY, timing_main
+from registest.utils.visualization import visu_overlay
 
 
 class Compare:
-    def __init__(self) -> None:
-        pass
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY, metric="ssim_nmse") -> None:
+        self.max_memory = max_memory
+        self.metric = metric
 
     def execute(self, reference_3d, target):
-        # Calculate Normalized MSE and SSIM
-        nmse_value = calculate_normalized_mse(reference_3d, target)
-        ssim_value = ssim(reference_3d, target, data_range=1.0)
-        return {
-            "method": "method_name",
-            "target": "target_name",
-            "NMSE": round(nmse_value, 6),
-            "SSIM": round(ssim_value, 6),
+        # Default metric: normalized MSE and SSIM, block by block to bound memory
+        metric_func = get_method("metric", self.metric).load()
+        values = metric_func(reference_3d, target, max_memory=self.max_memory)
+        report = {"method": "method_name", "target": "target_name"}
+        report.update({name: round(value, 6) for name, value in values.items()})
+        return report
+
+
+class PdfReport:
+    """Similarity report kept open during a whole comparison stage.
+
+    Pages are added in memory and the document is written once by `save`,
+    through a temporary file next to the report, instead of rewriting the
+    whole PDF for each target. Leaving a `with` block on an error still
+    saves the pages added so far, like the similarity results and the cache
+    entries of their targets. Without new pages, the report on disk is left
+    unchanged.
+    """
+
+    def __init__(self, pdf_path):
+        import fitz  # PyMuPDF
+
+        self.path = pdf_path
+        self.added = 0
+        # Check if the PDF exists
+        if os.path.exists(pdf_path):
+            self.doc = fitz.open(pdf_path)  # Open existing PDF
+            print(f"Appending new pages to {pdf_path}")
+        else:
+            self.doc = fitz.open()  # Create a new empty PDF
+            print(f"Creating a new PDF as {pdf_path}")
+
+    def add_page(
+        self, img_2d_path, refpath, target_path, xyz_transfo, xyz_shifts, ssim, nmse
+    ):
+        from PIL import Image
+
+        # Sample dictionary with information
+        info_dict = {
+            "Reference Path": refpath,
+            "Target Path": target_path,
+            # "XYZ Transformation": xyz_transfo,
+            # "XYZ Shifts": xyz_shifts,
+            "SSIM": ssim,
+            "NMSE": nmse,
         }
 
+        # Ensure the image exists
+        if not os.path.exists(img_2d_path):
+            raise FileNotFoundError(f"Image not found: {img_2d_path}")
+
+        # Create a new page (A4 size)
+        new_page = self.doc.new_page(width=595, height=842)  # A4 page in points
+        self.added += 1
+
+        # Add an image
+        with Image.open(img_2d_path) as img:
+            img_width, img_height = img.size
+        max_width, max_height = 400, 300  # Max size in points
+        scale = min(max_width / img_width, max_height / img_height)
+
+        # Calculate position (centered)
+        x_pos = (595 - (img_width * scale)) / 2
+        y_pos = 50  # Place image **at the top of the page**
+
+        # Insert the image
+        new_page.insert_image(
+            (x_pos, y_pos, x_pos + img_width * scale, y_pos + img_height * scale),
+            filename=img_2d_path,
+        )
+
+        # Adjust text position **below the image**
+        text_start_y = y_pos + (img_height * scale) + 20  # 20 pts below the image
+        x_text = 50  # Left margin
+
+        # Insert text information
+        for key, value in info_dict.items():
+            new_page.insert_text((x_text, text_start_y), f"{key}: {value}", fontsize=12)
+            text_start_y += 20  # Move down for the next line
+
+    def save(self):
+        """Write the document if pages were added, and close it."""
+        if self.added:
+            # Temporary file next to the report, unique for this process
+            temp_pdf = f"{self.path}.{os.getpid()}.tmp"
+            self.doc.save(temp_pdf)
+            self.doc.close()
+            # Replace the original file with the updated version
+            os.replace(temp_pdf, self.path)
+        else:
+            self.doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
+
 
 def add_page_pdf(
     img_2d_path, pdf_path, refpath, target_path, xyz_transfo, xyz_shifts, ssim, nmse
 ):
-
-    # Sample dictionary with information
-    info_dict = {
-        "Reference Path": refpath,
-        "Target Path": target_path,
-        # "XYZ Transformation": xyz_transfo,
-        # "XYZ Shifts": xyz_shifts,
-        "SSIM": ssim,
-        "NMSE": nmse,
-    }
-
-    # Ensure the image exists
-    if not os.path.exists(img_2d_path):
-        raise FileNotFoundError(f"Image not found: {img_2d_path}")
-
-    # Check if the PDF exists
-    if os.path.exists(pdf_path):
-        doc = fitz.open(pdf_path)  # Open existing PDF
-        print(f"Appending a new page to {pdf_path}")
-    else:
-        doc = fitz.open()  # Create a new empty PDF
-        print(f"Creating a new PDF as {pdf_path}")
-
-    # Create a new page (A4 size)
-    new_page = doc.new_page(width=595, height=842)  # Standard A4 page in points
-
-    # Add an image
-    img = Image.open(img_2d_path)
-    img_width, img_height = img.size
-    max_width, max_height = 400, 300  # Max size in points
-    scale = min(max_width / img_width, max_height / img_height)
-
-    # Calculate position (centered)
-    x_pos = (595 - (img_width * scale)) / 2
-    y_pos = 50  # Place image **at the top of the page**
-
-    # Insert the image
-    new_page.insert_image(
-        (x_pos, y_pos, x_pos + img_width * scale, y_pos + img_height * scale),
-        filename=img_2d_path,
-    )
-
-    # Adjust text position **below the image**
-    text_start_y = y_pos + (img_height * scale) + 20  # 20 pts below the image
-    x_text = 50  # Left margin
-
-    # Insert text information
-    for key, value in info_dict.items():
-        new_page.insert_text((x_text, text_start_y), f"{key}: {value}", fontsize=12)
-        text_start_y += 20  # Move down for the next line
-
-    temp_pdf = "temp_updated.pdf"  # Temporary file
-    # Save the modified PDF
-    doc.save(temp_pdf)
-    doc.close()
-    # Replace the original file with the updated version
-    shutil.move(temp_pdf, pdf_path)
+    """Append a single page to a PDF report (use `PdfReport` for many pages)."""
+    with PdfReport(pdf_path) as report:
+        report.add_page(
+            img_2d_path, refpath, target_path, xyz_transfo, xyz_shifts, ssim, nmse
+        )
 
 
 @timing_main
 def main():
-    run_args = parse_run_args()
+    import pandas as pd
+
+    run_args = parse_compare_args()
     ref_img = ReferenceImg(run_args.reference)
     target_img = ReferenceImg(run_args.target)
     # Normalize the reference and target images
@@ -148,13 +148,12 @@ def main():
     )
     print(f"Similarity report saved to {out_csv}")
     # Plotting
-    visu_rgb_slice(
+    project = visu_overlay(
         ref_img.data,
         target_img.data,
-        path_to_save=os.path.join(run_args.folder, target_img.basename),
+        os.path.join(run_args.folder, target_img.basename),
+        html=run_args.html,
     )
-    project = visu_rgb_2d(ref_img.data, target_img.data)
-    # overlay_uint8 = (project * 255).astype(np.uint8)
     save_png(project, os.path.join(run_args.folder, f"{target_img.basename}_2d.png"))
 
 
@@ -1,16 +1,35 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import random
+import functools
+import os
 
 import numpy as np
 import tifffile
 
+from registest.core.run_args import parse_generate_args, parse_shape
+from registest.utils.metrics import timing_main
+
 
 def save_tiff(image, filename):
     tifffile.imwrite(filename, image, dtype=np.uint16)
 
 
+def gaussian_psf(shape, voxel_size=(0.25, 0.1, 0.1), attenuation_factor=2.0):
+    """
+    Compute a 3D Gaussian PSF as the product of its 1D profiles (no meshgrid).
+    :param shape: 3D image shape (Z, X, Y).
+    :param voxel_size: voxel shape (Z, X, Y) in microns.
+    :return: a float64 3D image with a PSF in center (maximum 1).
+    """
+    z, x, y = (
+        np.exp(-attenuation_factor * (np.linspace(-1, 1, n) * v / min(voxel_size)) ** 2)
+        for n, v in zip(shape, voxel_size)
+    )
+    psf = z[:, None, None] * x[None, :, None] * y[None, None, :]
+    return psf / psf.max()
+
+
 def generate_psf(shape, voxel_size=(0.25, 0.1, 0.1), attenuation_factor=2.0):
     """
     Generate a 3D PSF (Point Spread Function).
@@ -18,20 +37,44 @@ def generate_psf(shape, voxel_size=(0.25, 0.1, 0.1), attenuation_factor=2.0):
     :param voxel_size: voxel shape (Z, X, Y) in microns.
     :return: a 3D image with a PSF in center.
     """
-    z, x, y = shape
-    voxel_z, voxel_x, voxel_y = voxel_size
-    z_coords = np.linspace(-1, 1, z) * voxel_z / min(voxel_size)
-    x_coords = np.linspace(-1, 1, x) * voxel_x / min(voxel_size)
-    y_coords = np.linspace(-1, 1, y) * voxel_y / min(voxel_size)
-    z_grid, x_grid, y_grid = np.meshgrid(z_coords, x_coords, y_coords, indexing="ij")
-
-    # Gaussian
-    psf = np.exp(-attenuation_factor * (z_grid**2 + x_grid**2 + y_grid**2))
+    psf = gaussian_psf(shape, voxel_size, attenuation_factor)
     # Center PSF
-    image = ((psf / psf.max()) * 65535).astype(np.uint16)  # uint16
+    image = (psf * 65535).astype(np.uint16)  # uint16
     return image
 
 
+@functools.lru_cache(maxsize=128)
+def psf_kernel(shape, voxel_size=(0.25, 0.1, 0.1), attenuation_factor=2.0):
+    """
+    Read-only float32 PSF in [0, 65535], cached by shape, voxel size and attenuation.
+    :param shape: tuple, 3D PSF shape (Z, X, Y).
+    :param voxel_size: tuple, voxel shape (Z, X, Y) in microns.
+    :return: a float32 3D image with a PSF in center.
+    """
+    psf = (gaussian_psf(shape, voxel_size, attenuation_factor) * 65535).astype(
+        np.float32
+    )
+    psf.flags.writeable = False
+    return psf
+
+
+def psf_bounds(image_shape, psf_shape, position):
+    """
+    Slices of the image and of the PSF overlapping when the PSF is centered on `position`.
+    :return: (image slices, PSF slices)
+    """
+    image_slices, psf_slices = [], []
+    for size, psf_size, pos in zip(image_shape, psf_shape, position):
+        # Calculate bounds for placement
+        start = max(0, pos - psf_size // 2)
+        end = min(size, pos + psf_size // 2)
+        # Corresponding bounds in the PSF
+        psf_start = max(0, psf_size // 2 - pos)
+        image_slices.append(slice(start, end))
+        psf_slices.append(slice(psf_start, psf_start + max(end - start, 0)))
+    return tuple(image_slices), tuple(psf_slices)
+
+
 def add_psf(image, psf, position=None):
     """
     Adds a PSF to a larger 3D image at the specified position, using sum, mean, or max.
@@ -41,87 +84,151 @@ def add_psf(image, psf, position=None):
                      If None, the PSF is added at the center of the image.
     :return: Updated image with the PSF added.
     """
-    z, x, y = image.shape
-    psf_z, psf_x, psf_y = psf.shape
-
     # Default to the center of the image if no position is specified
     if position is None:
-        position = (z // 2, x // 2, y // 2)
-
-    # Calculate bounds for placement
-    start_z = max(0, position[0] - psf_z // 2)
-    end_z = min(z, position[0] + psf_z // 2)
-    start_x = max(0, position[1] - psf_x // 2)
-    end_x = min(x, position[1] + psf_x // 2)
-    start_y = max(0, position[2] - psf_y // 2)
-    end_y = min(y, position[2] + psf_y // 2)
-
-    # Corresponding bounds in the PSF
-    psf_start_z = max(0, psf_z // 2 - position[0])
-    psf_end_z = psf_start_z + (end_z - start_z)
-    psf_start_x = max(0, psf_x // 2 - position[1])
-    psf_end_x = psf_start_x + (end_x - start_x)
-    psf_start_y = max(0, psf_y // 2 - position[2])
-    psf_end_y = psf_start_y + (end_y - start_y)
+        position = tuple(size // 2 for size in image.shape)
+    image_slices, psf_slices = psf_bounds(image.shape, psf.shape, position)
 
     # Intermediate computation with uint32 to prevent overflow
     combined = image.astype(np.uint32)
     # Combine PSF with the image
-    combined[start_z:end_z, start_x:end_x, start_y:end_y] += psf[
-        psf_start_z:psf_end_z, psf_start_x:psf_end_x, psf_start_y:psf_end_y
-    ].astype(np.uint32)
+    combined[image_slices] += psf[psf_slices].astype(np.uint32)
     # Normalize to maintain proportions
     max_val = max(combined.max(), 65535)
     combined = (combined / max_val * 65535).astype(np.uint16)
     return combined
 
 
-if __name__ == "__main__":
-    # psf1 = generate_psf(
-    #     shape=(60, 128, 128), voxel_size=(0.25, 0.1, 0.1), attenuation_factor=20
-    # )
-    # psf2 = generate_psf(
-    #     shape=(60, 128, 128), voxel_size=(0.25, 0.1, 0.1), attenuation_factor=30
-    # )
-    # save_tiff(psf1, "psf1.tif")
-    # save_tiff(psf2, "psf2.tif")
-    # pos1 = (28, 100, 80)
-    # pos2 = (30, 100, 100)
-    # img_sum = np.ones((60, 256, 256), dtype=np.uint16)
-    # img_sum = add_psf(img_sum, psf1, pos1)
-    # img_sum = add_psf(img_sum, psf2, pos2)
-    # save_tiff(img_sum, "img_sum.tif")
-    n_spots = 100
-    psf_list = [
-        generate_psf(
-            shape=(60, 128, 128),
-            voxel_size=(0.25, 0.1, 0.1),
-            attenuation_factor=random.randint(30, 70),
-        )
-        for _ in range(n_spots)
-    ]
-    psf_pos_list = [
-        (
-            random.randint(5, 55),
-            random.randint(64, 256 - 64),
-            random.randint(64, 256 - 64),
-        )
-        for _ in range(n_spots)
-    ]
-    pos_shifted = []
-    for x, y, z in psf_pos_list:
-        pos_shifted.append(
-            (
-                x + random.randint(-4, 4),
-                y + random.randint(-4, 4),
-                z + random.randint(-4, 4),
+def splat_psfs(
+    shape,
+    positions,
+    attenuation_factors,
+    psf_shape=(30, 64, 64),
+    voxel_size=(0.25, 0.1, 0.1),
+    background=10,
+):
+    """
+    Add many PSFs to a 3D image in one pass, then normalize once.
+
+    Spots are summed in a float32 accumulator with cached PSF kernels, so the
+    cost of each spot is the size of its PSF, not of the whole image.
+    :param shape: 3D image shape (Z, X, Y).
+    :param positions: list of (z, x, y) spot centers.
+    :param attenuation_factors: attenuation factor of each spot.
+    :param psf_shape: shape (Z, X, Y) of each PSF, cropped to the image shape.
+    :param voxel_size: voxel shape (Z, X, Y) in microns.
+    :param background: initial value of every voxel.
+    :return: a uint16 3D image.
+    """
+    psf_shape = tuple(min(p, s) for p, s in zip(psf_shape, shape))
+    image = np.full(shape, background, dtype=np.float32)
+    for position, attenuation in zip(positions, attenuation_factors):
+        psf = psf_kernel(psf_shape, tuple(voxel_size), attenuation)
+        image_slices, psf_slices = psf_bounds(shape, psf_shape, position)
+        image[image_slices] += psf[psf_slices]
+    # Normalize to maintain proportions
+    image *= 65535 / max(float(image.max()), 65535)
+    return image.astype(np.uint16)
+
+
+def draw_spots(shape, n_spots, rng, psf_shape=(30, 64, 64)):
+    """
+    Draw random spot attenuation factors and positions.
+
+    Spots are kept away from the borders, so they are not cut by the image edges.
+    :return: (list of attenuation factors, list of (z, x, y) positions)
+    """
+    psf_shape = tuple(min(p, s) for p, s in zip(psf_shape, shape))
+    attenuations, positions = [], []
+    for _ in range(n_spots):
+        attenuations.append(int(rng.integers(30, 71)))
+        positions.append(
+            tuple(
+                int(rng.integers(p // 4, max(s - p // 4, p // 4 + 1)))
+                for p, s in zip(psf_shape, shape)
             )
         )
-    img_ref = np.ones((60, 256, 256), dtype=np.uint16) * 10
-    target = np.ones((60, 256, 256), dtype=np.uint16) * 10
-    for i in range(n_spots):
-        img_ref = add_psf(img_ref, psf_list[i], psf_pos_list[i])
-        target = add_psf(target, psf_list[i], pos_shifted[i])
-
-    save_tiff(img_ref, "img_ref.tif")
-    save_tiff(target, "target.tif")
+    return attenuations, positions
+
+
+def generate_volume(
+    shape, n_spots, rng=None, psf_shape=(30, 64, 64), voxel_size=(0.25, 0.1, 0.1)
+):
+    """
+    Generate a synthetic 3D image with PSF spots at random positions.
+    :param shape: 3D image shape (Z, X, Y).
+    :param n_spots: number of spots.
+    :param rng: numpy random Generator (or seed) for reproducible volumes.
+    :param psf_shape: shape (Z, X, Y) of each PSF, cropped to the image shape.
+    :param voxel_size: voxel shape (Z, X, Y) in microns.
+    :return: a uint16 3D image.
+    """
+    rng = np.random.default_rng(rng)
+    attenuations, positions = draw_spots(shape, n_spots, rng, psf_shape)
+    return splat_psfs(shape, positions, attenuations, psf_shape, voxel_size)
+
+
+def generate_pair(
+    shape,
+    n_spots,
+    shift_range=4,
+    rng=None,
+    psf_shape=(30, 64, 64),
+    voxel_size=(0.25, 0.1, 0.1),
+):
+    """
+    Generate a reference and a target where each spot is moved by a random shift.
+    :param shape: 3D image shape (Z, X, Y).
+    :param n_spots: number of spots.
+    :param shift_range: maximum absolute shift (pixel) of each spot on each axis.
+    :param rng: numpy random Generator (or seed) for reproducible images.
+    :param psf_shape: shape (Z, X, Y) of each PSF, cropped to the image shape.
+    :param voxel_size: voxel shape (Z, X, Y) in microns.
+    :return: (reference, target, spots) with spots an array of rows
+             (z, x, y, attenuation, dz, dx, dy).
+    """
+    rng = np.random.default_rng(rng)
+    attenuations, positions = draw_spots(shape, n_spots, rng, psf_shape)
+    shifts = rng.integers(-shift_range, shift_range + 1, size=(n_spots, 3))
+    shifted_positions = [
+        tuple(int(p + d) for p, d in zip(pos, shift))
+        for pos, shift in zip(positions, shifts)
+    ]
+    reference = splat_psfs(shape, positions, attenuations, psf_shape, voxel_size)
+    target = splat_psfs(shape, shifted_positions, attenuations, psf_shape, voxel_size)
+    spots = np.column_stack(
+        [np.array(positions).reshape(-1, 3), attenuations, shifts.reshape(-1, 3)]
+    )
+    return reference, target, spots
+
+
+@timing_main
+def main():
+    gen_args = parse_generate_args()
+    os.makedirs(gen_args.folder, exist_ok=True)
+    reference, target, spots = generate_pair(
+        parse_shape(gen_args.shape),
+        gen_args.spots,
+        shift_range=gen_args.shift_range,
+        rng=gen_args.seed,
+        psf_shape=parse_shape(gen_args.psf_shape),
+    )
+    ref_path = os.path.join(gen_args.folder, "img_ref.tif")
+    target_path = os.path.join(gen_args.folder, "target.tif")
+    spots_path = os.path.join(gen_args.folder, "spots.csv")
+    save_tiff(reference, ref_path)
+    save_tiff(target, target_path)
+    np.savetxt(
+        spots_path,
+        spots,
+        fmt="%d",
+        delimiter=",",
+        header="z,x,y,attenuation,dz,dx,dy",
+        comments="",
+    )
+    print(f"Synthetic images saved to {ref_path} and {target_path}")
+    print(f"Spot positions and shifts saved to {spots_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,552 @@
 # -*- coding: utf-8 -*-
 
 import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
-import SimpleITK as sitk
-from skimage.registration import phase_cross_correlation
+import numpy as np
 
 from registest.config.metadata import FileMetadata, MetadataManager
 from registest.core.data_manager import OutImg, ReferenceImg
+from registest.core.registry import BUILTIN_METHODS, get_method
 from registest.core.run_args import parse_run_args
-from registest.modules.transformation import shift_3d_array_subpixel
+from registest.modules.transformation import shift_3d_array
 from registest.utils.metrics import timing_main
 
 
 def phase_cross_correlation_wrapper(ref_3d, target_3d):
+    from skimage.registration import phase_cross_correlation
+
     shift, _, _ = phase_cross_correlation(ref_3d, target_3d, upsample_factor=100)
     return shift
 
 
-def affine_sitk(fixed_image, moving_image):
-    # Convert NumPy arrays to SimpleITK images and cast to Float32
-    fixed_sitk = sitk.GetImageFromArray(fixed_image)
-    moving_sitk = sitk.GetImageFromArray(moving_image)
-    fixed_sitk = sitk.Cast(fixed_sitk, sitk.sitkFloat32)  # Convert to float
-    moving_sitk = sitk.Cast(moving_sitk, sitk.sitkFloat32)  # Convert to float
-    registration = sitk.ImageRegistrationMethod()
-    registration.SetMetricAsMeanSquares()
-    # Optimization
-    registration.SetOptimizerAsRegularStepGradientDescent(
-        learningRate=1.0, minStep=1e-4, numberOfIterations=100
-    )
-    transform = sitk.CenteredTransformInitializer(
-        fixed_sitk,
-        moving_sitk,
-        sitk.AffineTransform(3),
-        sitk.CenteredTransformInitializerFilter.GEOMETRY,
+def array_checksum(array):
+    """Fast checksum of the content of an array, read one plane at a time."""
+    checksum = 1
+    for plane in array:
+        checksum = zlib.adler32(np.ascontiguousarray(plane).view(np.uint8), checksum)
+    return checksum
+
+
+def reference_checksum(ref_3d):
+    """
+    Checksum of a reference, used by the finders to detect in-place changes.
+
+    Read-only references (loaded by `ReferenceImg`, or shared with the
+    workers) can't change in place: they get None and are never read.
+    """
+    return array_checksum(ref_3d) if ref_3d.flags.writeable else None
+
+
+class TargetProducts:
+    """Products of one target shared by the registration methods run on it.
+
+    Each product (spectrum, pyramid, float32 cast...) is built at its first
+    request and kept, so several methods registering the same target compute
+    it once. Products can be requested from several threads.
+    """
+
+    def __init__(self, target_3d):
+        self.target = target_3d
+        self.products = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def get(self, key, build):
+        """Return the product `key`, built by `build()` at the first request."""
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.products:
+                self.products[key] = build()
+        return self.products[key]
+
+    def float32(self):
+        """The target cast to float32."""
+        return self.get("float32", lambda: np.asarray(self.target, dtype=np.float32))
+
+
+class ReferenceSpectrum:
+    """Fourier transform of a reference image, computed once and reused.
+
+    `phase_cross_correlation` transforms both images at each call. Keeping
+    the reference spectrum saves one 3D FFT per target, and the shifts are
+    the same as `phase_cross_correlation_wrapper`.
+    """
+
+    # `find_shift` accepts the `TargetProducts` of the target
+    shares_products = True
+
+    def __init__(self, ref_3d, upsample_factor=100):
+        from scipy import fft
+
+        self.ref = ref_3d
+        self.checksum = reference_checksum(ref_3d)
+        self.upsample_factor = upsample_factor
+        self.freq = fft.fftn(ref_3d)
+        self.report = {}
+
+    def matches(self, ref_3d):
+        """Return True if this spectrum was computed from `ref_3d`, unchanged since."""
+        return ref_3d is self.ref and reference_checksum(ref_3d) == self.checksum
+
+    def find_shift(self, target_3d, products=None):
+        from scipy import fft
+        from skimage.registration import phase_cross_correlation
+
+        if target_3d.shape != self.freq.shape:
+            raise ValueError("images must be same shape")
+        products = products or TargetProducts(target_3d)
+        shift, _, _ = phase_cross_correlation(
+            self.freq,
+            products.get("fftn", lambda: fft.fftn(target_3d)),
+            upsample_factor=self.upsample_factor,
+            space="fourier",
+        )
+        return shift
+
+    def find_shifts(self, targets):
+        """Return the (z, x, y) shift of each target of a batch (one spectrum)."""
+        return [self.find_shift(target_3d) for target_3d in targets]
+
+
+def downsample_2x(image, axes):
+    """Average blocks of 2 voxels along `axes` (odd borders are dropped)."""
+    crop = tuple(
+        slice(0, size - size % 2) if axis in axes else slice(None)
+        for axis, size in enumerate(image.shape)
     )
-    registration.SetInitialTransform(transform, inPlace=False)
-    final_transform = registration.Execute(fixed_sitk, moving_sitk)
-    affine_transform = final_transform.GetBackTransform()  # Extracts the last transform
-    shift_x, shift_y, shift_z = affine_transform.GetTranslation()
-    return [shift_x, shift_y, shift_z]
+    image = image[crop]
+    shape, block_axes = [], []
+    for axis, size in enumerate(image.shape):
+        if axis in axes:
+            shape += [size // 2, 2]
+            block_axes.append(len(shape) - 1)
+        else:
+            shape.append(size)
+    return image.reshape(shape).mean(axis=tuple(block_axes), dtype=np.float32)
+
+
+def build_pyramid(image, min_size=(16, 64, 64), max_levels=4):
+    """
+    Build a coarse-to-fine pyramid of a 3D image.
+
+    Each level halves the axes that stay at least `min_size` long.
+
+    Returns
+    -------
+    list of tuple
+        (level image, (z, x, y) downsampling factors), from full resolution
+        to the coarsest level. The full resolution level is not copied.
+    """
+    levels = [(image, (1, 1, 1))]
+    for _ in range(max_levels):
+        current, factors = levels[-1]
+        axes = [
+            axis
+            for axis, size in enumerate(current.shape)
+            if size // 2 >= min_size[axis]
+        ]
+        if not axes:
+            break
+        factors = tuple(f * 2 if axis in axes else f for axis, f in enumerate(factors))
+        levels.append((downsample_2x(current, axes), factors))
+    return levels
+
+
+def best_window(image, window_shape):
+    """
+    Origin of the `window_shape` window (stepping by half a window) with the
+    highest variance, where phase correlation has the most signal to lock on.
+    """
+    steps = [max(w // 2, 1) for w in window_shape]
+    starts = [
+        sorted({*range(0, size - w + 1, step), size - w})
+        for size, w, step in zip(image.shape, window_shape, steps)
+    ]
+    best, best_var = (0, 0, 0), -1.0
+    for z in starts[0]:
+        for x in starts[1]:
+            for y in starts[2]:
+                window = image[
+                    z : z + window_shape[0],
+                    x : x + window_shape[1],
+                    y : y + window_shape[2],
+                ]
+                var = float(window.var(dtype=np.float64))
+                if var > best_var:
+                    best, best_var = (z, x, y), var
+    return best
+
+
+class ReferencePyramid:
+    """Coarse-to-fine registration against a reference pyramid built once.
+
+    The shift is estimated by phase correlation on the whole coarsest level,
+    then refined at each finer level on a single window around the estimate,
+    so the full resolution volume is never transformed as a whole.
+    """
+
+    # `find_shift` accepts the `TargetProducts` of the target
+    shares_products = True
+
+    def __init__(
+        self,
+        ref_3d,
+        upsample_factor=100,
+        window_shape=(32, 256, 256),
+        min_size=(16, 64, 64),
+        max_levels=4,
+    ):
+        self.ref = ref_3d
+        self.checksum = reference_checksum(ref_3d)
+        self.upsample_factor = upsample_factor
+        self.min_size = min_size
+        self.max_levels = max_levels
+        self.levels = build_pyramid(ref_3d, min_size, max_levels)
+        coarse, factors = self.levels[-1]
+        self.window_shape = tuple(
+            min(w, size) for w, size in zip(window_shape, ref_3d.shape)
+        )
+        # Same window (in full resolution voxels) at every level
+        coarse_window = [max(w // f, 1) for w, f in zip(self.window_shape, factors)]
+        origin = best_window(coarse, coarse_window)
+        self.origin = tuple(o * f for o, f in zip(origin, factors))
+        self.report = {"levels": len(self.levels)}
+
+    def matches(self, ref_3d):
+        """Return True if this pyramid was built from `ref_3d`, unchanged since."""
+        return ref_3d is self.ref and reference_checksum(ref_3d) == self.checksum
+
+    def refine(self, ref_level, targ_level, factors, estimate, upsample_factor):
+        """Refine an estimate (in level voxels) on one window of a level."""
+        from skimage.registration import phase_cross_correlation
+
+        estimate = np.round(estimate).astype(int)
+        origin, stop = [], []
+        for size, w, o, f, e in zip(
+            ref_level.shape, self.window_shape, self.origin, factors, estimate
+        ):
+            # The target window starts at origin - estimate: keep both inside
+            w = min(max(w // f, 1), size - abs(e))
+            if w < 1:
+                return estimate.astype(float)
+            low, high = max(0, e), min(size - w, size - w + e)
+            start = min(max(o // f, low), high)
+            origin.append(start)
+            stop.append(start + w)
+        ref_win = tuple(slice(a, b) for a, b in zip(origin, stop))
+        targ_win = tuple(slice(a - e, b - e) for a, b, e in zip(origin, stop, estimate))
+        residual, _, _ = phase_cross_correlation(
+            ref_level[ref_win],
+            targ_level[targ_win],
+            upsample_factor=upsample_factor,
+            normalization=None,
+        )
+        return estimate + residual
+
+    def find_shift(self, target_3d, products=None):
+        from skimage.registration import phase_cross_correlation
+
+        if target_3d.shape != self.ref.shape:
+            raise ValueError("images must be same shape")
+        products = products or TargetProducts(target_3d)
+        targ_levels = products.get(
+            ("pyramid", tuple(self.min_size), self.max_levels),
+            lambda: build_pyramid(target_3d, self.min_size, self.max_levels),
+        )
+        coarse_ref, coarse_factors = self.levels[-1]
+        # Without finer levels to refine on, the coarse estimate is the result
+        estimate, _, _ = phase_cross_correlation(
+            coarse_ref,
+            targ_levels[-1][0],
+            upsample_factor=self.upsample_factor if len(self.levels) == 1 else 1,
+            normalization=None,
+        )
+        for level in range(len(self.levels) - 2, -1, -1):
+            (ref_level, factors), (targ_level, _) = (
+                self.levels[level],
+                targ_levels[level],
+            )
+            estimate = estimate * np.divide(self.levels[level + 1][1], factors)
+            upsample_factor = self.upsample_factor if level == 0 else 1
+            estimate = self.refine(
+                ref_level, targ_level, factors, estimate, upsample_factor
+            )
+        return estimate
+
+
+def tile_blocks(shape, block_size=256):
+    """
+    Split the XY plane of a 3D image into blocks of about `block_size` pixels.
+
+    Returns
+    -------
+    list of tuple
+        (x slice, y slice) of each block; blocks cover the whole plane.
+    """
+    edges = []
+    for size in shape[1:]:
+        n_blocks = max(1, round(size / block_size))
+        edges.append(np.linspace(0, size, n_blocks + 1).astype(int))
+    return [
+        (slice(int(x0), int(x1)), slice(int(y0), int(y1)))
+        for x0, x1 in zip(edges[0][:-1], edges[0][1:])
+        for y0, y1 in zip(edges[1][:-1], edges[1][1:])
+    ]
+
+
+def combine_shifts(shifts, combine="median", tolerance=1.0):
+    """
+    Combine block shifts into one global shift.
+
+    Parameters
+    ----------
+    shifts : ndarray
+        (n_blocks, 3) array of (z, x, y) block shifts.
+    combine : str, optional
+        "median" (per axis median) or "consensus" (mean of the largest group
+        of blocks agreeing within `tolerance`). The default is "median".
+    tolerance : float, optional
+        Maximum distance (pixel, on each axis) of a block shift to the global
+        shift to count as an inlier. The default is 1.0.
+
+    Returns
+    -------
+    tuple
+        (global shift, boolean inlier mask of the blocks)
+    """
+    shifts = np.asarray(shifts, dtype=float)
+    if combine == "median":
+        shift = np.median(shifts, axis=0)
+        inliers = np.all(np.abs(shifts - shift) <= tolerance, axis=1)
+    elif combine == "consensus":
+        votes = np.all(np.abs(shifts[:, None] - shifts[None]) <= tolerance, axis=2)
+        inliers = votes[np.argmax(votes.sum(axis=1))]
+        shift = shifts[inliers].mean(axis=0)
+    else:
+        raise ValueError(f"Unknown combination '{combine}', use median or consensus.")
+    return shift, inliers
+
+
+class BlockRegistration:
+    """Phase correlation of XY blocks ("X-corr by blocks"), combined into one shift.
+
+    Blocks span the whole Z axis. Their reference spectra are computed once,
+    and blocks are registered on a thread pool (the FFTs release the GIL).
+    The last shift of each block is kept in `field` for export.
+    """
+
+    # `find_shift` accepts the `TargetProducts` of the target
+    shares_products = True
+
+    def __init__(
+        self,
+        ref_3d,
+        block_size=256,
+        combine="median",
+        tolerance=1.0,
+        upsample_factor=100,
+        workers=None,
+    ):
+        self.ref = ref_3d
+        self.checksum = reference_checksum(ref_3d)
+        self.blocks = tile_blocks(ref_3d.shape, block_size)
+        self.combine = combine
+        self.tolerance = tolerance
+        self.upsample_factor = upsample_factor
+        self.workers = workers or min(32, os.cpu_count() or 1)
+        self.field = None
+        self.inliers = None
+        self.report = {}
+        with ThreadPoolExecutor(self.workers) as pool:
+            self.freqs = list(
+                pool.map(
+                    self.block_spectrum,
+                    [ref_3d] * len(self.blocks),
+                    range(len(self.blocks)),
+                )
+            )
+
+    def matches(self, ref_3d):
+        """Return True if these block spectra were computed from `ref_3d`, unchanged since."""
+        return ref_3d is self.ref and reference_checksum(ref_3d) == self.checksum
+
+    def block_spectrum(self, image, index):
+        from scipy import fft
+
+        x_slice, y_slice = self.blocks[index]
+        return fft.fftn(np.asarray(image[:, x_slice, y_slice]))
+
+    def block_shift(self, target_3d, index, products):
+        from skimage.registration import phase_cross_correlation
+
+        x_slice, y_slice = self.blocks[index]
+        spectrum = products.get(
+            ("block_fftn", x_slice.start, x_slice.stop, y_slice.start, y_slice.stop),
+            lambda: self.block_spectrum(target_3d, index),
+        )
+        shift, _, _ = phase_cross_correlation(
+            self.freqs[index],
+            spectrum,
+            upsample_factor=self.upsample_factor,
+            space="fourier",
+        )
+        return shift
+
+    def find_shift(self, target_3d, products=None):
+        if target_3d.shape != self.ref.shape:
+            raise ValueError("images must be same shape")
+        products = products or TargetProducts(target_3d)
+        indexes = range(len(self.blocks))
+        with ThreadPoolExecutor(self.workers) as pool:
+            shifts = list(
+                pool.map(
+                    self.block_shift,
+                    [target_3d] * len(indexes),
+                    indexes,
+                    [products] * len(indexes),
+                )
+            )
+        self.field = np.array(shifts, dtype=float)
+        shift, self.inliers = combine_shifts(self.field, self.combine, self.tolerance)
+        self.report = {"blocks": len(self.blocks), "inliers": int(self.inliers.sum())}
+        return shift
+
+    def save_field(self, path):
+        """
+        Save the last block shifts as CSV, one row per block with its XY
+        bounds, its (x, y, z) shift and whether it agrees with the global shift.
+        """
+        rows = [
+            [x.start, x.stop, y.start, y.stop, shift[1], shift[2], shift[0], inlier]
+            for (x, y), shift, inlier in zip(self.blocks, self.field, self.inliers)
+        ]
+        np.savetxt(
+            path,
+            np.array(rows, dtype=float),
+            fmt=["%d"] * 4 + ["%.4f"] * 3 + ["%d"],
+            delimiter=",",
+            header="x_start,x_stop,y_start,y_stop,shift_x,shift_y,shift_z,inlier",
+            comments="",
+        )
+
+
+def affine_sitk(fixed_image, moving_image, **options):
+    """Return the (x, y, z) shift registering `moving_image` on `fixed_image`."""
+    finder_cls = get_method("registration", "global_sitk").load()
+    zxy = finder_cls(fixed_image, **options).find_shift(moving_image)
+    return [zxy[1], zxy[2], zxy[0]]
+
+
+# Built-in methods of `Register`, plugins are listed by `list_methods("registration")`
+REGISTRATION_METHODS = [
+    spec.name for spec in BUILTIN_METHODS if spec.kind == "registration"
+]
 
 
 class Register:
-    def __init__(self, method="global_pyhim"):
+    def __init__(
+        self, method="global_pyhim", interpolation="auto", order=3, options=None
+    ):
+        """
+        Parameters
+        ----------
+        method : str, optional
+            Name of a registered method (built-in `REGISTRATION_METHODS` or
+            plugin). The default is "global_pyhim".
+        interpolation, order : optional
+            How the shift is applied (see `shift_3d_array`).
+        options : dict, optional
+            Keyword arguments of the method (e.g. `block_size` and `combine`
+            for "blocks_pyhim"). With `"export_field": true`, the block shifts
+            are saved next to the registered image.
+        """
         self.method: str = method
+        self.interpolation: str = interpolation
+        self.order: int = int(order)
+        self.options: dict = dict(options or {})
+        self.export_field: bool = self.options.pop("export_field", False)
+        if self.export_field and not get_method("registration", method).has("field"):
+            raise ValueError(
+                f"The registration method '{method}' has no block field to export."
+            )
         self.zxy_shift = None
         self.xyz_shift = None
+        self.finder = None
+        self.field_path = None
+        self.elapsed_time = None
+        self.shift_path = None
 
-    def execute(self, ref_3d, target_3d):
-        if self.method == "global_pyhim":
-            self.zxy_shift, _, _ = phase_cross_correlation(
-                ref_3d, target_3d, upsample_factor=100
-            )
-            self.xyz_shift = [
-                float(self.zxy_shift[1]),
-                float(self.zxy_shift[2]),
-                float(self.zxy_shift[0]),
-            ]
-            return self.apply(target_3d)
-        elif self.method == "global_sitk":
-            self.xyz_shift = affine_sitk(ref_3d, target_3d)
-            self.zxy_shift = [
-                float(self.xyz_shift[2]),
-                float(self.xyz_shift[0]),
-                float(self.xyz_shift[1]),
-            ]
-            return self.apply(target_3d)
+    def get_finder(self, ref_3d):
+        """
+        Return the reference-derived finder, built at the first call for `ref_3d`.
+
+        A finder without `matches` is rebuilt at each call.
+        """
+        matches = getattr(self.finder, "matches", None)
+        if matches is None or not matches(ref_3d):
+            finder_cls = get_method("registration", self.method).load()
+            self.finder = finder_cls(ref_3d, **self.options)
+        return self.finder
+
+    def save_field(self, path):
+        """Save the block shifts of the last `execute` (blocks_pyhim only)."""
+        self.finder.save_field(path)
+        self.field_path = path
+
+    def execute(self, ref_3d, target_3d, dtype=None, products=None):
+        """
+        Find the shift of `target_3d` and return it registered, in `dtype` if given.
+
+        `products` (a `TargetProducts` of `target_3d`) shares the target
+        spectrum, pyramid or casts with the other methods run on it.
+        """
+        start = time.perf_counter()
+        self.field_path = None
+        finder = self.get_finder(ref_3d)
+        if products is not None and getattr(finder, "shares_products", False):
+            self.zxy_shift = finder.find_shift(target_3d, products=products)
         else:
-            raise NotImplementedError(
-                f"The method '{self.method}' is not implemented. Please use a supported method such as 'global_pyhim' or `global_sitk`."
-            )
+            self.zxy_shift = finder.find_shift(target_3d)
+        self.xyz_shift = [
+            float(self.zxy_shift[1]),
+            float(self.zxy_shift[2]),
+            float(self.zxy_shift[0]),
+        ]
+        registered_img = self.apply(target_3d, dtype=dtype)
+        self.elapsed_time = time.perf_counter() - start
+        return registered_img
 
-    def apply(self, target_3d):
+    def apply(self, target_3d, dtype=None):
         if self.zxy_shift is None:
             raise ValueError
-        return shift_3d_array_subpixel(target_3d, self.zxy_shift)
+        shifted, self.shift_path = shift_3d_array(
+            target_3d,
+            self.zxy_shift,
+            mode=self.interpolation,
+            order=self.order,
+            dtype=dtype,
+        )
+        return shifted
 
     def generate_metadata(self, key_path: str, ref_path):
         metad = FileMetadata(key_path, ref_path)
-        metad.registration = {"done": True, "method": self.method}
+        metad.registration = {
+            "done": True,
+            "method": self.method,
+            "elapsed_time": self.elapsed_time,
+            "interpolation": self.shift_path,
+        }
+        if self.options:
+            metad.registration["options"] = self.options
+        if self.finder is not None:
+            metad.registration.update(getattr(self.finder, "report", {}))
+        if self.field_path:
+            metad.registration["block_field"] = os.path.basename(self.field_path)
         metad.shift = {"done": True, "xyz_values": self.xyz_shift}
         return metad
 
@@ -1,44 +1,133 @@
+import importlib.util
 import os
-
-import numpy as np
-import pandas as pd
-import tifffile
-from skimage.metrics import structural_similarity as ssim
-
-
-def normalize_image(image):
+import time
+
+from registest.utils.kernels import calculate_normalized_mse  # noqa: F401 (re-exported)
+from registest.utils.kernels import normalize_image
+from registest.utils.metrics import streaming_similarity
+
+# Columns of the similarity results and their types
+RESULT_COLUMNS = {
+    "reference": "object",
+    "target": "object",
+    "method": "object",
+    "transform_x": "float64",
+    "transform_y": "float64",
+    "transform_z": "float64",
+    "shift_x": "float64",
+    "shift_y": "float64",
+    "shift_z": "float64",
+    "SSIM": "float64",
+    "NMSE": "float64",
+    "registration_time": "float64",
+    "comparison_time": "float64",
+}
+
+
+def resolve_results_format(fmt="auto"):
     """
-    Normalize the image to the range [0, 1].
+    Choose the file format of the similarity results.
 
     Parameters
     ----------
-    image : ndarray
-        The input image to normalize.
+    fmt : str, optional
+        "auto" (Parquet if pyarrow is installed, else CSV), "parquet" or
+        "csv". The default is "auto".
 
     Returns
     -------
-    ndarray
-        The normalized image.
+    str
+        "parquet" or "csv".
+    """
+    if fmt not in ("auto", "parquet", "csv"):
+        raise ValueError(f"Unknown results format: '{fmt}'. Use auto, parquet or csv.")
+    if fmt == "csv":
+        return fmt
+    if importlib.util.find_spec("pyarrow") is None:
+        if fmt == "parquet":
+            print("pyarrow is not installed: similarity results are saved in CSV.")
+        return "csv"
+    return "parquet"
+
+
+class ResultsWriter:
+    """Buffer similarity results and write them to disk by batches.
+
+    With Parquet, each batch is a new part file inside the
+    `<path_base>.parquet/` dataset directory (read it with
+    `pandas.read_parquet`). With CSV, batches are appended to
+    `<path_base>.csv`; a file with other columns (older version) is first
+    renamed `<path_base>_old-<run>.csv`.
     """
-    return (image - np.min(image)) / (np.max(image) - np.min(image))
 
+    def __init__(self, path_base, fmt="auto", batch_size=1000):
+        self.format = resolve_results_format(fmt)
+        self.path = f"{path_base}.{self.format}"
+        self.batch_size = batch_size
+        self.rows = []
+        self.part = 0
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+    def add(self, row):
+        """Add a result row (missing columns are left empty)."""
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows."""
+        import pandas as pd
+
+        if not self.rows:
+            return
+        results = pd.DataFrame(self.rows, columns=list(RESULT_COLUMNS))
+        results = results.astype(RESULT_COLUMNS)
+        if self.format == "parquet":
+            os.makedirs(self.path, exist_ok=True)
+            name = f"part-{self.run_id}-{self.part:05d}.parquet"
+            # Hidden temporary name: ignored by readers until it is complete
+            temp_path = os.path.join(self.path, f".{name}.tmp")
+            results.to_parquet(temp_path, index=False)
+            os.replace(temp_path, os.path.join(self.path, name))
+        else:
+            if self.part == 0:
+                self.move_other_columns()
+            results.to_csv(
+                self.path,
+                mode="a",
+                header=not os.path.exists(self.path),
+                index=False,
+            )
+        print(f"{len(self.rows)} similarity results saved to {self.path}")
+        self.rows = []
+        self.part += 1
 
-def calculate_normalized_mse(image1, image2):
-    """
-    Calculate normalized MSE between two images.
+    def move_other_columns(self):
+        """Rename an existing CSV file whose header is not `RESULT_COLUMNS`."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as file:
+            header = file.readline().rstrip("\r\n")
+        if header == ",".join(RESULT_COLUMNS):
+            return
+        old_path = f"{self.path[: -len('.csv')]}_old-{self.run_id}.csv"
+        os.replace(self.path, old_path)
+        print(f"{self.path} has other columns: moved to {old_path}")
 
-    Parameters
-    ----------
-    image1, image2 : ndarray
-        Two input images to compare (must have the same shape).
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
 
-    Returns
-    -------
-    float
-        The normalized Mean Squared Error (MSE).
-    """
-    mse = np.mean((image1 - image2) ** 2)
-    return mse
+
+def load_results(path):
+    """Load similarity results saved by `ResultsWriter` (Parquet or CSV)."""
+    import pandas as pd
+
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
 
 
 def generate_similarity_report(reference_3d, registered_dir, output_csv):
@@ -54,6 +143,8 @@ def generate_similarity_report(reference_3d, registered_dir, output_csv):
     output_csv : str
         Path to save the generated CSV report.
     """
+    import pandas as pd
+    import tifffile
 
     if reference_3d.ndim != 3:
         raise ValueError("The reference image must be 3D.")
@@ -87,8 +178,9 @@ def generate_similarity_report(reference_3d, registered_dir, output_csv):
             target = normalize_image(target)
 
             # Calculate Normalized MSE and SSIM
-            mse_value = calculate_normalized_mse(reference_3d, target)
-            ssim_value = ssim(reference_3d, target, data_range=1.0)
+            ssim_value, mse_value = streaming_similarity(
+                reference_3d, target, data_range=1.0
+            )
 
             # Append results
             report_data.append(
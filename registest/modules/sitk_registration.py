@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""SimpleITK registration, imported only when `global_sitk` is used."""
+
+import SimpleITK as sitk
+
+from registest.modules.registration import TargetProducts, reference_checksum
+
+
+class SitkRegistration:
+    """SimpleITK intensity-based registration, tunable from `parameters.json`.
+
+    The reference is converted to a float32 SimpleITK image once. Each call
+    records the number of iterations, the final metric value and the stop
+    condition of the optimizer in `report`.
+    """
+
+    # `find_shift` accepts the `TargetProducts` of the target
+    shares_products = True
+
+    def __init__(
+        self,
+        ref_3d,
+        transform="affine",
+        sampling="none",
+        sampling_percentage=1.0,
+        seed=0,
+        shrink_factors=(1,),
+        smoothing_sigmas=(0,),
+        threads=None,
+        learning_rate=1.0,
+        min_step=1e-4,
+        iterations=100,
+        relaxation_factor=0.5,
+        gradient_tolerance=1e-4,
+    ):
+        """
+        Parameters
+        ----------
+        ref_3d : ndarray
+            The fixed (reference) image.
+        transform : str, optional
+            "affine" or "translation". The default is "affine".
+        sampling : str, optional
+            Metric sampling strategy: "none" (every voxel), "random" or
+            "regular". The default is "none".
+        sampling_percentage : float, optional
+            Fraction of voxels sampled by the metric. The default is 1.0.
+        seed : int, optional
+            Seed of the random sampling. The default is 0.
+        shrink_factors, smoothing_sigmas : list, optional
+            Downsampling factor and Gaussian smoothing (pixel) of each
+            resolution level, from coarse to fine. The default is one level
+            at full resolution.
+        threads : int, optional
+            Number of threads of SimpleITK. The default is SimpleITK's default.
+        learning_rate, min_step, iterations, relaxation_factor, gradient_tolerance : optional
+            Settings of the regular step gradient descent optimizer.
+        """
+        if transform not in ["affine", "translation"]:
+            raise ValueError(
+                f"Unknown transform '{transform}', use affine or translation."
+            )
+        if sampling not in ["none", "random", "regular"]:
+            raise ValueError(
+                f"Unknown sampling '{sampling}', use none, random or regular."
+            )
+        if len(shrink_factors) != len(smoothing_sigmas):
+            raise ValueError("One smoothing sigma is needed per shrink factor.")
+        self.ref = ref_3d
+        self.checksum = reference_checksum(ref_3d)
+        self.transform = transform
+        self.sampling = sampling
+        self.sampling_percentage = sampling_percentage
+        self.seed = seed
+        self.shrink_factors = [int(f) for f in shrink_factors]
+        self.smoothing_sigmas = [float(s) for s in smoothing_sigmas]
+        self.threads = threads
+        self.optimizer = {
+            "learningRate": learning_rate,
+            "minStep": min_step,
+            "numberOfIterations": iterations,
+            "relaxationFactor": relaxation_factor,
+            "gradientMagnitudeTolerance": gradient_tolerance,
+        }
+        self.fixed = sitk.Cast(sitk.GetImageFromArray(ref_3d), sitk.sitkFloat32)
+        self.report = {}
+
+    def matches(self, ref_3d):
+        """Return True if the fixed image was converted from `ref_3d`, unchanged since."""
+        return ref_3d is self.ref and reference_checksum(ref_3d) == self.checksum
+
+    def build_method(self):
+        registration = sitk.ImageRegistrationMethod()
+        registration.SetMetricAsMeanSquares()
+        if self.sampling != "none":
+            strategy = {
+                "random": registration.RANDOM,
+                "regular": registration.REGULAR,
+            }[self.sampling]
+            registration.SetMetricSamplingStrategy(strategy)
+            registration.SetMetricSamplingPercentage(
+                self.sampling_percentage, self.seed
+            )
+        registration.SetShrinkFactorsPerLevel(self.shrink_factors)
+        registration.SetSmoothingSigmasPerLevel(self.smoothing_sigmas)
+        registration.SmoothingSigmasAreSpecifiedInPhysicalUnitsOff()
+        if self.threads:
+            registration.SetNumberOfThreads(int(self.threads))
+        registration.SetOptimizerAsRegularStepGradientDescent(**self.optimizer)
+        # Matrix and translation parameters have very different ranges
+        registration.SetOptimizerScalesFromPhysicalShift()
+        return registration
+
+    def find_shift(self, target_3d, products=None):
+        if target_3d.shape != self.ref.shape:
+            raise ValueError("images must be same shape")
+        # The float32 moving image is shared by the settings run on a target,
+        # built from the float32 cast shared by all methods
+        products = products or TargetProducts(target_3d)
+        moving = products.get(
+            "sitk_float32", lambda: sitk.GetImageFromArray(products.float32())
+        )
+        registration = self.build_method()
+        if self.transform == "affine":
+            initial = sitk.CenteredTransformInitializer(
+                self.fixed,
+                moving,
+                sitk.AffineTransform(3),
+                sitk.CenteredTransformInitializerFilter.GEOMETRY,
+            )
+        else:
+            initial = sitk.TranslationTransform(3)
+        registration.SetInitialTransform(initial, inPlace=False)
+        final_transform = registration.Execute(self.fixed, moving)
+        # Extracts the last transform
+        translation = final_transform.GetBackTransform().GetParameters()[-3:]
+        self.report = {
+            "iterations": registration.GetOptimizerIteration(),
+            "final_metric": registration.GetMetricValue(),
+            "stop_condition": registration.GetOptimizerStopConditionDescription(),
+        }
+        # SimpleITK maps fixed points to moving points in (x, y, z) = numpy
+        # axes (2, 1, 0): the shift to apply to the target is the opposite.
+        return [-translation[2], -translation[1], -translation[0]]
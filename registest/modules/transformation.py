@@ -1,44 +1,289 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from typing import Any, List
+from typing import Any, List, Optional
 
 import numpy as np
-from scipy.ndimage import shift
 
 from registest.config.metadata import FileMetadata, MetadataManager
 from registest.core.data_manager import OutImg, ReferenceImg
+from registest.core.registry import get_method
 from registest.core.run_args import parse_run_args
 from registest.utils.metrics import timing_main
 
+# Interpolation modes of `shift_3d_array`
+SHIFT_MODES = ["auto", "integer", "spline", "fft"]
+SPLINE_ORDERS = [0, 1, 3]
 
-def shift_3d_array_subpixel(array_3d, shift_values, filling_val=0.0):
+
+def is_integer_shift(shift_values, tol=1e-6):
+    """Return True if every shift value is a whole number of pixels."""
+    return all(abs(value - round(value)) <= tol for value in shift_values)
+
+
+def cast_fill_value(filling_val, dtype):
+    """Filling value as stored in an array of `dtype` (NaN becomes 0 for integers)."""
+    if np.issubdtype(dtype, np.integer) and not np.isfinite(filling_val):
+        return 0
+    return filling_val
+
+
+def cast_like(array, dtype):
+    """Cast a float result back to `dtype`, rounding and clipping integer types."""
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        array = np.clip(np.rint(array), info.min, info.max)
+    return array.astype(dtype, copy=False)
+
+
+def integer_shift(array_3d, shift_values, filling_val=0.0):
     """
-    Shifts a 3D numpy array along the Z, X and Y axes with subpixel accuracy.
+    Shift a 3D array by whole pixels with a single slice copy (no interpolation).
 
-    Parameters:
-    array_3d (numpy.ndarray): The 3D array to shift.
-    shift_values (list): A list of three floats representing the shift values for the Z, X and Y axes.
+    Parameters
+    ----------
+    array_3d : ndarray
+        The 3D array to shift.
+    shift_values : list of int
+        Shift values for the Z, X and Y axes.
+    filling_val : float, optional
+        Value of the voxels shifted in from outside. The default is 0.0.
 
-    Returns:
-    numpy.ndarray: The shifted 3D array.
+    Returns
+    -------
+    ndarray
+        The shifted array, with the same dtype as `array_3d`.
+    """
+    shifted = np.full(
+        array_3d.shape, cast_fill_value(filling_val, array_3d.dtype), array_3d.dtype
+    )
+    src, dst = [], []
+    for size, value in zip(array_3d.shape, shift_values):
+        value = int(round(value))
+        if abs(value) >= size:
+            return shifted
+        src.append(slice(max(0, -value), size - max(0, value)))
+        dst.append(slice(max(0, value), size - max(0, -value)))
+    shifted[tuple(dst)] = array_3d[tuple(src)]
+    return shifted
+
+
+def fourier_shift(array_3d, shift_values, filling_val=0.0, dtype=None):
+    """
+    Shift a 3D array with a phase ramp in the Fourier domain.
+
+    The Fourier shift is circular: voxels wrapped around the borders are
+    replaced by `filling_val`, like the constant mode of the spline shift.
+
+    Parameters
+    ----------
+    array_3d : ndarray
+        The 3D array to shift.
+    shift_values : list of float
+        Shift values for the Z, X and Y axes.
+    filling_val : float, optional
+        Value of the voxels shifted in from outside. The default is 0.0.
+    dtype : data-type, optional
+        Data type of the shifted array. The default is the `array_3d` dtype.
+
+    Returns
+    -------
+    ndarray
+        The shifted array.
+    """
+    from scipy import fft
+
+    # Single-threaded: with `--workers`, each process already runs its own FFTs
+    spectrum = fft.rfftn(array_3d)
+    last_axis = array_3d.ndim - 1
+    for axis, (size, value) in enumerate(zip(array_3d.shape, shift_values)):
+        if value == 0:
+            continue
+        freqs = fft.rfftfreq(size) if axis == last_axis else fft.fftfreq(size)
+        ramp = np.exp(-2j * np.pi * value * freqs)
+        spectrum *= ramp.reshape([-1 if i == axis else 1 for i in range(3)])
+    shifted = fft.irfftn(spectrum, s=array_3d.shape)
+    for axis, (size, value) in enumerate(zip(array_3d.shape, shift_values)):
+        index = [slice(None)] * 3
+        if value > 0:
+            index[axis] = slice(0, min(size, int(np.ceil(value))))
+        elif value < 0:
+            index[axis] = slice(max(0, size + int(np.floor(value))), size)
+        else:
+            continue
+        shifted[tuple(index)] = cast_fill_value(filling_val, array_3d.dtype)
+    return cast_like(shifted, np.dtype(dtype or array_3d.dtype))
+
+
+def select_shift_path(shift_values, mode="auto", order=3):
+    """
+    Choose how a shift is applied, without computing it.
+
+    Parameters
+    ----------
+    shift_values : list of float
+        Shift values for the Z, X and Y axes.
+    mode : str, optional
+        "auto", "integer", "spline" or "fft" (see `shift_3d_array`).
+    order : int, optional
+        Order of the spline interpolation (0, 1 or 3). The default is 3.
+
+    Returns
+    -------
+    str
+        "integer", "spline<order>" or "fft".
+    """
+    if mode not in SHIFT_MODES:
+        raise ValueError(f"Unknown shift mode '{mode}', use one of {SHIFT_MODES}.")
+    if order not in SPLINE_ORDERS:
+        raise ValueError(f"Spline order must be one of {SPLINE_ORDERS}.")
+    if mode == "integer" or (mode == "auto" and is_integer_shift(shift_values)):
+        if not is_integer_shift(shift_values):
+            raise ValueError(f"Shift values {shift_values} are not whole pixels.")
+        return "integer"
+    if mode == "fft":
+        return "fft"
+    return f"spline{order}"
+
+
+def spline_coefficients(array_3d, order=3):
+    """
+    Cubic spline prefilter of a 3D array, as computed by each `scipy.ndimage.shift`.
+
+    Shifting these coefficients with `prefilter=False` gives the same result
+    as shifting `array_3d`, so many shifts of one image share one prefilter.
+
+    Parameters
+    ----------
+    array_3d : ndarray
+        The 3D array to interpolate.
+    order : int, optional
+        Order of the spline interpolation. The default is 3.
+
+    Returns
+    -------
+    ndarray
+        The float64 spline coefficients.
+    """
+    from scipy.ndimage import spline_filter
+
+    return spline_filter(array_3d, order, output=np.float64, mode="constant")
+
+
+def shift_3d_array(
+    array_3d,
+    shift_values,
+    filling_val=0.0,
+    mode="auto",
+    order=3,
+    prefiltered=False,
+    dtype=None,
+):
+    """
+    Shift a 3D numpy array along the Z, X and Y axes and tell which path was used.
+
+    Parameters
+    ----------
+    array_3d : ndarray
+        The 3D array to shift, or its spline coefficients if `prefiltered`.
+    shift_values : list of float
+        Shift values for the Z, X and Y axes.
+    filling_val : float, optional
+        Value of the voxels shifted in from outside. The default is 0.0.
+    mode : str, optional
+        "auto" (integer slicing for whole-pixel shifts, spline otherwise),
+        "integer", "spline" or "fft". The default is "auto".
+    order : int, optional
+        Order of the spline interpolation (0, 1 or 3). The default is 3.
+    prefiltered : bool, optional
+        True if `array_3d` holds the output of `spline_coefficients`; only
+        valid for the cubic spline path. The default is False.
+    dtype : data-type, optional
+        Data type of the shifted array. The default is the `array_3d` dtype.
+        A float type keeps the interpolated values of an integer image.
+
+    Returns
+    -------
+    tuple
+        (shifted array, path) with path "integer", "spline<order>" or "fft".
     """
     if not isinstance(array_3d, np.ndarray) or len(array_3d.shape) != 3:
         raise ValueError("Input must be a 3D numpy array.")
     if len(shift_values) != 3:
         raise ValueError("Shift values must be a list of three floats (z,x,y).")
 
-    shift_vector = [shift_values[0], shift_values[1], shift_values[2]]
-    shifted_array = shift(array_3d, shift_vector, mode="constant", cval=filling_val)
+    shift_vector = [float(value) for value in shift_values]
+    path = select_shift_path(shift_vector, mode, order)
+    if path.startswith("spline"):
+        # scipy.ndimage is only imported by the spline path
+        from scipy.ndimage import shift
 
-    return shifted_array
+    if prefiltered:
+        if path != "spline3":
+            raise ValueError(
+                f"Spline coefficients can't be shifted by the {path} path."
+            )
+        shifted_array = shift(
+            array_3d,
+            shift_vector,
+            output=dtype or array_3d.dtype,
+            mode="constant",
+            cval=filling_val,
+            prefilter=False,
+        )
+    elif path == "integer":
+        shifted_array = integer_shift(array_3d, shift_vector, filling_val)
+    elif path == "fft":
+        shifted_array = fourier_shift(array_3d, shift_vector, filling_val, dtype)
+    else:
+        # A float output is interpolated directly, an integer one is rounded below
+        float_output = dtype is not None and np.issubdtype(dtype, np.floating)
+        shifted_array = shift(
+            array_3d,
+            shift_vector,
+            output=dtype if float_output else None,
+            order=order,
+            mode="constant",
+            cval=filling_val,
+        )
+    if dtype is not None and shifted_array.dtype != np.dtype(dtype):
+        shifted_array = cast_like(shifted_array, np.dtype(dtype))
+    return shifted_array, path
+
+
+def shift_3d_array_subpixel(
+    array_3d, shift_values, filling_val=0.0, mode="auto", order=3
+):
+    """
+    Shifts a 3D numpy array along the Z, X and Y axes with subpixel accuracy.
+
+    Parameters:
+    array_3d (numpy.ndarray): The 3D array to shift.
+    shift_values (list): A list of three floats representing the shift values for the Z, X and Y axes.
+    mode (str): "auto", "integer", "spline" or "fft" (see `shift_3d_array`).
+    order (int): Order of the spline interpolation (0, 1 or 3).
+
+    Returns:
+    numpy.ndarray: The shifted 3D array.
+    """
+    return shift_3d_array(array_3d, shift_values, filling_val, mode, order)[0]
 
 
 class Transform:
-    def __init__(self, method="scipy", xyz_shifts=None, filling_value="0.0"):
+    def __init__(
+        self,
+        method="scipy",
+        xyz_shifts=None,
+        filling_value="0.0",
+        interpolation="auto",
+        order=3,
+    ):
         self.method: str = method
         self.xyz_shifts: List[float] = self.cast_shifts(xyz_shifts)
         self.filling_value: Any = self.cast_filling_value(filling_value)
+        self.interpolation: str = interpolation
+        self.order: int = int(order)
+        self.shift_path: Optional[str] = None
 
     def cast_shifts(self, shifts: List[float]):
         if shifts is None:
@@ -53,18 +298,44 @@ class Transform:
         else:
             return float(value)
 
-    def execute(self, img):
-        if self.method == "scipy":
-            zxy = [self.xyz_shifts[2], self.xyz_shifts[0], self.xyz_shifts[1]]
-            return shift_3d_array_subpixel(img, zxy, filling_val=self.filling_value)
-        else:
-            raise NotImplementedError(
-                f"The method '{self.method}' is not implemented. Please use a supported method such as 'scipy'."
-            )
+    @property
+    def zxy_shifts(self):
+        return [self.xyz_shifts[2], self.xyz_shifts[0], self.xyz_shifts[1]]
+
+    def select_path(self):
+        """
+        Interpolation path that `execute` will take, or None if the method
+        can't shift precomputed spline coefficients.
+        """
+        if not get_method("transform", self.method).has("prefilter"):
+            return None
+        return select_shift_path(self.zxy_shifts, self.interpolation, self.order)
+
+    def execute(self, img, prefiltered=False, dtype=None):
+        """
+        Shift `img`, or its cubic spline coefficients if `prefiltered`
+        (then `dtype` is the data type of the original image).
+        """
+        shift_func = get_method("transform", self.method).load()
+        shifted, self.shift_path = shift_func(
+            img,
+            self.zxy_shifts,
+            self.filling_value,
+            self.interpolation,
+            self.order,
+            prefiltered=prefiltered,
+            dtype=dtype,
+        )
+        return shifted
 
     def generate_metadata(self, key_path: str, ref_path):
         metad = FileMetadata(key_path, ref_path)
-        metad.transformation = {"done": True, "xyz_values": self.xyz_shifts}
+        metad.transformation = {
+            "done": True,
+            "method": self.method,
+            "xyz_values": self.xyz_shifts,
+            "interpolation": self.shift_path,
+        }
         return metad
 
 
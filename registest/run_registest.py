@@ -1,22 +1,48 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import sys
 
 from registest.config.parameters import Parameters
 from registest.core.data_manager import DataManager
 from registest.core.pipeline import Pipeline
-from registest.core.run_args import parse_run_args
+from registest.core.run_args import parse_pipeline_args
 from registest.utils.metrics import timing_main
 
 
 @timing_main
-def main():
-    run_args = parse_run_args()
+def run():
+    run_args = parse_pipeline_args()
     datam = DataManager(run_args.folder)
+    if run_args.evict_stale:
+        datam.evict_stale_results()
     params = Parameters(run_args.parameters)
-    pipe = Pipeline(datam, params, run_args.command)
+    pipe = Pipeline(
+        datam,
+        params,
+        run_args.command,
+        workers=run_args.workers,
+        use_cache=not run_args.no_cache,
+        keep_spline=run_args.keep_spline,
+        fused=run_args.fused,
+        save_intermediate=run_args.save_intermediate,
+        prefetch=run_args.prefetch,
+        io_memory=run_args.io_memory * 2**20,
+        register_threads=run_args.register_threads,
+        html=run_args.html,
+    )
     pipe.run()
 
 
+def main():
+    """Run the pipeline, or the benchmark with `registest bench [options]`."""
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        from registest.modules.benchmark import main as bench_main
+
+        bench_main(sys.argv[2:])
+    else:
+        run()
+
+
 if __name__ == "__main__":
     main()
@@ -1,17 +1,185 @@
 import json
+import os
 
 import numpy as np
-import tifffile
-from PIL import Image
-from reportlab.pdfgen import canvas
 
+# tifffile, PIL and reportlab are imported by the functions using them, so
+# importing this module (done by every entry point) stays cheap.
 
-def load_tiff(filepath):
+
+def load_tiff(filepath, mmap=False):
+    """
+    Load a TIFF image.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the TIFF file.
+    mmap : bool, optional
+        Memory-map the image data instead of reading it, so only the planes
+        that are accessed get paged in. Falls back to a regular read when the
+        data are not memory-mappable (compressed or tiled files).
+        The default is False.
+
+    Returns
+    -------
+    ndarray
+        The image data (a read-only `numpy.memmap` when mapped).
+    """
+    import tifffile
+
+    if mmap:
+        try:
+            return tifffile.memmap(filepath, mode="r")
+        except ValueError:
+            pass
     return tifffile.imread(filepath)
 
 
-def save_tiff(image, filepath):
-    tifffile.imwrite(filepath, image)
+OUTPUT_DTYPES = ["input", "float32"]
+TIFF_COMPRESSIONS = ["none", "zlib", "zstd", "lzw"]
+# Files larger than this are written as BigTIFF with bigtiff="auto"
+BIGTIFF_SIZE = 2**32 - 2**25
+
+
+class TiffFormat:
+    """Options of the TIFF files written by the pipeline.
+
+    Set by the `output` section of `parameters.json`; the defaults write
+    uncompressed classic TIFF files in the data type of the input image.
+    """
+
+    DEFAULTS = {
+        "dtype": "input",
+        "compression": "none",
+        "level": None,
+        "tile": None,
+        "bigtiff": "auto",
+    }
+
+    def __init__(
+        self, dtype="input", compression="none", level=None, tile=None, bigtiff="auto"
+    ):
+        """
+        Parameters
+        ----------
+        dtype : str, optional
+            "input" keeps the data type of the shifted image (interpolated
+            values are rounded for integer images), "float32" stores the
+            interpolated values in float32. The default is "input".
+        compression : str, optional
+            "none", "zlib", "zstd" or "lzw". zstd and lzw need the
+            `imagecodecs` package, zlib is used without it. The default is "none".
+        level : int, optional
+            Compression level of zlib and zstd. The default is the codec default.
+        tile : list of int, optional
+            (height, width) of the tiles of each Z plane, multiples of 16.
+            The default is None (one strip per plane).
+        bigtiff : str or bool, optional
+            "auto" (BigTIFF only for files larger than 4 GB), True or False.
+            The default is "auto".
+        """
+        if dtype not in OUTPUT_DTYPES:
+            raise ValueError(
+                f"Unknown output dtype '{dtype}', use one of {OUTPUT_DTYPES}."
+            )
+        compression = str(compression).lower()
+        if compression not in TIFF_COMPRESSIONS:
+            raise ValueError(
+                f"Unknown TIFF compression '{compression}', use one of {TIFF_COMPRESSIONS}."
+            )
+        if compression in ("zstd", "lzw") and not has_imagecodecs():
+            print(
+                f"imagecodecs is not installed: TIFF files use zlib instead of {compression}."
+            )
+            compression = "zlib"
+        if tile is not None:
+            tile = [int(size) for size in tile]
+            if len(tile) != 2 or any(size <= 0 or size % 16 for size in tile):
+                raise ValueError(f"TIFF tiles must be 2 multiples of 16, got {tile}.")
+        if bigtiff not in ("auto", True, False):
+            raise ValueError(f"bigtiff must be 'auto', true or false, got {bigtiff}.")
+        self.dtype = dtype
+        self.compression = compression
+        self.level = level
+        self.tile = tile
+        self.bigtiff = bigtiff
+
+    @property
+    def options(self):
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    def cache_params(self):
+        """Options that differ from the defaults, to add to a cache key."""
+        return {
+            name: value
+            for name, value in self.options.items()
+            if value != self.DEFAULTS[name]
+        }
+
+    def out_dtype(self, dtype):
+        """Data type of the file written for an image computed from `dtype` data."""
+        if self.dtype == "float32":
+            return np.dtype(np.float32)
+        return np.dtype(dtype)
+
+    def imwrite_options(self, image):
+        """Keyword arguments of `tifffile.imwrite` for `image`."""
+        options = {}
+        if self.compression != "none":
+            options["compression"] = self.compression
+            if self.level is not None:
+                options["compressionargs"] = {"level": self.level}
+        if self.tile is not None:
+            options["tile"] = tuple(self.tile)
+        if self.bigtiff == "auto":
+            options["bigtiff"] = image.nbytes > BIGTIFF_SIZE
+        else:
+            options["bigtiff"] = self.bigtiff
+        return options
+
+
+def has_imagecodecs():
+    import importlib.util
+
+    return importlib.util.find_spec("imagecodecs") is not None
+
+
+def save_tiff(image, filepath, tiff_format=None):
+    """
+    Save a TIFF image atomically: write a temporary file then rename it over `filepath`.
+
+    Parameters
+    ----------
+    image : ndarray
+        The image data.
+    filepath : str
+        Path of the TIFF file.
+    tiff_format : TiffFormat, optional
+        Compression, tiling and BigTIFF options. The default is `TiffFormat()`.
+
+    Returns
+    -------
+    int
+        Number of bytes written.
+    """
+    import tifffile
+
+    if tiff_format is None:
+        tiff_format = TiffFormat()
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    try:
+        tifffile.imwrite(
+            tmp_path,
+            image,
+            **tiff_format.imwrite_options(image),
+            photometric="minisblack",
+        )
+        os.replace(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return os.path.getsize(filepath)
 
 
 def load_json(filepath):
@@ -21,24 +189,56 @@ def load_json(filepath):
 
 
 def save_json(data, path):
-    with open(path, "w") as file:
-        json.dump(data, file, ensure_ascii=False, sort_keys=True, indent=4)
+    """Save JSON atomically: write a temporary file then rename it over `path`."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as file:
+            json.dump(data, file, ensure_ascii=False, sort_keys=True, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_npy(data, path):
+    """Save a numpy array atomically: write a temporary file then rename it over `path`."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            np.save(file, data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_npy(filepath, mmap=False):
+    """Load a numpy array, memory-mapped read-only if `mmap`."""
+    return np.load(filepath, mmap_mode="r" if mmap else None)
 
 
 def load_png(filepath):
     """Load a PNG file and convert it in numpy array."""
+    from PIL import Image
+
     image = Image.open(filepath).convert("RGB")
     return np.array(image)
 
 
 def save_png(data, path):
     """Save a numpy array as PNG image."""
+    from PIL import Image
+
     image = Image.fromarray(data)
     image.save(path, format="PNG")
 
 
 def save_pdf(data, path):
     """Create PDF from text."""
+    from reportlab.pdfgen import canvas
+
     c = canvas.Canvas(path)
     c.drawString(100, 750, data)  # Text position on the page
     c.save()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Numeric kernels shared by comparison, reporting and visualization.
+
+Images are processed by flat chunks small enough to stay in CPU cache, so
+each kernel reads every voxel from memory only once and never allocates
+full-size temporaries.
+"""
+
+import numpy as np
+
+# Number of voxels processed at once by the chunked kernels
+CHUNK_SIZE = 2**18
+
+
+def iter_chunks(*images, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over aligned flat chunks of images with the same shape.
+
+    C-contiguous images (including memory-mapped TIFFs) are viewed without
+    copy, other images (strided views, lazy Zarr arrays) are read by slabs of
+    planes: one plane, or one chunk of planes for chunked arrays.
+
+    Yields
+    ------
+    tuple of ndarray
+        One 1D chunk per image.
+    """
+    if all(is_contiguous(image) for image in images):
+        flats = [image.reshape(-1) for image in images]
+        for start in range(0, flats[0].size, chunk_size):
+            yield tuple(flat[start : start + chunk_size] for flat in flats)
+    else:
+        step = max(getattr(image, "chunks", (1,))[0] for image in images)
+        for start in range(0, images[0].shape[0], step):
+            yield from iter_chunks(
+                *[
+                    np.ascontiguousarray(image[start : start + step])
+                    for image in images
+                ],
+                chunk_size=chunk_size,
+            )
+
+
+def is_contiguous(image):
+    """True for an in-memory (or memory-mapped) C-contiguous array."""
+    return isinstance(image, np.ndarray) and image.flags.c_contiguous
+
+
+def min_max(image):
+    """
+    Return the minimum and the maximum of an image in a single pass.
+
+    Parameters
+    ----------
+    image : ndarray
+        The input image.
+
+    Returns
+    -------
+    tuple of float
+        The minimum and maximum values.
+    """
+    vmin, vmax = np.inf, -np.inf
+    for (chunk,) in iter_chunks(image):
+        vmin = min(vmin, chunk.min())
+        vmax = max(vmax, chunk.max())
+    return float(vmin), float(vmax)
+
+
+def normalize_image(image, dtype=np.float32, copy=True):
+    """
+    Normalize the image to the range [0, 1].
+
+    Parameters
+    ----------
+    image : ndarray
+        The input image to normalize.
+    dtype : data-type, optional
+        Data type of the normalized image. The default is float32.
+    copy : bool, optional
+        If False and `image` is a writeable C-contiguous array of `dtype`, it
+        is normalized in place. The default is True.
+
+    Returns
+    -------
+    ndarray
+        The normalized image (zeros if the image is constant).
+    """
+    vmin, vmax = min_max(image)
+    scale = 1.0 / (vmax - vmin) if vmax > vmin else 0.0
+    # Strided views are read through copies of their planes: never in place
+    in_place = is_contiguous(image) and image.flags.writeable
+    if not copy and image.dtype == dtype and in_place:
+        normalized = image
+    else:
+        normalized = np.empty(image.shape, dtype=dtype)
+    for src, dst in iter_chunks(image, normalized):
+        np.subtract(src, vmin, out=dst, dtype=dtype)
+        np.multiply(dst, scale, out=dst)
+    return normalized
+
+
+def squared_error_sum(image1, image2):
+    """
+    Sum of squared differences, accumulated in float64 chunk by chunk.
+
+    Parameters
+    ----------
+    image1, image2 : ndarray
+        Two input images (must have the same shape).
+
+    Returns
+    -------
+    float
+        The sum of squared differences.
+    """
+    total = 0.0
+    for chunk1, chunk2 in iter_chunks(image1, image2):
+        diff = np.subtract(chunk1, chunk2, dtype=np.float64)
+        total += float(np.dot(diff, diff))
+    return total
+
+
+def calculate_normalized_mse(image1, image2):
+    """
+    Calculate normalized MSE between two images.
+
+    Parameters
+    ----------
+    image1, image2 : ndarray
+        Two input images to compare (must have the same shape).
+
+    Returns
+    -------
+    float
+        The normalized Mean Squared Error (MSE).
+    """
+    if image1.shape != image2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    return squared_error_sum(image1, image2) / image1.size
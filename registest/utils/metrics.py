@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 
 import functools
+import itertools
+import os
+import sys
+import threading
 from datetime import datetime
 
+import numpy as np
+
 from registest._version import __version__
+from registest.utils.kernels import squared_error_sum
+
+# Default peak memory (bytes) of the temporary arrays used by block-wise metrics
+DEFAULT_MAX_MEMORY = 1024 * 2**20
+# Approximate number of block-sized float arrays alive while computing SSIM
+SSIM_BLOCK_ARRAYS = 16
 
 
 def timing_main(func):
@@ -19,3 +31,200 @@ def timing_main(func):
         return result
 
     return wrapper
+
+
+def current_rss():
+    """Resident set size of this process in bytes (Linux), or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakRSS:
+    """Context manager sampling the peak resident memory of a code block.
+
+    On Linux the RSS is sampled by a background thread. Elsewhere, the peak
+    RSS of the whole process (`resource.getrusage`) is used when available.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.baseline = current_rss()
+        if self.baseline is not None:
+            self.peak = self.baseline
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss())
+        else:
+            try:
+                import resource
+
+                # kilobytes on Linux, bytes on macOS
+                scale = 1 if sys.platform == "darwin" else 1024
+                self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+            except ImportError:
+                self.peak = None
+
+
+def split_block_shape(shape, max_voxels, halo=0):
+    """
+    Choose a block shape so that a block plus its halo holds at most `max_voxels`.
+
+    The largest axis is halved until the block fits.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the whole volume.
+    max_voxels : int
+        Maximum number of voxels of a block, halo included.
+    halo : int, optional
+        Number of extra voxels read on each side of a block. The default is 0.
+
+    Returns
+    -------
+    list of int
+        The block shape (without halo).
+    """
+    block = list(shape)
+    while np.prod([min(b + 2 * halo, s) for b, s in zip(block, shape)]) > max_voxels:
+        axis = int(np.argmax(block))
+        if block[axis] == 1:
+            break
+        block[axis] = (block[axis] + 1) // 2
+    return block
+
+
+def iter_blocks(shape, block_shape, halo=0):
+    """
+    Iterate over the blocks of a volume.
+
+    Yields
+    ------
+    read : tuple of slice
+        Block extended by `halo` voxels on each side (clipped to the volume).
+    core : tuple of slice
+        Block itself, in volume coordinates.
+    """
+    ranges = [range(0, s, b) for s, b in zip(shape, block_shape)]
+    for starts in itertools.product(*ranges):
+        read, core = [], []
+        for start, b, s in zip(starts, block_shape, shape):
+            stop = min(start + b, s)
+            read.append(slice(max(start - halo, 0), min(stop + halo, s)))
+            core.append(slice(start, stop))
+        yield tuple(read), tuple(core)
+
+
+def streaming_similarity(
+    image1, image2, data_range=1.0, win_size=7, max_memory=DEFAULT_MAX_MEMORY
+):
+    """
+    Compute the mean SSIM and the MSE of two volumes block by block.
+
+    Each block is read with a halo of `(win_size - 1) // 2` voxels, so the
+    local SSIM of its voxels is the same as over the whole volume. Global
+    sums are accumulated in float64, which gives the same values as
+    `skimage.metrics.structural_similarity` (uniform window, sample
+    covariance) and `np.mean((image1 - image2) ** 2)` within floating-point
+    tolerance. Inputs can be memory-mapped: only one block is in memory at
+    a time.
+
+    Parameters
+    ----------
+    image1, image2 : ndarray
+        Two input images to compare (must have the same shape).
+    data_range : float, optional
+        Data range of the input images. The default is 1.0.
+    win_size : int, optional
+        Side-length of the SSIM sliding window (odd). The default is 7.
+    max_memory : int, optional
+        Approximate peak memory (bytes) of the temporary arrays of a block.
+
+    Returns
+    -------
+    tuple of float
+        The mean SSIM and the MSE.
+    """
+    from scipy.ndimage import uniform_filter
+
+    if image1.shape != image2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    if np.any(np.asarray(image1.shape) < win_size):
+        raise ValueError("win_size exceeds image extent.")
+    if not win_size % 2:
+        raise ValueError("Window size must be odd.")
+
+    float_type = np.float32 if image1.dtype in (np.float16, np.float32) else np.float64
+    itemsize = np.dtype(float_type).itemsize
+    pad = (win_size - 1) // 2
+    shape = image1.shape
+    cov_norm = win_size**image1.ndim / (win_size**image1.ndim - 1)
+    c1 = (0.01 * data_range) ** 2
+    c2 = (0.03 * data_range) ** 2
+
+    max_voxels = max(max_memory // (SSIM_BLOCK_ARRAYS * itemsize), 1)
+    block_shape = split_block_shape(shape, max_voxels, halo=pad)
+
+    ssim_sum, ssim_count, se_sum = 0.0, 0, 0.0
+    for read, core in iter_blocks(shape, block_shape, halo=pad):
+        im1 = np.asarray(image1[read], dtype=float_type)
+        im2 = np.asarray(image2[read], dtype=float_type)
+        # Core block and cropped SSIM area, in block coordinates
+        in_core = tuple(
+            slice(c.start - r.start, c.stop - r.start) for r, c in zip(read, core)
+        )
+        in_crop = tuple(
+            slice(max(c.start, pad) - r.start, min(c.stop, s - pad) - r.start)
+            for r, c, s in zip(read, core, shape)
+        )
+
+        se_sum += squared_error_sum(im1[in_core], im2[in_core])
+
+        ux = uniform_filter(im1, size=win_size)
+        uy = uniform_filter(im2, size=win_size)
+        vx = cov_norm * (uniform_filter(im1 * im1, size=win_size) - ux * ux)
+        vy = cov_norm * (uniform_filter(im2 * im2, size=win_size) - uy * uy)
+        vxy = cov_norm * (uniform_filter(im1 * im2, size=win_size) - ux * uy)
+        del im1, im2
+        local_ssim = ((2 * ux * uy + c1) * (2 * vxy + c2)) / (
+            (ux**2 + uy**2 + c1) * (vx + vy + c2)
+        )
+        cropped = local_ssim[in_crop]
+        ssim_sum += float(cropped.sum(dtype=np.float64))
+        ssim_count += cropped.size
+
+    return ssim_sum / ssim_count, se_sum / image1.size
+
+
+def similarity_metrics(reference_3d, target_3d, max_memory=DEFAULT_MAX_MEMORY):
+    """
+    SSIM and normalized MSE of two normalized volumes (metric "ssim_nmse").
+
+    Returns
+    -------
+    dict
+        {"SSIM": float, "NMSE": float}
+    """
+    ssim_value, nmse_value = streaming_similarity(
+        reference_3d, target_3d, data_range=1.0, max_memory=max_memory
+    )
+    return {"SSIM": ssim_value, "NMSE": nmse_value}
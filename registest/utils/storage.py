@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""Storage backends of the volumes written between pipeline stages.
+
+- "tiff": one TIFF file per volume (default), see `TiffFormat`.
+- "npy": one `.npy` file per volume, memory-mapped when read back, so a
+  stage only pages in the planes it accesses.
+- "zarr": one chunked Zarr directory per volume (needs `zarr`, else "npy"
+  is used). `open_volume` returns a lazy array: only the sliced chunks are
+  read.
+
+The "npy" and "zarr" backends write and read volumes by chunks of Z planes
+in a thread pool. Their volumes can be exported to TIFF at the end of a run.
+"""
+
+import importlib.util
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from registest.utils.io_utils import TiffFormat, load_tiff, save_tiff
+
+STORAGE_BACKENDS = ["tiff", "npy", "zarr"]
+STORAGE_EXTENSIONS = (".tif", ".tiff", ".npy", ".zarr")
+
+
+def z_chunks(n_planes, chunk_planes):
+    """Slices of `chunk_planes` Z planes covering `n_planes`."""
+    return [
+        slice(start, min(start + chunk_planes, n_planes))
+        for start in range(0, n_planes, chunk_planes)
+    ]
+
+
+def copy_chunks(src, dst, chunk_planes, workers=None):
+    """Copy `src` into `dst` by chunks of Z planes, in a thread pool."""
+    chunks = z_chunks(src.shape[0], chunk_planes)
+    if workers == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            dst[chunk] = src[chunk]
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def copy(chunk):
+            dst[chunk] = src[chunk]
+
+        list(pool.map(copy, chunks))
+
+
+def replace_path(tmp_path, path):
+    """Rename a temporary file or directory over `path`."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def path_size(path):
+    """Size in bytes of a file, or of all the files of a directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+class TiffStorage:
+    """One TIFF file per volume."""
+
+    name = "tiff"
+    ext = ".tif"
+
+    def __init__(self, tiff_format=None):
+        self.tiff_format = tiff_format or TiffFormat()
+
+    def save(self, image, path):
+        """Save `image` and return the number of bytes written."""
+        return save_tiff(image, path, self.tiff_format)
+
+    def load(self, path, mmap=False):
+        return load_tiff(path, mmap=mmap)
+
+    def open(self, path):
+        """Memory-mapped volume (read in memory if compressed)."""
+        return self.load(path, mmap=True)
+
+
+class NpyStorage(TiffStorage):
+    """One `.npy` file per volume, written by chunks and memory-mapped when read."""
+
+    name = "npy"
+    ext = ".npy"
+
+    def __init__(self, tiff_format=None, chunk_planes=8, workers=None):
+        super().__init__(tiff_format)
+        self.chunk_planes = chunk_planes
+        self.workers = workers
+
+    def save(self, image, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            stored = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=image.dtype, shape=image.shape
+            )
+            copy_chunks(image, stored, self.chunk_planes, self.workers)
+            stored.flush()
+            del stored
+            replace_path(tmp_path, path)
+        finally:
+            remove_path(tmp_path)
+        return path_size(path)
+
+    def open(self, path):
+        """Read-only memory-mapped volume."""
+        return np.load(path, mmap_mode="r")
+
+    def load(self, path, mmap=False):
+        """Load a volume, or map it read-only if `mmap`."""
+        stored = self.open(path)
+        if mmap:
+            return stored
+        image = np.empty(stored.shape, dtype=stored.dtype)
+        copy_chunks(stored, image, self.chunk_planes, self.workers)
+        return image
+
+    def export_tiff(self, path):
+        """Write a TIFF copy of a stored volume next to it and return its path."""
+        tif_path = os.path.splitext(path)[0] + ".tif"
+        save_tiff(self.load(path, mmap=True), tif_path, self.tiff_format)
+        return tif_path
+
+
+class ZarrStorage(NpyStorage):
+    """One chunked Zarr directory per volume (chunks of Z planes)."""
+
+    name = "zarr"
+    ext = ".zarr"
+
+    def save(self, image, path):
+        import zarr
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            stored = zarr.open_array(
+                tmp_path,
+                mode="w",
+                shape=image.shape,
+                chunks=(self.chunk_planes,) + image.shape[1:],
+                dtype=image.dtype,
+            )
+            copy_chunks(image, stored, self.chunk_planes, self.workers)
+            replace_path(tmp_path, path)
+        finally:
+            remove_path(tmp_path)
+        return path_size(path)
+
+    def open(self, path):
+        """Lazy Zarr array: only the sliced chunks are read."""
+        import zarr
+
+        return zarr.open_array(path, mode="r")
+
+    def load(self, path, mmap=False):
+        """Read a volume, chunks in parallel (Zarr stores are never memory-mapped)."""
+        stored = self.open(path)
+        image = np.empty(stored.shape, dtype=stored.dtype)
+        copy_chunks(stored, image, self.chunk_planes, self.workers)
+        return image
+
+
+def get_storage(backend="tiff", tiff_format=None, **options):
+    """
+    Build the storage backend of the pipeline volumes.
+
+    Parameters
+    ----------
+    backend : str, optional
+        "tiff", "npy" or "zarr" (falls back to "npy" without `zarr`).
+        The default is "tiff".
+    tiff_format : TiffFormat, optional
+        Options of the TIFF files (written or exported).
+    **options
+        `chunk_planes` (Z planes per chunk, default 8) and `workers`
+        (threads reading and writing chunks) of the "npy" and "zarr" backends.
+
+    Returns
+    -------
+    TiffStorage
+        The storage backend.
+    """
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(
+            f"Unknown storage backend '{backend}', use one of {STORAGE_BACKENDS}."
+        )
+    if backend == "tiff":
+        return TiffStorage(tiff_format)
+    if backend == "zarr" and importlib.util.find_spec("zarr") is None:
+        print("zarr is not installed: volumes are stored in .npy files.")
+        backend = "npy"
+    storage_cls = ZarrStorage if backend == "zarr" else NpyStorage
+    return storage_cls(tiff_format, **options)
+
+
+def path_storage(path, storage=None, **options):
+    """
+    Backend of a stored volume, chosen from the path extension.
+
+    `storage`, the backend of the run, is used for the volumes it writes,
+    with its chunk options; `options` apply to the other chunked volumes.
+    """
+    if storage is not None and path.endswith(storage.ext):
+        return storage
+    if path.endswith(".npy"):
+        return NpyStorage(**options)
+    if path.endswith(".zarr"):
+        return ZarrStorage(**options)
+    return TiffStorage()
+
+
+def load_volume(path, mmap=False, storage=None, **options):
+    """
+    Load a volume stored by any backend, chosen from the path extension.
+
+    Parameters
+    ----------
+    path : str
+        Path of a TIFF file, a `.npy` file or a `.zarr` directory.
+    mmap : bool, optional
+        Memory-map the data when the format allows it. The default is False.
+    storage : TiffStorage, optional
+        Backend of the run, used for the volumes with its extension.
+    **options
+        `chunk_planes` and `workers` of the chunked backends.
+    """
+    return path_storage(path, storage, **options).load(path, mmap=mmap)
+
+
+def open_volume(path, storage=None):
+    """
+    Open a volume stored by any backend without reading it all.
+
+    TIFF (uncompressed) and `.npy` files are memory-mapped, Zarr stores are
+    opened as lazy arrays: slicing them only reads the chunks it covers.
+
+    Parameters
+    ----------
+    path : str
+        Path of a TIFF file, a `.npy` file or a `.zarr` directory.
+    storage : TiffStorage, optional
+        Backend of the run, used for the volumes with its extension.
+    """
+    return path_storage(path, storage).open(path)
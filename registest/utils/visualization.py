@@ -2,14 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-import tifffile
-from skimage import exposure
 
-
-def normalize_image(image):
-    return (image - np.min(image)) / (np.max(image) - np.min(image))
+from registest.utils.kernels import normalize_image
 
 
 def image_adjust(image, lower_threshold=0.3, higher_threshold=0.9999):
@@ -34,6 +28,8 @@ def image_adjust(image, lower_threshold=0.3, higher_threshold=0.9999):
         adjusted 3D image.
 
     """
+    from skimage import exposure
+
     # rescales image to [0,1]
     image1 = exposure.rescale_intensity(image, out_range=(0, 1))
     # calculates histogram of intensities
@@ -56,6 +52,8 @@ def image_adjust(image, lower_threshold=0.3, higher_threshold=0.9999):
 
 
 def visu_slice(normalized_3d):
+    import plotly.express as px
+
     fig = px.imshow(normalized_3d, color_continuous_scale="viridis", animation_frame=0)
     fig.update_layout(title="Visualisation 3D Interactive")
     # fig.show()
@@ -64,6 +62,8 @@ def visu_slice(normalized_3d):
 
 def visu_3d(normalized_image):
     # Créer une grille pour les coordonnées (x, y, z)
+    import plotly.graph_objects as go
+
     z, y, x = np.mgrid[
         : normalized_image.shape[0],
         : normalized_image.shape[1],
@@ -104,6 +104,8 @@ def overlay_3d_img(ref_img, shifted_img):
 
 
 def visu_rgb(ref, target):
+    import plotly.graph_objects as go
+
     fig = go.Figure()
     z, y, x = np.mgrid[
         : ref.shape[0],
@@ -161,33 +163,259 @@ def enhance_contrast(img, power=1):
     ndarray
         Contrast-enhanced image.
     """
-    return normalize_image(np.power(img, power))
+    return normalize_image(np.power(img, power, dtype=np.float32), copy=False)
+
+
+# Default settings of the static previews
+PREVIEW_FORMATS = ["png", "webp"]
+PREVIEW_SLICES = 8
+PREVIEW_TILE_SIZE = 512
+
+
+def preview_slice_indices(n_planes, n_slices=PREVIEW_SLICES):
+    """Evenly spaced Z indices of the slices shown in a preview."""
+    if n_slices <= 0:
+        return []
+    return sorted(set(np.linspace(0, n_planes - 1, n_slices).round().astype(int)))
+
+
+def contrast_channel(plane, power=1):
+    """Channel of an overlay plane before normalization (see `enhance_contrast`)."""
+    if power == 1 and plane.dtype == np.float32:
+        return plane
+    return np.power(plane, power, dtype=np.float32)
+
+
+def overlay_channels(ref_plane, shifted_plane, power=1):
+    """Red, green and blue channels (before normalization) of an overlay plane."""
+    red = contrast_channel(ref_plane, power)
+    green = contrast_channel(shifted_plane, power)
+    return [red, green, np.minimum(red, green)]
+
+
+class ChannelProjections:
+    """Value range and max projections of a channel, fed one Z plane at a time."""
+
+    def __init__(self):
+        self.range = [np.inf, -np.inf]
+        self.projections = {"xy": None, "xz": [], "yz": []}
+
+    def add(self, plane):
+        self.range[0] = min(self.range[0], float(plane.min()))
+        self.range[1] = max(self.range[1], float(plane.max()))
+        if self.projections["xy"] is None:
+            self.projections["xy"] = plane.astype(np.float32)
+        else:
+            np.maximum(self.projections["xy"], plane, out=self.projections["xy"])
+        self.projections["xz"].append(plane.max(axis=1))
+        self.projections["yz"].append(plane.max(axis=0))
+
+    def close(self):
+        for name in ["xz", "yz"]:
+            self.projections[name] = np.stack(self.projections[name])
+        return self
+
+
+class ReferenceOverlay:
+    """Red channel products of the overlays, computed once per reference.
+
+    Every target compared to the same reference reuses its value range and
+    max projections, only the green and blue channels are computed per target.
+    """
+
+    def __init__(self, ref_img, power=1):
+        self.data = ref_img
+        self.shape = ref_img.shape
+        self.power = power
+        self.red = ChannelProjections()
+        for plane in ref_img:
+            self.red.add(contrast_channel(plane, power))
+        self.red.close()
+
+    def matches(self, ref_img, power=1):
+        """Return True if these products were computed from `ref_img` with `power`."""
+        return ref_img is self.data and power == self.power
+
+
+class OverlaySummary:
+    """RGB overlay products of two volumes, computed in one pass over Z planes.
+
+    Channels are the reference (red), the target (green) and their minimum
+    (blue), each after `enhance_contrast`. Only 2D arrays are kept: the value
+    range of each channel over the whole volume, the max projections along
+    each axis and the requested Z slices. No full-size RGB copy is made.
+    The red channel products come from a `ReferenceOverlay`, which can be
+    shared by several targets.
+    """
+
+    def __init__(self, ref_img, shifted_img, z_indices=(), power=1, reference=None):
+        if ref_img.shape != shifted_img.shape:
+            raise ValueError("Both images must have the same shape.")
+        if reference is None or not reference.matches(ref_img, power):
+            reference = ReferenceOverlay(ref_img, power)
+        self.shape = ref_img.shape
+        self.power = power
+        self.slices = {}
+        green, blue = ChannelProjections(), ChannelProjections()
+        z_indices = set(z_indices)
+        for z, (ref_plane, shifted_plane) in enumerate(zip(ref_img, shifted_img)):
+            channels = overlay_channels(ref_plane, shifted_plane, power)
+            green.add(channels[1])
+            blue.add(channels[2])
+            if z in z_indices:
+                self.slices[z] = channels
+        channels = [reference.red, green.close(), blue.close()]
+        self.ranges = [channel.range for channel in channels]
+        self.projections = {
+            name: [channel.projections[name] for channel in channels]
+            for name in ["xy", "xz", "yz"]
+        }
+
+    def rgb(self, channels):
+        """uint8 RGB image of 2D channels, scaled with the volume value ranges."""
+        overlay = np.empty(channels[0].shape + (3,), dtype=np.float32)
+        for i, (channel, (vmin, vmax)) in enumerate(zip(channels, self.ranges)):
+            scale = 1.0 / (vmax - vmin) if vmax > vmin else 0.0
+            np.subtract(channel, vmin, out=overlay[..., i], dtype=np.float32)
+            np.multiply(overlay[..., i], scale, out=overlay[..., i])
+        return (overlay * 255).astype(np.uint8)
+
+    def projection(self, name="xy"):
+        """RGB max projection along Z ("xy"), Y ("xz") or X ("yz")."""
+        return self.rgb(self.projections[name])
+
+    def slice(self, z):
+        return self.rgb(self.slices[z])
+
+
+def downscale(image, tile_size=PREVIEW_TILE_SIZE):
+    """Keep one pixel out of n on each axis so that the image fits in `tile_size`."""
+    step = max(1, -(-max(image.shape[:2]) // tile_size))
+    return image[::step, ::step]
+
+
+def preview_mosaic(summary, tile_size=PREVIEW_TILE_SIZE, gap=2):
+    """
+    Assemble the preview tiles in one uint8 RGB image.
+
+    The first row starts with the XY max projection followed by the Z slices
+    (on a square grid), the XZ and YZ max projections are added below.
+    """
+    tiles = [downscale(summary.projection("xy"), tile_size)]
+    tiles += [downscale(summary.slice(z), tile_size) for z in sorted(summary.slices)]
+    n_cols = int(np.ceil(np.sqrt(len(tiles))))
+    tile_h, tile_w = tiles[0].shape[:2]
+    rows = []
+    for start in range(0, len(tiles), n_cols):
+        row = np.zeros((tile_h, n_cols * (tile_w + gap) - gap, 3), dtype=np.uint8)
+        for i, tile in enumerate(tiles[start : start + n_cols]):
+            row[:, i * (tile_w + gap) : i * (tile_w + gap) + tile_w] = tile
+        rows.append(row)
+    step = max(1, -(-max(summary.shape[1:]) // tile_size))
+    for name in ["xz", "yz"]:
+        rows.append(summary.projection(name)[:, ::step])
+    width = max(row.shape[1] for row in rows)
+    mosaic = np.zeros(
+        (sum(row.shape[0] for row in rows) + gap * (len(rows) - 1), width, 3),
+        dtype=np.uint8,
+    )
+    top = 0
+    for row in rows:
+        mosaic[top : top + row.shape[0], : row.shape[1]] = row
+        top += row.shape[0] + gap
+    return mosaic
+
+
+def save_preview(
+    summary, path_base, fmt="png", quality=85, tile_size=PREVIEW_TILE_SIZE
+):
+    """
+    Save the static preview of an overlay summary.
+
+    Parameters
+    ----------
+    summary : OverlaySummary
+        Overlay products of the reference and the target.
+    path_base : str
+        Output path without extension.
+    fmt : str, optional
+        "png" (lossless) or "webp" (lossy, smaller). The default is "png".
+    quality : int, optional
+        WebP quality. The default is 85.
+    tile_size : int, optional
+        Maximum size (pixel) of each tile. The default is 512.
+
+    Returns
+    -------
+    str
+        Path of the saved image.
+    """
+    from PIL import Image
+
+    if fmt not in PREVIEW_FORMATS:
+        raise ValueError(
+            f"Unknown preview format '{fmt}', use one of {PREVIEW_FORMATS}."
+        )
+    path = f"{path_base}.{fmt}"
+    image = Image.fromarray(preview_mosaic(summary, tile_size))
+    if fmt == "webp":
+        image.save(path, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(path, format="PNG", compress_level=6)
+    return path
+
+
+def visu_rgb_2d(ref_img, shifted_img):
+    """
+    Visualize two 2D images together using the RGB overlay technique.
+
+    Parameters
+    ----------
+    ref_img : ndarray
+        The reference image to be visualized in the red channel.
+    shifted_img : ndarray
+        The shifted image to be visualized in the green channel.
+
+    Returns
+    -------
+    ndarray
+        uint8 RGB max projection along Z.
+    """
+    return OverlaySummary(ref_img, shifted_img).projection("xy")
 
 
-def visu_rgb_slice(ref_img, shifted_img, path_to_save):
+def visu_rgb_slice(ref_img, shifted_img, path_to_save, summary=None):
     """
     Visualize two 3D images together using the RGB overlay technique.
 
+    Every Z slice is saved in an interactive Plotly HTML file, which is large
+    and slow to write: use `save_preview` for a quick look.
+
     Parameters
     ----------
     ref_img : ndarray
         The reference image to be visualized in the red channel.
     shifted_img : ndarray
         The shifted image to be visualized in the green channel.
+    path_to_save : str
+        Output path without the ".html" extension.
+    summary : OverlaySummary, optional
+        Summary of the same images, to reuse its value ranges.
+
+    Returns
+    -------
+    ndarray
+        uint8 RGB overlay of shape (Z, X, Y, 3).
     """
-    # Ensure both images have the same shape
-    if ref_img.shape != shifted_img.shape:
-        raise ValueError("Both images must have the same shape.")
-
-    min_ch = np.minimum(ref_img, shifted_img)
-    overlay = np.stack(
-        [
-            enhance_contrast(ref_img),
-            enhance_contrast(shifted_img),
-            enhance_contrast(min_ch),
-        ],
-        axis=-1,
-    )
+    import plotly.express as px
+
+    if summary is None:
+        summary = OverlaySummary(ref_img, shifted_img)
+    overlay = np.empty(summary.shape + (3,), dtype=np.uint8)
+    for z, (ref_plane, shifted_plane) in enumerate(zip(ref_img, shifted_img)):
+        overlay[z] = summary.rgb(
+            overlay_channels(ref_plane, shifted_plane, summary.power)
+        )
 
     # Visualize using Plotly
     fig = px.imshow(
@@ -207,41 +435,53 @@ def visu_rgb_slice(ref_img, shifted_img, path_to_save):
     return overlay
 
 
-def visu_rgb_2d(ref_img, shifted_img):
+def visu_overlay(
+    ref_img,
+    shifted_img,
+    path_base,
+    n_slices=PREVIEW_SLICES,
+    fmt="png",
+    html=False,
+    reference=None,
+):
     """
-    Visualize two 2D images together using the RGB overlay technique.
+    Save the overlay visualizations of a comparison.
 
     Parameters
     ----------
     ref_img : ndarray
-        The reference image to be visualized in the red channel.
+        The reference image (red channel).
     shifted_img : ndarray
-        The shifted image to be visualized in the green channel.
-    """
-    # Ensure both images have the same shape
-    if ref_img.shape != shifted_img.shape:
-        raise ValueError("Both images must have the same shape.")
-
-    min_ch = np.minimum(ref_img, shifted_img)
-    overlay = np.stack(
-        [
-            enhance_contrast(ref_img).max(axis=0),
-            enhance_contrast(shifted_img).max(axis=0),
-            enhance_contrast(min_ch).max(axis=0),
-        ],
-        axis=-1,
-    )
-    # Display the overlay
-    # plt.figure(figsize=(6, 6))
-    # plt.imshow(overlay)
-    # plt.axis("off")  # Hide axis for better visualization
-    # plt.title("RGB Overlay: Red (Reference), Green (Shifted), Blue (Overlap)")
-    # plt.show()
+        The compared image (green channel).
+    path_base : str
+        Output path without extension, "_preview" is added for the preview.
+    n_slices : int, optional
+        Number of Z slices in the static preview, 0 to skip the preview.
+        The default is 8.
+    fmt : str, optional
+        Format of the preview, "png" or "webp". The default is "png".
+    html : bool, optional
+        Also save the interactive Plotly HTML of every slice. The default is False.
+    reference : ReferenceOverlay, optional
+        Products of `ref_img` shared by several targets. Computed if not given.
 
-    return (overlay * 255).astype(np.uint8)
+    Returns
+    -------
+    ndarray
+        uint8 RGB max projection along Z (see `visu_rgb_2d`).
+    """
+    z_indices = preview_slice_indices(ref_img.shape[0], n_slices)
+    summary = OverlaySummary(ref_img, shifted_img, z_indices, reference=reference)
+    if n_slices > 0:
+        save_preview(summary, f"{path_base}_preview", fmt=fmt)
+    if html:
+        visu_rgb_slice(ref_img, shifted_img, path_base, summary=summary)
+    return summary.projection("xy")
 
 
 if __name__ == "__main__":
+    import tifffile
+
     base = "/home/xdevos/Repositories/XDevos/pyhim-small-dataset/register_global/IN/global/"
     tar0 = base + "scan_001_RT26_005_ROI_converted_decon_ch00.tif"
     ref = base + "scan_001_RT27_005_ROI_converted_decon_ch00.tif"
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from registest.modules.benchmark import parse_shape, run_benchmark
+
+
+def test_parse_shape():
+    assert parse_shape("30x128x256") == (30, 128, 256)
+    with pytest.raises(ValueError):
+        parse_shape("128x128")
+
+
+def test_run_benchmark_integer_shift(monkeypatch):
+    """An integer shift is recovered by global_pyhim and every metric is filled."""
+    monkeypatch.setattr(
+        "registest.modules.benchmark.random_shifts",
+        lambda rng, n_shifts, max_shift: [[2, -1, 0]],
+    )
+    results = run_benchmark([(20, 96, 96)], ["global_pyhim"], n_spots=10)
+    assert len(results) == 1
+    row = results.iloc[0]
+    assert row["shift_error"] < 0.05
+    assert row["wall_time"] > 0
+    assert 0 < row["SSIM"] <= 1
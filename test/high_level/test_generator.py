@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from registest.modules.generator import add_psf, generate_pair, generate_psf, splat_psfs
+
+
+def test_splat_psfs_matches_add_psf_without_overlap():
+    """Separate spots give the same image as adding them one by one."""
+    shape, psf_shape = (20, 64, 64), (10, 16, 16)
+    positions, attenuations = [(6, 16, 16), (14, 48, 40)], [30, 50]
+    image = np.zeros(shape, dtype=np.uint16)
+    for position, attenuation in zip(positions, attenuations):
+        psf = generate_psf(psf_shape, attenuation_factor=attenuation)
+        image = add_psf(image, psf, position)
+    splatted = splat_psfs(
+        shape, positions, attenuations, psf_shape=psf_shape, background=0
+    )
+    assert splatted.dtype == np.uint16
+    assert np.abs(splatted.astype(int) - image).max() <= 1
+
+
+def test_generate_pair_is_reproducible():
+    ref1, target1, spots1 = generate_pair((16, 48, 48), 5, rng=3)
+    ref2, target2, spots2 = generate_pair((16, 48, 48), 5, rng=3)
+    np.testing.assert_array_equal(ref1, ref2)
+    np.testing.assert_array_equal(target1, target2)
+    np.testing.assert_array_equal(spots1, spots2)
+    assert np.abs(spots1[:, 4:]).max() <= 4
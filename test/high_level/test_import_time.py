@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Wall-clock budgets depend on the machine: they are only checked when
+# REGISTEST_CHECK_IMPORT_TIME is set, e.g. on a quiet benchmark machine.
+CHECK_IMPORT_TIME = bool(os.environ.get("REGISTEST_CHECK_IMPORT_TIME"))
+
+# Entry point module: (import time budget in seconds, modules it must not import)
+HEAVY_MODULES = ["pandas", "plotly", "fitz", "reportlab", "SimpleITK", "tqdm"]
+ENTRY_POINTS = {
+    "registest.run_registest": (0.6, HEAVY_MODULES + ["skimage", "scipy.fft"]),
+    "registest.modules.transformation": (0.5, HEAVY_MODULES + ["scipy"]),
+    "registest.modules.comparison": (0.6, HEAVY_MODULES + ["skimage", "scipy"]),
+    "registest.modules.generator": (0.5, HEAVY_MODULES + ["scipy"]),
+    "registest.modules.registration": (0.6, HEAVY_MODULES + ["skimage", "scipy.fft"]),
+    "registest.modules.benchmark": (0.6, HEAVY_MODULES + ["skimage", "scipy.fft"]),
+}
+
+
+def import_times(module):
+    """
+    Import `module` in a new interpreter with `python -X importtime`.
+
+    Returns
+    -------
+    dict
+        Cumulative import time (seconds) of each imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+@pytest.mark.parametrize("module", ENTRY_POINTS)
+def test_entry_point_imports(module):
+    """Entry points only import what their stage needs."""
+    _, forbidden = ENTRY_POINTS[module]
+    loaded = [name for name in forbidden if name in import_times(module)]
+    assert not loaded, f"{module} imports {loaded} at startup"
+
+
+@pytest.mark.skipif(
+    not CHECK_IMPORT_TIME, reason="set REGISTEST_CHECK_IMPORT_TIME to check budgets"
+)
+@pytest.mark.parametrize("module", ENTRY_POINTS)
+def test_entry_point_import_time(module):
+    """Entry points import within their time budget."""
+    budget, _ = ENTRY_POINTS[module]
+    times = min((import_times(module) for _ in range(3)), key=lambda t: t[module])
+    assert times[module] < budget, f"{module} imports in {times[module]:.3f} s"
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+import tifffile
+
+from registest.modules.transformation import shift_3d_array
+from registest.utils.io_utils import TiffFormat, load_tiff, save_tiff
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 500, (6, 64, 80), dtype=np.uint16)
+
+
+def test_save_tiff_default_is_uncompressed(image, tmp_path):
+    path = str(tmp_path / "image.tif")
+    nbytes = save_tiff(image, path)
+    with tifffile.TiffFile(path) as tif:
+        assert tif.pages[0].compression == 1 and not tif.is_bigtiff
+    assert nbytes == (tmp_path / "image.tif").stat().st_size
+    # Uncompressed files are memory-mapped
+    assert isinstance(load_tiff(path, mmap=True), np.memmap)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_save_tiff_compressed_tiles(image, tmp_path):
+    path = str(tmp_path / "image.tif")
+    tiff_format = TiffFormat(compression="zlib", level=9, tile=[32, 32], bigtiff=True)
+    save_tiff(image, path, tiff_format)
+    with tifffile.TiffFile(path) as tif:
+        assert tif.pages[0].is_tiled and tif.is_bigtiff
+        assert tif.pages[0].compression == 8  # deflate
+    assert np.array_equal(load_tiff(path, mmap=True), image)
+    assert tiff_format.cache_params() == {
+        "compression": "zlib",
+        "level": 9,
+        "tile": [32, 32],
+        "bigtiff": True,
+    }
+    assert TiffFormat().cache_params() == {}
+
+
+def test_tiff_format_dtype_policy(image):
+    assert TiffFormat().out_dtype(image.dtype) == np.uint16
+    assert TiffFormat(dtype="float32").out_dtype(np.float64) == np.float32
+    # A float32 output keeps the interpolated values of an integer image
+    rounded, _ = shift_3d_array(image, [0, 0.5, 0], dtype=np.uint16)
+    interpolated, _ = shift_3d_array(image, [0, 0.5, 0], dtype=np.float32)
+    assert interpolated.dtype == np.float32
+    assert np.array_equal(np.rint(interpolated).clip(0, 65535), rounded)
+    assert not np.array_equal(interpolated, rounded)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"dtype": "float16"},
+        {"compression": "jpeg"},
+        {"tile": [30, 32]},
+        {"bigtiff": 1.5},
+    ],
+)
+def test_tiff_format_invalid(options):
+    with pytest.raises(ValueError):
+        TiffFormat(**options)
+
+
+@pytest.mark.parametrize("backend", ["npy", "zarr"])
+def test_chunked_storage_round_trip(image, tmp_path, backend):
+    from registest.utils.storage import get_storage, load_volume
+
+    # zarr falls back to npy when it is not installed
+    storage = get_storage(backend, chunk_planes=4, workers=2)
+    path = str(tmp_path / f"image{storage.ext}")
+    nbytes = storage.save(image, path)
+    assert nbytes >= image.nbytes or backend == "zarr"
+    assert not list(tmp_path.glob("*.tmp"))
+    volume = load_volume(path, mmap=True)
+    assert np.array_equal(volume, image) and volume.dtype == image.dtype
+    assert np.array_equal(storage.load(path), image)
+    tif_path = storage.export_tiff(path)
+    assert tif_path == str(tmp_path / "image.tif")
+    assert np.array_equal(load_tiff(tif_path), image)
+
+
+def test_data_manager_storage_round_trip(image, tmp_path):
+    from registest.core.data_manager import DataManager
+    from registest.utils.storage import get_storage
+
+    datam = DataManager(str(tmp_path))
+    datam.storage = get_storage("npy", chunk_planes=4)
+    datam.save_tif(image, "shifted", "image.npy")
+    path = datam.get_filepath("shifted", "image.npy")
+    opened = datam.load_tiff(path, mmap=True)
+    assert isinstance(opened, np.memmap) and not opened.flags.writeable
+    np.testing.assert_array_equal(opened, image)
+    np.testing.assert_array_equal(datam.load_tiff(path), image)
+
+
+def test_volumes_of_the_run_use_its_storage(image, tmp_path):
+    """Volumes with the run extension are read with its chunk options."""
+    from registest.utils.storage import (
+        NpyStorage,
+        TiffStorage,
+        get_storage,
+        load_volume,
+        open_volume,
+        path_storage,
+    )
+
+    storage = get_storage("npy", chunk_planes=2, workers=1)
+    assert path_storage("target.npy", storage) is storage
+    assert isinstance(path_storage("target.tif", storage), TiffStorage)
+    other = path_storage("target.npy", get_storage("tiff"))
+    assert isinstance(other, NpyStorage) and other.chunk_planes == 8
+
+    path = str(tmp_path / "image.npy")
+    storage.save(image, path)
+    np.testing.assert_array_equal(load_volume(path, storage=storage), image)
+    assert isinstance(open_volume(path, storage), np.memmap)
+
+
+def test_open_zarr_volume_is_lazy(image, tmp_path):
+    zarr = pytest.importorskip("zarr")
+    from registest.utils.storage import ZarrStorage, open_volume
+
+    path = str(tmp_path / "image.zarr")
+    ZarrStorage(chunk_planes=2).save(image, path)
+    opened = open_volume(path)
+    assert isinstance(opened, zarr.Array) and opened.chunks[0] == 2
+    np.testing.assert_array_equal(opened[2:4], image[2:4])
+
+
+def test_get_storage_invalid():
+    from registest.utils.storage import get_storage
+
+    with pytest.raises(ValueError):
+        get_storage("hdf5")
+
+
+def test_load_tiff_mmap(image, tmp_path):
+    path = str(tmp_path / "image.tif")
+    save_tiff(image, path)
+    mapped = load_tiff(path, mmap=True)
+    assert isinstance(mapped, np.memmap) and not mapped.flags.writeable
+    np.testing.assert_array_equal(mapped, image)
+
+
+def test_load_tiff_mmap_compressed_falls_back(image, tmp_path):
+    """Compressed files are not mappable: they are read with imread."""
+    path = str(tmp_path / "image.tif")
+    tifffile.imwrite(path, image, compression="zlib")
+    loaded = load_tiff(path, mmap=True)
+    assert not isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, image)
+
+
+def test_reference_lazy_load_and_unload(image, tmp_path):
+    from registest.core.data_manager import ReferenceImg
+
+    path = str(tmp_path / "ref.tif")
+    save_tiff(image, path)
+    reference = ReferenceImg(path)
+    assert reference._data is None  # nothing read at creation
+    data = reference.data
+    assert reference.data is data  # loaded once
+    np.testing.assert_array_equal(data, image)
+
+    reference.unload()
+    assert reference._data is None
+    reloaded = reference.data
+    assert reloaded is not data
+    np.testing.assert_array_equal(reloaded, image)
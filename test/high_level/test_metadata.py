@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest
+
+from registest.config.metadata import FileMetadata, MetadataManager
+from registest.core.cache import make_cache_entry
+
+
+def read_metadata(folder):
+    with open(os.path.join(folder, "metadata.json")) as f:
+        return json.load(f)
+
+
+def test_metadata_batch_is_written_on_flush(tmp_path):
+    """Entries stay in memory until the batch is full or flush is called."""
+    meta_datam = MetadataManager(folder=str(tmp_path), batch_size=3)
+    meta_datam.add_file_metadata(FileMetadata("a.tif", "ref.tif"))
+    meta_datam.add_file_metadata(FileMetadata("b.tif", "ref.tif"))
+    assert not os.path.exists(meta_datam.filepath)
+
+    meta_datam.add_file_metadata(FileMetadata("c.tif", "ref.tif"))
+    assert sorted(read_metadata(tmp_path)) == ["a.tif", "b.tif", "c.tif"]
+
+    meta_datam.add_file_metadata(FileMetadata("d.tif", "ref.tif"))
+    meta_datam.flush()
+    assert sorted(read_metadata(tmp_path)) == ["a.tif", "b.tif", "c.tif", "d.tif"]
+
+
+def test_metadata_flush_on_context_exit(tmp_path):
+    """Pending entries are saved when leaving the context, even after an error."""
+    with pytest.raises(RuntimeError):
+        with MetadataManager(folder=str(tmp_path), batch_size=100) as meta_datam:
+            meta_datam.add_file_metadata(FileMetadata("a.tif", "ref.tif"))
+            raise RuntimeError("crash in the middle of a sweep")
+    assert list(read_metadata(tmp_path)) == ["a.tif"]
+    assert os.listdir(tmp_path) == ["metadata.json"]  # no temporary file left
+
+
+def test_metadata_default_writes_each_entry(tmp_path):
+    """Standalone scripts keep writing metadata.json at each new entry."""
+    meta_datam = MetadataManager(folder=str(tmp_path))
+    meta_datam.add_file_metadata(FileMetadata("a.tif", "ref.tif"))
+    assert list(read_metadata(tmp_path)) == ["a.tif"]
+    with pytest.raises(ValueError):
+        meta_datam.add_file_metadata(FileMetadata("a.tif", "ref.tif"))
+
+
+def test_metadata_cache_hit_and_eviction(tmp_path):
+    """A result is reused only with the same key, and evicted when stale."""
+    (tmp_path / "a.tif").write_bytes(b"")
+    cache = make_cache_entry("ref_digest", "transform", {"xyz": [1, 0, 0]})
+    metad = FileMetadata("a.tif", "/somewhere/ref.tif")
+    metad.cache = cache
+    meta_datam = MetadataManager(folder=str(tmp_path))
+    meta_datam.add_file_metadata(metad)
+
+    assert meta_datam.is_cached("a.tif", cache)
+    other = make_cache_entry("ref_digest", "transform", {"xyz": [2, 0, 0]})
+    assert not meta_datam.is_cached("a.tif", other)
+
+    assert meta_datam.evict_stale({"ref.tif": "ref_digest"}) == []
+    assert meta_datam.evict_stale({"ref.tif": "new_digest"}) == ["a.tif"]
+    assert not (tmp_path / "a.tif").exists()
+    assert not meta_datam.is_cached("a.tif", cache)
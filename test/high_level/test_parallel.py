@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from registest.core import parallel
+from registest.core.parallel import Prefetcher, WriteBehind, run_jobs
+
+
+def test_prefetcher_keeps_order():
+    items = list(range(10))
+    loaded = list(Prefetcher(items, lambda item: np.full(4, item), depth=3))
+    assert [item for item, _ in loaded] == items
+    assert all((data == item).all() for item, data in loaded)
+
+
+def test_prefetcher_raises_load_error_at_its_item():
+    def load(item):
+        if item == 2:
+            raise OSError("unreadable")
+        return item
+
+    seen = []
+    with pytest.raises(OSError, match="unreadable"):
+        for item, _ in Prefetcher(range(5), load):
+            seen.append(item)
+    assert seen == [0, 1]
+
+
+def test_prefetcher_memory_cap():
+    loads = []
+
+    def load(item):
+        loads.append(item)
+        return np.zeros(100, dtype=np.uint8)
+
+    for item, _ in Prefetcher(range(6), load, depth=4, max_bytes=100):
+        # One item fits the cap: at most one is read ahead
+        assert len(loads) <= item + 2
+
+
+def test_write_behind_runs_in_order():
+    done = []
+    with WriteBehind(max_pending=2) as writer:
+        for index in range(6):
+            writer.submit(done.append, index, nbytes=10)
+    assert done == list(range(6))
+
+
+def test_write_behind_error_stops_the_caller():
+    def fail():
+        raise OSError("disk full")
+
+    release = threading.Event()
+    with pytest.raises(OSError, match="disk full"):
+        with WriteBehind(max_pending=1) as writer:
+            writer.submit(fail)
+            # Waits for the failed task, then raises its error
+            writer.submit(release.set)
+    assert not release.is_set()
+
+    with pytest.raises(OSError, match="disk full"):
+        writer = WriteBehind()
+        writer.submit(fail)
+        writer.close()
+
+
+def shared_sum(ref_data, index):
+    """Job reading the shared reference, with the name of its memory block."""
+    shms = parallel._SHARED_REF[0] if parallel._SHARED_REF else []
+    return float(ref_data[index].sum()), [shm.name for shm in shms]
+
+
+def dict_sum(ref_data, index):
+    return shared_sum(ref_data["image"], index)
+
+
+@pytest.mark.parametrize("ref_type", [np.ndarray, dict])
+def test_run_jobs_workers_share_the_reference(ref_type):
+    """Jobs in worker processes see the reference, released afterwards."""
+    reference = np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+    jobs = [{"index": index} for index in range(4)]
+    ref_data = reference if ref_type is np.ndarray else {"image": reference}
+    func = shared_sum if ref_type is np.ndarray else dict_sum
+
+    serial = list(run_jobs(func, ref_data, jobs, workers=1))
+    pooled = list(run_jobs(func, ref_data, jobs, workers=2))
+    assert [value for value, _ in pooled] == [value for value, _ in serial]
+    names = {name for _, shm_names in pooled for name in shm_names}
+    assert names  # the workers attached shared memory
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+
+import pytest
+import tifffile
+
+from registest.config.parameters import Parameters
+from registest.core.data_manager import DataManager
+from registest.core.pipeline import Pipeline
+from registest.modules.generator import generate_volume
+
+PARAMETERS = {
+    "transform": [{"xyz": [2, -3, 1]}, {"xyz": [1.5, 0, 0]}],
+    "register": [{"method": "global_pyhim"}, {"method": "pyramid_pyhim"}],
+    "compare": [{"preview_slices": 2, "results_format": "csv"}],
+}
+
+
+def make_folder(folder, parameters=PARAMETERS):
+    folder.mkdir()
+    volume = generate_volume((12, 64, 64), n_spots=15, rng=0, psf_shape=(6, 12, 12))
+    tifffile.imwrite(folder / "ref.tif", volume)
+    (folder / "parameters.json").write_text(json.dumps(parameters))
+
+
+def run_pipeline(folder, parameters=PARAMETERS, **kwargs):
+    make_folder(folder, parameters)
+    datam = DataManager(str(folder))
+    params = Parameters(str(folder / "parameters.json"))
+    Pipeline(datam, params, "transform,register,compare", **kwargs).run()
+    lines = (folder / "similarity" / "similarity_report.csv").read_text().splitlines()
+    # Same rows, without the target folder and the measured times
+    return sorted(line.split(",", 2)[2].rsplit(",", 2)[0] for line in lines[1:])
+
+
+@pytest.mark.parametrize("save_intermediate", [False, True])
+def test_fused_pipeline_matches_stages(tmp_path, save_intermediate):
+    staged = run_pipeline(tmp_path / "staged")
+    fused = run_pipeline(
+        tmp_path / "fused", fused=True, save_intermediate=save_intermediate
+    )
+    assert len(fused) == 4 and fused == staged
+    shifted = sorted(path.name for path in (tmp_path / "fused" / "shifted").iterdir())
+    if save_intermediate:
+        assert shifted == sorted(
+            path.name for path in (tmp_path / "staged" / "shifted").iterdir()
+        )
+    else:
+        assert shifted == []
+    assert len(list((tmp_path / "fused" / "similarity").glob("*_2d.png"))) == 4
+
+
+def test_prefetch_pipeline_matches_no_prefetch(tmp_path):
+    assert run_pipeline(tmp_path / "prefetch") == run_pipeline(
+        tmp_path / "serial", prefetch=0
+    )
+
+
+@pytest.mark.parametrize("kwargs", [{"register_threads": 2}, {"workers": 2}])
+def test_register_per_target_matches_serial(tmp_path, kwargs):
+    assert run_pipeline(tmp_path / "grouped", **kwargs) == run_pipeline(
+        tmp_path / "serial", prefetch=0
+    )
+
+
+def test_zarr_workers_match_serial(tmp_path):
+    """Pool workers read the Zarr volumes with the storage of the run."""
+    pytest.importorskip("zarr")
+    parameters = dict(PARAMETERS, storage={"backend": "zarr", "chunk_planes": 4})
+    assert run_pipeline(tmp_path / "pool", parameters, workers=2) == run_pipeline(
+        tmp_path / "serial", parameters
+    )
+
+
+def test_rerun_report_is_incremental(tmp_path):
+    """A re-run adds the rows of the new comparisons, cached ones are kept once."""
+    import fitz
+
+    folder = tmp_path / "rerun"
+    assert len(run_pipeline(folder)) == 4
+    parameters = dict(
+        PARAMETERS, transform=PARAMETERS["transform"] + [{"xyz": [0, 2, 0]}]
+    )
+    (folder / "parameters.json").write_text(json.dumps(parameters))
+    datam = DataManager(str(folder))
+    params = Parameters(str(folder / "parameters.json"))
+    Pipeline(datam, params, "transform,register,compare").run()
+
+    similarity = folder / "similarity"
+    lines = (similarity / "similarity_report.csv").read_text().splitlines()[1:]
+    targets = [line.split(",")[1] for line in lines]
+    assert len(targets) == 6 and len(set(targets)) == 6
+    with fitz.open(similarity / "similarity_report.pdf") as pdf:
+        assert pdf.page_count == 6
+    assert len(list(similarity.glob("*_preview.png"))) == 6
+
+    # A new reference content makes every comparison stale: its files go too
+    volume = generate_volume((12, 64, 64), n_spots=15, rng=1, psf_shape=(6, 12, 12))
+    tifffile.imwrite(folder / "ref.tif", volume)
+    DataManager(str(folder)).evict_stale_results()
+    assert not list(similarity.glob("*_2d.png"))
+    assert not list(similarity.glob("*_preview.png"))
+
+
+def test_registest_html_option(tmp_path, monkeypatch):
+    """`registest --html` saves the HTML overlays, off in the `compare` section."""
+    from registest.run_registest import run
+
+    folder = tmp_path / "html"
+    make_folder(folder)
+    parameters = folder / "parameters.json"
+    argv = ["registest", "-F", str(folder), "-P", str(parameters)]
+    monkeypatch.setattr(sys, "argv", argv + ["-C", "transform,compare", "--html"])
+    run()
+    similarity = folder / "similarity"
+    targets = [path.name[: -len("_2d.png")] for path in similarity.glob("*_2d.png")]
+    assert len(targets) == 2
+    assert sorted(path.name for path in similarity.glob("*.html")) == sorted(
+        f"{target}.html" for target in targets
+    )
+
+
+def test_failed_compare_keeps_report_consistent(tmp_path, monkeypatch):
+    """After a compare failing on its 3rd target and a re-run, results agree."""
+    import fitz
+
+    from registest.core import pipeline
+
+    compare_image = pipeline.compare_image
+    calls = []
+
+    def failing_compare(*args, **kwargs):
+        calls.append(args[2])
+        if len(calls) == 3:
+            raise RuntimeError("comparison failed")
+        return compare_image(*args, **kwargs)
+
+    folder = tmp_path / "failed"
+    monkeypatch.setattr(pipeline, "compare_image", failing_compare)
+    with pytest.raises(RuntimeError):
+        run_pipeline(folder)
+    monkeypatch.setattr(pipeline, "compare_image", compare_image)
+    datam = DataManager(str(folder))
+    params = Parameters(str(folder / "parameters.json"))
+    Pipeline(datam, params, "transform,register,compare").run()
+
+    similarity = folder / "similarity"
+    rows = (similarity / "similarity_report.csv").read_text().splitlines()[1:]
+    with fitz.open(similarity / "similarity_report.pdf") as pdf:
+        pages = pdf.page_count
+    entries = json.loads((similarity / "metadata.json").read_text())
+    assert len(rows) == pages == len(entries) == 4
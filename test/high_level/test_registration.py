@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from registest.modules.generator import generate_volume
+from registest.modules.registration import (
+    ReferenceSpectrum,
+    Register,
+    TargetProducts,
+    build_pyramid,
+    phase_cross_correlation_wrapper,
+)
+from registest.modules.transformation import shift_3d_array
+
+
+@pytest.fixture(scope="module")
+def volume():
+    return generate_volume((20, 256, 320), n_spots=80, rng=3, psf_shape=(10, 24, 24))
+
+
+@pytest.mark.parametrize("zxy", [[2, -7, 13], [0.5, 3.3, -2.7]])
+def test_reference_spectrum_matches_wrapper(volume, zxy):
+    """Reusing the reference spectrum gives the shifts of phase_cross_correlation."""
+    target = shift_3d_array(volume, zxy)[0]
+    spectrum = ReferenceSpectrum(volume)
+    np.testing.assert_array_equal(
+        spectrum.find_shift(target), phase_cross_correlation_wrapper(volume, target)
+    )
+
+
+def test_reference_spectrum_batch(volume):
+    """A batch of targets gets the same shifts as one call per target."""
+    targets = [shift_3d_array(volume, zxy)[0] for zxy in [[1, 2, -3], [0, -4.5, 2]]]
+    spectrum = ReferenceSpectrum(volume)
+    batch = spectrum.find_shifts(targets)
+    assert len(batch) == 2
+    for shift, target in zip(batch, targets):
+        np.testing.assert_array_equal(shift, spectrum.find_shift(target))
+
+
+def test_read_only_reference_is_not_checksummed(volume, monkeypatch):
+    """References loaded read-only are never read again to check them."""
+    from registest.modules import registration
+
+    reference = volume.copy()
+    reference.flags.writeable = False
+    target = shift_3d_array(volume, [0, 2, 1])[0]
+    calls = []
+    monkeypatch.setattr(
+        registration, "array_checksum", lambda array: calls.append(1) or 0
+    )
+    reg_mod = Register("global_pyhim")
+    for _ in range(3):
+        reg_mod.execute(reference, target)
+    assert not calls
+
+
+def test_finder_rebuilt_after_in_place_change(volume):
+    """A reference modified in place does not reuse its stale spectrum."""
+    reference = volume.copy()
+    target = shift_3d_array(reference, [0, 4, -3])[0]
+    reg_mod = Register("global_pyhim")
+    reg_mod.execute(reference, target)
+    finder = reg_mod.finder
+    assert finder.matches(reference)
+    reference[...] = shift_3d_array(volume, [0, 4, -3])[0]
+    assert not finder.matches(reference)
+    reg_mod.execute(reference, target)
+    assert reg_mod.finder is not finder
+    np.testing.assert_allclose(reg_mod.zxy_shift, [0, 0, 0], atol=0.05)
+
+
+def test_build_pyramid_levels(volume):
+    levels = build_pyramid(volume, min_size=(16, 64, 64))
+    assert levels[0][0] is volume
+    assert [factors for _, factors in levels] == [(1, 1, 1), (1, 2, 2), (1, 4, 4)]
+    assert levels[-1][0].shape == (20, 64, 80)
+
+
+@pytest.mark.parametrize("zxy", [[2, -7, 13], [0.5, 3.3, -20.7], [-1, 30.25, 4]])
+def test_pyramid_recovers_shift(volume, zxy):
+    """Coarse-to-fine registration recovers subpixel shifts."""
+    target = shift_3d_array(volume, zxy)[0]
+    pyramid = Register("pyramid_pyhim")
+    pyramid.execute(volume, target)
+    np.testing.assert_allclose(pyramid.zxy_shift, np.negative(zxy), atol=0.15)
+    assert pyramid.get_finder(volume) is pyramid.finder  # built once
+
+
+def test_pyramid_single_level_is_subpixel():
+    """A volume too small for a coarser level still gets a subpixel shift."""
+    small = generate_volume((20, 96, 96), n_spots=20, rng=3, psf_shape=(10, 24, 24))
+    zxy = [0.5, 3.3, -2.7]
+    target = shift_3d_array(small, zxy)[0]
+    pyramid = Register("pyramid_pyhim")
+    pyramid.execute(small, target)
+    assert len(pyramid.finder.levels) == 1
+    np.testing.assert_allclose(pyramid.zxy_shift, np.negative(zxy), atol=0.15)
+
+
+@pytest.mark.parametrize("combine", ["median", "consensus"])
+def test_blocks_ignore_partial_drift(volume, tmp_path, combine):
+    """The global shift is recovered when one block of the field of view drifted."""
+    target = shift_3d_array(volume, [1, -4, 6])[0]
+    target[:, :128, :160] = shift_3d_array(volume, [0, 9, -12])[0][:, :128, :160]
+    reg_mod = Register(
+        "blocks_pyhim",
+        options={"block_size": 128, "combine": combine, "export_field": True},
+    )
+    reg_mod.execute(volume, target)
+    np.testing.assert_allclose(reg_mod.zxy_shift, [-1, 4, -6], atol=0.15)
+
+    reg_mod.save_field(str(tmp_path / "field.csv"))
+    field = np.loadtxt(tmp_path / "field.csv", delimiter=",", skiprows=1)
+    assert field.shape == (4, 8)  # 2x2 blocks of 128x160 pixels
+    assert field[0, -1] == 0 and field[1:, -1].all()  # the drifted block is an outlier
+    metad = reg_mod.generate_metadata("a.tif", "ref.tif")
+    assert metad.registration["block_field"] == "field.csv"
+    assert metad.registration["options"]["combine"] == combine
+
+
+@pytest.mark.parametrize("method", ["global_pyhim", "pyramid_pyhim", "global_sitk"])
+def test_export_field_needs_blocks(method):
+    with pytest.raises(ValueError, match="no block field"):
+        Register(method, options={"export_field": True})
+
+
+def test_sitk_options_and_report(volume):
+    """A fast SimpleITK setup recovers the shift and records its optimizer run."""
+    target = shift_3d_array(volume, [1, -3, 2.5])[0]
+    reg_mod = Register(
+        "global_sitk",
+        options={
+            "transform": "translation",
+            "sampling": "random",
+            "sampling_percentage": 0.1,
+            "shrink_factors": [2, 1],
+            "smoothing_sigmas": [1, 0],
+            "threads": 2,
+        },
+    )
+    reg_mod.execute(volume, target)
+    np.testing.assert_allclose(reg_mod.zxy_shift, [-1, 3, -2.5], atol=0.1)
+    registration = reg_mod.generate_metadata("a.tif", "ref.tif").registration
+    assert 0 < registration["iterations"] <= 100
+    assert registration["final_metric"] >= 0
+    assert registration["elapsed_time"] > 0
+    assert registration["options"]["sampling"] == "random"
+
+
+def test_target_products_shared_by_methods(volume):
+    """Methods registering one target reuse its products and find the same shifts."""
+    target = shift_3d_array(volume, [1, -4, 6])[0]
+    products = TargetProducts(target)
+    for method, options in [
+        ("global_pyhim", None),
+        ("global_pyhim", {"upsample_factor": 10}),
+        ("pyramid_pyhim", None),
+        ("global_sitk", {"transform": "translation", "shrink_factors": [2]}),
+    ]:
+        shared, alone = Register(method, options=options), Register(
+            method, options=options
+        )
+        shared.execute(volume, target, products=products)
+        alone.execute(volume, target)
+        np.testing.assert_allclose(shared.zxy_shift, alone.zxy_shift)
+    assert set(products.products) == {
+        "fftn",
+        ("pyramid", (16, 64, 64), 4),
+        "float32",
+        "sitk_float32",
+    }
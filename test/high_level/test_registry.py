@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+
+import numpy as np
+import pytest
+
+from registest.core import registry
+from registest.modules.registration import REGISTRATION_METHODS, Register
+
+PLUGIN_MODULE = """
+from registest.core.registry import MethodSpec
+
+
+class ZeroShift:
+    def __init__(self, ref_3d, value=0.0):
+        self.ref = ref_3d
+        self.value = value
+        self.report = {"plugin": True}
+
+    def matches(self, ref_3d):
+        return ref_3d is self.ref
+
+    def find_shift(self, target_3d):
+        return [self.value] * 3
+
+
+# Minimal registration: only `find_shift`
+class FixedShift:
+    def __init__(self, ref_3d):
+        pass
+
+    def find_shift(self, target_3d):
+        return [0.0, 1.0, 0.0]
+
+
+FIXED_SHIFT = MethodSpec("registration", "fixed_shift", "registest_test_plugin:FixedShift")
+
+ZERO_SHIFT = MethodSpec(
+    "registration",
+    "zero_shift",
+    "registest_test_plugin:ZeroShift",
+    capabilities=["translation"],
+    cost={"memory": 0, "time": 0.0},
+)
+"""
+
+
+@pytest.fixture
+def plugin(tmp_path, monkeypatch):
+    """Install a plugin package declaring a registration entry point."""
+    (tmp_path / "registest_test_plugin.py").write_text(PLUGIN_MODULE)
+    dist_info = tmp_path / "registest_test_plugin-0.1.dist-info"
+    dist_info.mkdir()
+    (dist_info / "METADATA").write_text(
+        "Metadata-Version: 2.1\nName: registest-test-plugin\nVersion: 0.1\n"
+    )
+    (dist_info / "entry_points.txt").write_text(
+        "[registest.registration]\nzero_shift = registest_test_plugin:ZERO_SHIFT\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(
+        registry, "_METHODS", {k: dict(v) for k, v in registry._METHODS.items()}
+    )
+    monkeypatch.setattr(registry, "_ENTRY_POINTS_LOADED", False)
+    yield
+    sys.modules.pop("registest_test_plugin", None)
+
+
+def test_builtin_methods():
+    assert registry.list_methods("registration")[: len(REGISTRATION_METHODS)] == (
+        REGISTRATION_METHODS
+    )
+    spec = registry.get_method("registration", "global_sitk")
+    assert spec.has("affine") and spec.cost["time"] > 1
+    assert registry.get_method("transform", "scipy").has("prefilter")
+    with pytest.raises(NotImplementedError):
+        registry.get_method("metric", "unknown")
+
+
+def test_plugin_method_is_loaded_lazily(plugin):
+    assert "zero_shift" in registry.list_methods("registration")
+    assert "registest_test_plugin" in sys.modules  # the spec, not the method
+    spec = registry.get_method("registration", "zero_shift")
+    assert spec._loaded is None
+
+    volume = np.arange(4 * 8 * 8, dtype=np.uint16).reshape(4, 8, 8)
+    reg_mod = Register("zero_shift", options={"value": 1.0})
+    registered = reg_mod.execute(volume, volume)
+    assert reg_mod.xyz_shift == [1.0, 1.0, 1.0]
+    np.testing.assert_array_equal(registered[1:, 1:, 1:], volume[:-1, :-1, :-1])
+    assert reg_mod.generate_metadata("a.tif", "ref.tif").registration["plugin"]
+
+
+def test_minimal_plugin_method(plugin):
+    """A registration class with only `find_shift` can be used."""
+    import registest_test_plugin
+
+    registry.register_method(registest_test_plugin.FIXED_SHIFT)
+    volume = np.arange(4 * 8 * 8, dtype=np.uint16).reshape(4, 8, 8)
+    reg_mod = Register("fixed_shift")
+    for _ in range(2):
+        reg_mod.execute(volume, volume)
+    assert reg_mod.xyz_shift == [1.0, 0.0, 0.0]
+    registration = reg_mod.generate_metadata("a.tif", "ref.tif").registration
+    assert registration["method"] == "fixed_shift"
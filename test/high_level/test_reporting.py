@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import os
+
+import pytest
+
+from registest.modules.comparison import PdfReport
+from registest.modules.reporting import RESULT_COLUMNS, ResultsWriter, load_results
+
+
+def test_results_writer_csv_batches(tmp_path):
+    """Rows are written by batches, and the remaining ones on exit."""
+    path_base = os.path.join(tmp_path, "similarity_report")
+    with ResultsWriter(path_base, fmt="csv", batch_size=2) as writer:
+        for i in range(3):
+            writer.add({"target": f"t{i}.tif", "method": "global_pyhim", "SSIM": i})
+            if i == 1:
+                assert len(load_results(writer.path)) == 2
+    results = load_results(writer.path)
+    assert list(results.columns) == list(RESULT_COLUMNS)
+    assert list(results["SSIM"]) == [0.0, 1.0, 2.0]
+
+
+def test_results_writer_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        ResultsWriter(os.path.join(tmp_path, "report"), fmt="xlsx")
+
+
+def test_results_writer_default_format(tmp_path):
+    """Parquet when pyarrow is installed, CSV otherwise."""
+    has_pyarrow = importlib.util.find_spec("pyarrow") is not None
+    writer = ResultsWriter(os.path.join(tmp_path, "report"))
+    assert writer.format == ("parquet" if has_pyarrow else "csv")
+
+
+def test_results_writer_csv_other_columns(tmp_path):
+    """Rows are not appended to a CSV file with other columns."""
+    path_base = os.path.join(tmp_path, "similarity_report")
+    with open(f"{path_base}.csv", "w") as file:
+        file.write("reference,target,SSIM\nref.tif,t0.tif,0.5\n")
+    with ResultsWriter(path_base, fmt="csv") as writer:
+        writer.add({"target": "t1.tif", "SSIM": 0.9})
+    results = load_results(writer.path)
+    assert list(results.columns) == list(RESULT_COLUMNS)
+    assert list(results["target"]) == ["t1.tif"]
+    (old_path,) = [name for name in os.listdir(tmp_path) if "_old-" in name]
+    assert load_results(os.path.join(tmp_path, old_path))["SSIM"].tolist() == [0.5]
+
+
+@pytest.fixture
+def overlay_png(tmp_path):
+    from PIL import Image
+
+    path = os.path.join(tmp_path, "overlay_2d.png")
+    Image.new("RGB", (64, 48), (255, 0, 0)).save(path)
+    return path
+
+
+def add_report_page(pdf_report, png_path):
+    pdf_report.add_page(png_path, "ref.tif", "t.tif", [0, 0, 0], [0, 0, 0], 0.9, 0.1)
+
+
+def page_count(path):
+    import fitz
+
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def test_pdf_report_appends_pages(tmp_path, overlay_png):
+    pdf_path = os.path.join(tmp_path, "similarity_report.pdf")
+    with PdfReport(pdf_path) as pdf_report:
+        add_report_page(pdf_report, overlay_png)
+    assert page_count(pdf_path) == 1
+    with PdfReport(pdf_path) as pdf_report:
+        add_report_page(pdf_report, overlay_png)
+        add_report_page(pdf_report, overlay_png)
+    assert page_count(pdf_path) == 3
+
+
+def test_pdf_report_atomic_replace(tmp_path, overlay_png, monkeypatch):
+    """The report is written to a temporary file, then renamed over the old one."""
+    pdf_path = os.path.join(tmp_path, "similarity_report.pdf")
+    with PdfReport(pdf_path) as pdf_report:
+        add_report_page(pdf_report, overlay_png)
+    before = os.path.getmtime(pdf_path), os.path.getsize(pdf_path)
+
+    # No new page: the report is not rewritten
+    with PdfReport(pdf_path):
+        pass
+    assert (os.path.getmtime(pdf_path), os.path.getsize(pdf_path)) == before
+
+    replaced = []
+    real_replace = os.replace
+    monkeypatch.setattr(
+        "registest.modules.comparison.os.replace",
+        lambda src, dst: replaced.append((src, dst)) or real_replace(src, dst),
+    )
+    with PdfReport(pdf_path) as pdf_report:
+        add_report_page(pdf_report, overlay_png)
+    ((temp_path, final_path),) = replaced
+    assert final_path == pdf_path and temp_path.endswith(".tmp")
+    assert set(os.listdir(tmp_path)) == {"overlay_2d.png", "similarity_report.pdf"}
+    assert page_count(pdf_path) == 2
+
+
+def test_pdf_report_keeps_pages_on_error(tmp_path, overlay_png):
+    """Pages added before an error are saved, like the similarity results."""
+    pdf_path = os.path.join(tmp_path, "similarity_report.pdf")
+    with pytest.raises(RuntimeError):
+        with PdfReport(pdf_path) as pdf_report:
+            add_report_page(pdf_report, overlay_png)
+            raise RuntimeError("comparison failed")
+    assert page_count(pdf_path) == 1
@@ -7,7 +7,11 @@ from unittest.mock import patch
 
 import pytest
 
-from registest.core.run_args import parse_run_args
+from registest.core.run_args import (
+    parse_compare_args,
+    parse_pipeline_args,
+    parse_run_args,
+)
 
 
 # No arg
@@ -164,3 +168,39 @@ def test_parse_run_args_command(cli_args, expected_method):
     with patch.object(sys, "argv", ["registest"] + cli_args):
         args = parse_run_args()
         assert args.command == expected_method
+
+
+# workers arg
+@pytest.mark.parametrize(
+    "cli_args, expected_workers",
+    [
+        (["-W", "8"], 8),
+        (["--workers", "2"], 2),
+        ([], 1),  # No argument should result in serial execution
+    ],
+)
+def test_parse_run_args_workers(cli_args, expected_workers):
+    """Test parsing of -W/--workers command-line argument."""
+    with patch.object(sys, "argv", ["registest"] + cli_args):
+        args = parse_pipeline_args()
+        assert args.workers == expected_workers
+
+
+# pipeline options are only known by registest
+@pytest.mark.parametrize("option", ["--workers", "--prefetch", "--io-memory", "--html"])
+def test_parse_run_args_rejects_pipeline_options(option):
+    """Test the stage scripts reject the options of the pipeline."""
+    with patch.object(sys, "argv", ["regis_register", option, "2"]):
+        with pytest.raises(SystemExit) as exc_info:
+            parse_run_args()
+    assert exc_info.value.code != 0
+
+
+# html arg, only known by registest and regis_compare
+@pytest.mark.parametrize("parse_args", [parse_pipeline_args, parse_compare_args])
+@pytest.mark.parametrize("cli_args, expected_html", [(["--html"], True), ([], False)])
+def test_parse_html(parse_args, cli_args, expected_html):
+    """Test parsing of the --html command-line argument."""
+    with patch.object(sys, "argv", ["registest"] + cli_args):
+        args = parse_args()
+        assert args.html == expected_html
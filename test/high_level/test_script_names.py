@@ -3,7 +3,14 @@ import subprocess
 import pytest
 
 # List of script names to test
-SCRIPT_NAMES = ["registest", "regis_transform", "regis_register", "regis_compare"]
+SCRIPT_NAMES = [
+    "registest",
+    "regis_transform",
+    "regis_register",
+    "regis_compare",
+    "regis_bench",
+    "regis_generate",
+]
 
 
 @pytest.mark.parametrize("script_name", SCRIPT_NAMES)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import importlib
+
+import numpy as np
+import pytest
+from skimage.metrics import structural_similarity
+
+from registest.utils.kernels import calculate_normalized_mse, normalize_image
+from registest.utils.metrics import streaming_similarity
+
+
+@pytest.fixture
+def image_pair():
+    rng = np.random.default_rng(0)
+    image1 = rng.random((20, 40, 50))
+    image2 = np.clip(image1 + rng.normal(0, 0.1, image1.shape), 0, 1)
+    return image1, image2
+
+
+@pytest.mark.parametrize("max_memory", [2**30, 2**20, 400_000])
+def test_streaming_similarity_matches_full_volume(image_pair, max_memory):
+    """Block-wise SSIM and MSE are the same as the full-volume computation."""
+    image1, image2 = image_pair
+    ssim_value, mse_value = streaming_similarity(
+        image1, image2, data_range=1.0, max_memory=max_memory
+    )
+    assert ssim_value == pytest.approx(
+        structural_similarity(image1, image2, data_range=1.0), abs=1e-12
+    )
+    assert mse_value == pytest.approx(np.mean((image1 - image2) ** 2), abs=1e-12)
+
+
+def test_streaming_similarity_shape_mismatch(image_pair):
+    image1, image2 = image_pair
+    with pytest.raises(ValueError):
+        streaming_similarity(image1, image2[:-1])
+
+
+def test_normalize_image_float32():
+    """Normalization runs in float32 and matches the float64 formula."""
+    image = np.arange(2 * 3 * 4, dtype=np.uint16).reshape(2, 3, 4) * 100
+    normalized = normalize_image(image)
+    expected = (image - image.min()) / (image.max() - image.min())
+    assert normalized.dtype == np.float32
+    np.testing.assert_allclose(normalized, expected, rtol=1e-6)
+
+
+def test_calculate_normalized_mse_non_contiguous(image_pair):
+    """The chunked MSE also works on strided views."""
+    image1, image2 = image_pair
+    view1, view2 = image1[:, ::2], image2[:, ::2]
+    assert calculate_normalized_mse(view1, view2) == pytest.approx(
+        np.mean((view1 - view2) ** 2), abs=1e-12
+    )
+
+
+@pytest.mark.parametrize(
+    "module", ["registest.modules.comparison", "registest.modules.reporting"]
+)
+def test_calculate_normalized_mse_old_imports(module):
+    """The kernel is still importable from the modules that defined it."""
+    assert importlib.import_module(module).calculate_normalized_mse is (
+        calculate_normalized_mse
+    )
+
+
+def test_normalize_image_strided_view(image_pair):
+    """A strided view is normalized into a new array, not left unnormalized."""
+    image = (image_pair[0] * 10).astype(np.float32)
+    view = image[:, ::2]
+    normalized = normalize_image(view, copy=False)
+    expected = (view - view.min()) / (view.max() - view.min())
+    np.testing.assert_allclose(normalized, expected, rtol=1e-5, atol=1e-6)
+    assert normalize_image(image, copy=False) is image  # contiguous: in place
+    assert image.max() == pytest.approx(1)
+
+
+class ChunkedArray:
+    """Lazy array read by chunks of planes, like a Zarr array (no `len`)."""
+
+    def __init__(self, array, planes):
+        self.array = array
+        self.shape, self.dtype = array.shape, array.dtype
+        self.chunks = (planes,) + array.shape[1:]
+        self.reads = []
+
+    def __getitem__(self, key):
+        self.reads.append(key)
+        return self.array[key]
+
+
+def test_normalize_image_chunked_array(image_pair):
+    """Lazy chunked arrays are read chunk by chunk, never all at once."""
+    image = image_pair[0]
+    lazy = ChunkedArray(image, planes=6)
+    normalized = normalize_image(lazy, copy=False)
+    np.testing.assert_allclose(normalized, normalize_image(image), rtol=1e-6)
+    # Two passes (min/max, then normalization) of 4 chunks of 6 planes
+    assert len(lazy.reads) == 8
+    assert all(key.stop - key.start <= 6 for key in lazy.reads)
+
+
+def test_overlay_projection_matches_full_overlay(image_pair):
+    """The one-pass max projection is the max of the full normalized overlay."""
+    from registest.utils.visualization import enhance_contrast, visu_rgb_2d
+
+    image1, image2 = (image.astype(np.float32) for image in image_pair)
+    overlay = np.stack(
+        [
+            enhance_contrast(image1),
+            enhance_contrast(image2),
+            enhance_contrast(np.minimum(image1, image2)),
+        ],
+        axis=-1,
+    ).max(axis=0)
+    assert np.array_equal(visu_rgb_2d(image1, image2), (overlay * 255).astype(np.uint8))
+
+
+def test_visu_overlay_preview(image_pair, tmp_path):
+    from PIL import Image
+
+    from registest.utils.visualization import visu_overlay
+
+    base = str(tmp_path / "target")
+    project = visu_overlay(*image_pair, base, n_slices=4)
+    assert project.dtype == np.uint8 and project.shape == (40, 50, 3)
+    with Image.open(base + "_preview.png") as preview:
+        # 2x3 grid of 50 px tiles (XY projection + 4 slices), XZ and YZ strips
+        assert preview.mode == "RGB"
+        assert preview.size == (3 * 52 - 2, 2 * 42 + 2 * 22 - 2)
+    assert not (tmp_path / "target.html").exists()
+
+
+def test_overlay_shared_reference(image_pair):
+    """Overlays built on a shared reference are the same as standalone ones."""
+    from registest.utils.visualization import OverlaySummary, ReferenceOverlay
+
+    image1, image2 = (image.astype(np.float32) for image in image_pair)
+    reference = ReferenceOverlay(image1)
+    for target in [image2, image2[::-1].copy()]:
+        shared = OverlaySummary(image1, target, [0, 7], reference=reference)
+        alone = OverlaySummary(image1, target, [0, 7])
+        assert shared.ranges == alone.ranges
+        for name in ["xy", "xz", "yz"]:
+            assert np.array_equal(shared.projection(name), alone.projection(name))
+        assert np.array_equal(shared.slice(7), alone.slice(7))
+
+
+def test_overlay_reference_of_another_image(image_pair):
+    """Overlay products of one reference are not reused for another one."""
+    from registest.core.pipeline import COMPARE_CACHE, reference_overlay
+    from registest.utils.visualization import OverlaySummary, ReferenceOverlay
+
+    image1, image2 = (image.astype(np.float32) for image in image_pair)
+    stale = ReferenceOverlay(image1)
+    summary = OverlaySummary(image2, image1, reference=stale)
+    alone = OverlaySummary(image2, image1)
+    assert np.array_equal(summary.projection("xy"), alone.projection("xy"))
+
+    try:
+        first = reference_overlay(image1)
+        assert reference_overlay(image1) is first
+        assert reference_overlay(image2).matches(image2)
+    finally:
+        COMPARE_CACHE.clear()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter, shift
+
+from registest.modules.generator import generate_volume
+from registest.modules.transformation import (
+    Transform,
+    shift_3d_array,
+    spline_coefficients,
+)
+
+
+@pytest.fixture(scope="module")
+def volume():
+    return generate_volume((16, 48, 48), n_spots=20, rng=0, psf_shape=(8, 16, 16))
+
+
+def test_integer_shift_matches_spline(volume):
+    """Whole-pixel shifts take the slicing path with the same result as scipy."""
+    for zxy in ([2, -3, 1], [0, 0, 0], [-20, 0, 0]):
+        shifted, path = shift_3d_array(volume, zxy)
+        assert path == "integer"
+        assert shifted.dtype == volume.dtype
+        np.testing.assert_array_equal(
+            shifted, shift(volume, zxy, mode="constant", cval=0.0)
+        )
+
+
+def test_subpixel_shift_paths(volume):
+    """Subpixel shifts use the spline of the requested order, or the FFT."""
+    zxy = [0.5, -1.25, 2.75]
+    shifted, path = shift_3d_array(volume, zxy)
+    assert path == "spline3"
+    np.testing.assert_array_equal(
+        shifted, shift(volume, zxy, mode="constant", cval=0.0)
+    )
+    assert shift_3d_array(volume, zxy, order=1)[1] == "spline1"
+
+    shifted, path = shift_3d_array(volume, zxy, mode="fft")
+    assert path == "fft"
+    assert shifted.dtype == volume.dtype
+    assert np.all(shifted[0] == 0) and np.all(shifted[:, -2:] == 0)
+    np.testing.assert_array_equal(
+        shift_3d_array(volume, [2, -3, 1], mode="fft")[0],
+        shift_3d_array(volume, [2, -3, 1])[0],
+    )
+    # Away from the borders, both interpolations agree on a smooth image
+    smooth = gaussian_filter(np.random.default_rng(0).random(volume.shape), 2)
+    inner = (slice(3, -3), slice(4, -4), slice(5, -5))
+    error = shift_3d_array(smooth, zxy, mode="fft")[0] - shift(smooth, zxy)
+    assert np.abs(error[inner]).max() < 0.1 * np.ptp(smooth)
+
+    with pytest.raises(ValueError):
+        shift_3d_array(volume, zxy, mode="integer")
+
+
+def test_shift_from_spline_coefficients(volume):
+    """One prefilter serves every cubic spline shift, with identical results."""
+    coefficients = spline_coefficients(volume)
+    for xyz in ([0.5, 0, 0], [0, 17.1, 15.0], [-2.2, 1, 0.3]):
+        transform_mod = Transform(xyz_shifts=xyz)
+        expected = transform_mod.execute(volume)
+        shifted = transform_mod.execute(coefficients, prefiltered=True, dtype="<u2")
+        assert shifted.dtype == volume.dtype
+        np.testing.assert_array_equal(shifted, expected)
+    with pytest.raises(ValueError):
+        Transform(xyz_shifts=[1, 0, 0]).execute(coefficients, prefiltered=True)
+
+
+def test_transform_records_interpolation_path(volume):
+    transform_mod = Transform(xyz_shifts=[1, 2, 3], filling_value="nan")
+    shifted = transform_mod.execute(volume)
+    assert transform_mod.shift_path == "integer"
+    assert shifted[:3].max() == 0  # NaN filling becomes 0 for integer images
+    metad = transform_mod.generate_metadata("a.tif", "ref.tif")
+    assert metad.transformation["interpolation"] == "integer"